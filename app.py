@@ -1,12 +1,25 @@
 import gevent
 from gevent import monkey
 monkey.patch_all() 
+# gevent's select module has no epoll (it can't make it cooperative), so patch_all()
+# (here, and gunicorn's gevent worker before it loads the app) removes select.epoll.
+# trio, which streamlink.stream imports for its ffmpeg muxer, picks its I/O backend
+# at import time and fails with AttributeError on select.epoll without it, taking
+# streaming.py down with it. We never run a trio event loop (streams are read by
+# Streamlink's threads, which are greenlets here), so the original is put back.
+import select
+if not hasattr(select, 'epoll'):
+    try:
+        select.epoll = monkey.get_original('select', 'epoll')
+    except AttributeError:
+        pass # No epoll on this platform, trio falls back to kqueue/IOCP
 
-from flask import Flask
+from flask import Flask, g, has_request_context
 import logging
-import sys
 import os
 import sqlite3
+from utils.logs import setup_logging
+from utils.crypto import DEFAULT_SECRET_KEY
 
 # --- Helper function (boot time only) ---
 def get_startup_log_level():
@@ -29,6 +42,12 @@ def get_startup_log_level():
     print(f"[Boot] Setting log level to '{level_str}'.")
     return logging.ERROR if level_str == 'error' else logging.INFO
 
+def get_log_context():
+    """Fields added to every log record of a request (set by the play endpoints)."""
+    if not has_request_context():
+        return {}
+    return {'channel': g.get('log_channel')}
+
 # --- Main App ---
 def create_app():
     app = Flask(__name__)
@@ -36,44 +55,29 @@ def create_app():
     # --- Logging Config (Dynamic) ---
     log_level = get_startup_log_level()
     
+    # All records (app, werkzeug, streamlink) go to the root logger and from there
+    # through a non-blocking queue to stdout, instance/app.log and the log ring
+    # shared with the pollers (admin log page), as JSON lines
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    log_path = os.path.join(base_dir, 'instance', 'app.log')
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    setup_logging('web', log_level, log_path, ring_path=os.path.join(base_dir, 'instance', 'logs.ring'),
+                  context=get_log_context)
     app.logger.setLevel(log_level)
-    
-    # 1. Stream Handler (Stdout)
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s [Flask] [%(filename)s:%(lineno)d] - %(message)s'
-    ))
-    app.logger.addHandler(stream_handler)
-    
-    # 2. File Handler (Rotating)
-    try:
-        from logging.handlers import RotatingFileHandler
-        # Ensure instance dir exists
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        log_path = os.path.join(base_dir, 'instance', 'app.log')
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        
-        file_handler = RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=1)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s [%(filename)s:%(lineno)d] - %(message)s'
-        ))
-        file_handler.setLevel(log_level)
-        app.logger.addHandler(file_handler)
-        app.logger.info(f"File logging enabled: {log_path}")
-    except Exception as e:
-        print(f"[Boot-Error] Failed to setup file logging: {e}")
+    app.logger.info(f"File logging enabled: {log_path}")
 
     app.logger.warning("-------------------------------------")
     app.logger.warning(f"Flask application starting... (Log Level: {logging.getLevelName(log_level)})")
     app.logger.warning("-------------------------------------")
 
     # --- Configuration ---
-    secret_key = os.environ.get('SECRET_KEY')
-    if not secret_key:
-        secret_key = 'default-dev-key-please-change'
-        app.logger.warning(
-            "[Config] SECRET_KEY is not set! Using an insecure default. "
-            "Set the SECRET_KEY environment variable in production (e.g. in Coolify)."
+    secret_key = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
+    if secret_key == DEFAULT_SECRET_KEY:
+        # Sessions, playback URLs and the Twitch secrets at rest are all keyed with it
+        app.logger.error(
+            "[Config] SECRET_KEY is not set! Using an insecure, public default: sessions and playback URLs "
+            "can be forged and stored Twitch secrets decrypted. Set the SECRET_KEY environment variable "
+            "in production (e.g. in Coolify)."
         )
     app.config['SECRET_KEY'] = secret_key
 
@@ -97,6 +101,10 @@ def create_app():
     from db import init_app
     init_app(app)
 
+    # Per-endpoint latency histograms (admin: /admin/timing, /admin/profile)
+    from utils import timing
+    timing.init_app(app)
+
     return app
 
 # This instance is used by Gunicorn
@@ -163,6 +163,7 @@ def check_web_ui_auth():
     public_paths = [
         '/health',
         '/static/',
+        '/images/',
         '/login',
         '/register',
         '/forgot-password',
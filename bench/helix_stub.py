@@ -0,0 +1,239 @@
+"""Local Twitch Helix stand-in for the poller benchmark (python3 poller.py --benchmark).
+
+Serves what the poller uses:
+
+    POST /oauth2/token     client-credentials tokens
+    GET  /helix/users      ?login=... (up to 100)
+    GET  /helix/streams    ?user_id=... (up to 100)
+    GET  /helix/videos     ?user_id=...&first=N
+    GET  /images/<name>    a small PNG (avatars and VOD thumbnails point here)
+    GET  /stats            requests per endpoint and status (POST /stats/reset clears them)
+
+Responses come from a fixture generator: every login exists, its ID is derived from
+the login, and the state moves on every --epoch-seconds: channels go live and
+offline in streaks (--live-ratio of them live at a time), titles and games change
+every few epochs, and each finished streak adds a VOD. Alternatively --fixture
+replays a recorded fixture, a JSON file {"users": [...], "streams": [...],
+"videos": {"<user_id>": [...]}} of Helix "data" objects.
+
+Every response is delayed by --latency-ms plus 0..--jitter-ms. --rate-limit
+enforces Helix's per-Client-ID token bucket (points per minute, 429 with
+Ratelimit-* headers when exhausted).
+
+    python3 bench/helix_stub.py --port 8891 --latency-ms 80 --jitter-ms 40 --rate-limit 800
+"""
+import argparse
+import base64
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from gevent.pywsgi import WSGIServer
+
+# 1x1 PNG
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+PAGE_LIMIT = 100
+LIVE_STREAK_EPOCHS = 5   # Channels change between live and offline at most this often
+TITLE_EPOCHS = 3         # A live channel's title changes every this many epochs
+GAME_EPOCHS = 10
+
+def fraction(*parts):
+    """Deterministic pseudo-random number in [0, 1) for the given parts."""
+    return zlib.crc32(':'.join(map(str, parts)).encode()) / 2**32
+
+def timestamp(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class GeneratedFixture:
+    def __init__(self, base_url, epoch_seconds=60, live_ratio=0.2, seed=1):
+        self.base_url = base_url
+        self.epoch_seconds = epoch_seconds
+        self.live_ratio = live_ratio
+        self.seed = seed
+        self.started = time.time()
+        # Key=user ID, Value=login (of the users looked up so far)
+        self.logins = {}
+
+    def epoch(self):
+        return int((time.time() - self.started) / self.epoch_seconds)
+
+    def streak(self, user_id, epoch):
+        # Streaks start at a per-channel offset, so not every channel changes in the same epoch
+        return (epoch + int(user_id) % LIVE_STREAK_EPOCHS) // LIVE_STREAK_EPOCHS
+
+    def is_live(self, user_id, streak):
+        return fraction(self.seed, user_id, 'live', streak) < self.live_ratio
+
+    def users(self, logins):
+        users = [{
+            'id': str(10**6 + zlib.crc32(login.encode()) % 10**9), 'login': login, 'display_name': login.title(),
+            'type': '', 'broadcaster_type': '', 'description': '',
+            'profile_image_url': f"{self.base_url}/images/avatar-{login}.png",
+            'offline_image_url': '', 'view_count': 0, 'created_at': '2020-01-01T00:00:00Z',
+        } for login in logins]
+        self.logins.update((user['id'], user['login']) for user in users)
+        return users
+
+    def streams(self, user_ids):
+        epoch = self.epoch()
+        data = []
+        for user_id in user_ids:
+            login = self.logins.get(user_id, f"user{user_id}")
+            streak = self.streak(user_id, epoch)
+            if not self.is_live(user_id, streak):
+                continue
+            streak_start = self.started + (streak * LIVE_STREAK_EPOCHS - int(user_id) % LIVE_STREAK_EPOCHS) * self.epoch_seconds
+            data.append({
+                'id': f"{user_id}{streak}", 'user_id': user_id, 'user_login': login, 'user_name': login.title(),
+                # Box art URLs are built from game_id on Twitch's CDN, which a benchmark doesn't reach
+                'game_id': '', 'game_name': f"Game {(int(user_id) + epoch // GAME_EPOCHS) % 300}",
+                'type': 'live', 'title': f"Stream {user_id}, part {epoch // TITLE_EPOCHS}",
+                'viewer_count': int(fraction(self.seed, user_id, 'viewers', epoch) * 5000),
+                'started_at': timestamp(max(streak_start, self.started - 3600)),
+                'language': 'en', 'thumbnail_url': '', 'tag_ids': [], 'is_mature': False,
+            })
+        return data
+
+    def videos(self, user_id, first):
+        # One VOD per finished live streak, newest first
+        login = self.logins.get(user_id, f"user{user_id}")
+        data = []
+        current = self.streak(user_id, self.epoch())
+        for streak in range(current - 1, current - 50, -1):
+            if len(data) >= first:
+                break
+            if not self.is_live(user_id, streak):
+                continue
+            video_id = str(int(user_id) * 1000 + streak % 1000)
+            created_at = timestamp(self.started + streak * LIVE_STREAK_EPOCHS * self.epoch_seconds)
+            data.append({
+                'id': video_id, 'user_id': user_id, 'user_login': login, 'user_name': login.title(),
+                'title': f"Broadcast {streak} of {login}", 'description': '',
+                'created_at': created_at, 'published_at': created_at, 'url': '',
+                'thumbnail_url': f"{self.base_url}/images/vod-{video_id}-%{{width}}x%{{height}}.png",
+                'viewable': 'public', 'view_count': 0, 'language': 'en', 'type': 'archive',
+                'duration': f"{int(LIVE_STREAK_EPOCHS * self.epoch_seconds)}s",
+            })
+        return data
+
+class RecordedFixture:
+    def __init__(self, path):
+        with open(path) as f:
+            fixture = json.load(f)
+        self.users_by_login = {user['login']: user for user in fixture.get('users', [])}
+        self.streams_by_user = {stream['user_id']: stream for stream in fixture.get('streams', [])}
+        self.videos_by_user = fixture.get('videos', {})
+
+    def users(self, logins):
+        return [self.users_by_login[login] for login in logins if login in self.users_by_login]
+
+    def streams(self, user_ids):
+        return [self.streams_by_user[user_id] for user_id in user_ids if user_id in self.streams_by_user]
+
+    def videos(self, user_id, first):
+        return self.videos_by_user.get(user_id, [])[:first]
+
+class HelixStub:
+    def __init__(self, fixture, latency_ms=0, jitter_ms=0, rate_limit=0):
+        self.fixture = fixture
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit   # Points per minute and Client-ID (0: unlimited)
+        # Key=Client-ID, Value=[points left, last refill]
+        self.buckets = {}
+        self.stats = Counter()
+
+    def take_point(self, client_id):
+        """Helix-style token bucket: refills continuously up to rate_limit. Returns (allowed, remaining, reset)."""
+        now = time.time()
+        bucket = self.buckets.setdefault(client_id, [self.rate_limit, now])
+        bucket[0] = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit / 60)
+        bucket[1] = now
+        allowed = bucket[0] >= 1
+        if allowed:
+            bucket[0] -= 1
+        reset = int(now + (self.rate_limit - bucket[0]) * 60 / self.rate_limit)
+        return allowed, int(bucket[0]), reset
+
+    def respond(self, start_response, endpoint, status, body, content_type='application/json', headers=()):
+        self.stats[f"{endpoint} {status.split()[0]}"] += 1
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        start_response(status, [('Content-Type', content_type), ('Content-Length', str(len(body)))] + list(headers))
+        return [body]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+
+        if path == '/stats':
+            return self.respond(start_response, 'stats', '200 OK', dict(sorted(self.stats.items())))
+        if path == '/stats/reset' and method == 'POST':
+            self.stats.clear()
+            return self.respond(start_response, 'stats', '200 OK', {})
+        if path.startswith('/images/'):
+            return self.respond(start_response, 'images', '200 OK', PNG, 'image/png')
+
+        if self.latency_ms or self.jitter_ms:
+            gevent.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+
+        if path == '/oauth2/token' and method == 'POST':
+            if query.get('grant_type') != ['client_credentials'] or not query.get('client_id'):
+                return self.respond(start_response, 'token', '400 Bad Request', {'status': 400, 'message': 'invalid client'})
+            token = f"stub-{query['client_id'][0]}-{int(time.time())}"
+            return self.respond(start_response, 'token', '200 OK',
+                                {'access_token': token, 'expires_in': 5000000, 'token_type': 'bearer'})
+
+        endpoint = path.rsplit('/', 1)[-1]
+        if not path.startswith('/helix/') or endpoint not in ('users', 'streams', 'videos'):
+            return self.respond(start_response, 'other', '404 Not Found', {'status': 404, 'message': 'not found'})
+        client_id = environ.get('HTTP_CLIENT_ID')
+        if not client_id or not environ.get('HTTP_AUTHORIZATION', '').startswith('Bearer '):
+            return self.respond(start_response, endpoint, '401 Unauthorized', {'status': 401, 'message': 'OAuth token is missing'})
+
+        headers = []
+        if self.rate_limit:
+            allowed, remaining, reset = self.take_point(client_id)
+            headers = [('Ratelimit-Limit', str(self.rate_limit)), ('Ratelimit-Remaining', str(remaining)),
+                       ('Ratelimit-Reset', str(reset))]
+            if not allowed:
+                return self.respond(start_response, endpoint, '429 Too Many Requests',
+                                    {'status': 429, 'message': 'Too Many Requests'}, headers=headers)
+
+        if endpoint == 'users':
+            data = self.fixture.users(query.get('login', [])[:PAGE_LIMIT])
+        elif endpoint == 'streams':
+            data = self.fixture.streams(query.get('user_id', [])[:PAGE_LIMIT])
+        else:
+            first = min(PAGE_LIMIT, int(query.get('first', ['20'])[0]))
+            data = self.fixture.videos(query.get('user_id', [''])[0], first)
+        return self.respond(start_response, endpoint, '200 OK', {'data': data, 'pagination': {}}, headers=headers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8891)
+    parser.add_argument('--latency-ms', type=int, default=0, help='Delay of every API response')
+    parser.add_argument('--jitter-ms', type=int, default=0, help='Additional random delay, 0..N ms')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Points per minute and Client-ID (Twitch: 800; 0: unlimited)')
+    parser.add_argument('--epoch-seconds', type=float, default=60, help='How often the generated state moves on')
+    parser.add_argument('--live-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fixture', help='Replay this recorded fixture instead of generating one')
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    if args.fixture:
+        fixture = RecordedFixture(args.fixture)
+    else:
+        fixture = GeneratedFixture(base_url, args.epoch_seconds, args.live_ratio, args.seed)
+    print(f"Helix stand-in on {base_url}/ (poller.py --benchmark N --api-url {base_url})", flush=True)
+    WSGIServer(('127.0.0.1', args.port), HelixStub(fixture, args.latency_ms, args.jitter_ms, args.rate_limit),
+               log=None).serve_forever()
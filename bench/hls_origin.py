@@ -0,0 +1,141 @@
+"""Fake Twitch HLS origin for the streaming benchmark.
+
+Serves synthetic Twitch-style variant/media playlists and MPEG-TS segments:
+
+    /live/<channel>/master.m3u8     variant playlist (one 1080p60 variant)
+    /live/<channel>/media.m3u8      sliding live window, advancing in real time
+    /live/<channel>/<n>.ts          live segment n
+    /vod/<vod_id>/master.m3u8       variant playlist
+    /vod/<vod_id>/media.m3u8        complete VOD playlist (#EXT-X-ENDLIST)
+    /vod/<vod_id>/<n>.ts            VOD segment n
+
+Segments are bitrate * duration bytes of 188-byte TS packets. Ad breaks are marked
+the way Twitch does (segment title "Amazon|...", discontinuities) and their packets
+carry AD_PACKET_HEADER instead of CONTENT_PACKET_HEADER, so a player can count the
+ad bytes that got through. Every segment response is delayed by a random 0..jitter ms.
+
+    python3 bench/hls_origin.py --port 8890 --bitrate 6000 --jitter 200 --ad-every 120 --ad-length 30
+"""
+import argparse
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from gevent import monkey
+monkey.patch_all()
+import gevent
+from gevent.pywsgi import WSGIServer
+
+TS_PACKET_SIZE = 188
+CONTENT_PACKET_HEADER = b'\x47\x01\x00\x10'
+AD_PACKET_HEADER = b'\x47\x01\xad\x10'
+LIVE_WINDOW = 6        # Segments in the live media playlist
+VOD_SEGMENTS = 900     # 30 minutes of 2s segments
+
+class Origin:
+    def __init__(self, bitrate_kbps=6000, segment_seconds=2.0, jitter_ms=0, ad_every=0, ad_length=30):
+        self.bitrate_kbps = bitrate_kbps
+        self.segment_seconds = segment_seconds
+        self.jitter_ms = jitter_ms
+        self.ad_every = ad_every     # Seconds between ad breaks (0: no ads)
+        self.ad_length = ad_length   # Seconds per ad break
+        self.started = time.time()
+        packets = max(1, int(bitrate_kbps * 1000 / 8 * segment_seconds) // TS_PACKET_SIZE)
+        body = b'\xff' * (TS_PACKET_SIZE - len(CONTENT_PACKET_HEADER))
+        self.content_segment = (CONTENT_PACKET_HEADER + body) * packets
+        self.ad_segment = (AD_PACKET_HEADER + body) * packets
+        self.requests = 0
+        self.bytes_sent = 0
+
+    def is_ad(self, n):
+        if not self.ad_every:
+            return False
+        position = (n * self.segment_seconds) % (self.ad_every + self.ad_length)
+        return position >= self.ad_every
+
+    def live_sequence(self):
+        return int((time.time() - self.started) / self.segment_seconds)
+
+    def master_playlist(self):
+        bandwidth = self.bitrate_kbps * 1000
+        return ('#EXTM3U\n'
+                '#EXT-X-TWITCH-INFO:NODE="bench",CLUSTER="bench"\n'
+                '#EXT-X-MEDIA:TYPE=VIDEO,GROUP-ID="chunked",NAME="1080p60 (source)",AUTOSELECT=YES,DEFAULT=YES\n'
+                f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION=1920x1080,CODECS="avc1.64002A,mp4a.40.2",'
+                'VIDEO="chunked",FRAME-RATE=60.000,STABLE-VARIANT-ID="1080p60"\n'
+                'media.m3u8\n')
+
+    def segment_lines(self, n):
+        date = datetime.fromtimestamp(self.started + n * self.segment_seconds, timezone.utc)
+        lines = []
+        if n > 0 and self.is_ad(n) != self.is_ad(n - 1):
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f'#EXT-X-PROGRAM-DATE-TIME:{date.isoformat(timespec="milliseconds").replace("+00:00", "Z")}')
+        title = f'Amazon|{n}' if self.is_ad(n) else 'live'
+        lines.append(f'#EXTINF:{self.segment_seconds:.3f},{title}')
+        lines.append(f'{n}.ts')
+        return lines
+
+    def live_playlist(self):
+        last = self.live_sequence()
+        first = max(0, last - LIVE_WINDOW + 1)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(self.segment_seconds + 0.999)}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{first}']
+        for n in range(first, last + 1):
+            lines += self.segment_lines(n)
+        return '\n'.join(lines) + '\n'
+
+    def vod_playlist(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{int(self.segment_seconds + 0.999)}',
+                 '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MEDIA-SEQUENCE:0']
+        for n in range(VOD_SEGMENTS):
+            lines += [f'#EXTINF:{self.segment_seconds:.3f},', f'{n}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        path = environ.get('PATH_INFO', '')
+        match = re.fullmatch(r'/(live|vod)/([^/]+)/(master\.m3u8|media\.m3u8|(\d+)\.ts)', path)
+        if not match:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'not found']
+        kind, _, name, segment = match.groups()
+
+        if name == 'master.m3u8':
+            body = self.master_playlist().encode()
+        elif name == 'media.m3u8':
+            body = (self.live_playlist() if kind == 'live' else self.vod_playlist()).encode()
+        else:
+            n = int(segment)
+            if (kind == 'live' and n > self.live_sequence()) or (kind == 'vod' and n >= VOD_SEGMENTS):
+                start_response('404 Not Found', [('Content-Type', 'text/plain')])
+                return [b'no such segment']
+            if self.jitter_ms:
+                gevent.sleep(random.uniform(0, self.jitter_ms) / 1000)
+            body = self.ad_segment if kind == 'live' and self.is_ad(n) else self.content_segment
+            self.bytes_sent += len(body)
+            start_response('200 OK', [('Content-Type', 'video/mp2t'), ('Content-Length', str(len(body)))])
+            return [body]
+
+        start_response('200 OK', [('Content-Type', 'application/vnd.apple.mpegurl'), ('Content-Length', str(len(body)))])
+        return [body]
+
+def add_arguments(parser):
+    parser.add_argument('--bitrate', type=int, default=6000, help='Segment bitrate in kbit/s')
+    parser.add_argument('--segment-seconds', type=float, default=2.0)
+    parser.add_argument('--jitter', type=int, default=0, help='Random delay of each segment response, 0..N ms')
+    parser.add_argument('--ad-every', type=int, default=0, help='Seconds of content between ad breaks (0: no ads)')
+    parser.add_argument('--ad-length', type=int, default=30, help='Seconds per ad break')
+
+def origin_from_args(args):
+    return Origin(args.bitrate, args.segment_seconds, args.jitter, args.ad_every, args.ad_length)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8890)
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(f"Fake HLS origin on http://127.0.0.1:{args.port}/", flush=True)
+    WSGIServer(('127.0.0.1', args.port), origin_from_args(args), log=None).serve_forever()
@@ -0,0 +1,369 @@
+"""Load benchmark: latency and memory of the catalog endpoints at synthetic scale.
+
+Builds a synthetic database with the real schema (bench/synthetic_db.py) at the
+given scale, then sends --requests requests to each endpoint below, spread over
+--sample-users users, --concurrency at a time:
+
+    player_api:<action>   /player_api.php (get_user_info, live/VOD catalogs, get_vod_info)
+    playlist.m3u          /playlist.m3u?token=...
+    epg.xml               /epg.xml?token=...
+    xmltv.php             /xmltv.php?username=...&password=...
+
+Each endpoint runs against a fresh app process, either in-process through Flask's
+test client (--server client, the default) or a local gunicorn with the gevent
+worker as in production (--server gunicorn). The first request per user is "cold"
+(credentials, snapshots and artifacts get built), the rest are "warm".
+
+Reports p50/p95/p99 latency (all, cold, warm) and the app process's peak RSS per
+endpoint, and writes them as JSON (default bench/results/load-<commit>.json).
+--baseline compares against an earlier report:
+
+    python3 bench/load_bench.py --users 10000 --channel-links 100000 --vods 500000 --db /tmp/load.db
+    python3 bench/load_bench.py --db /tmp/load.db --baseline bench/results/load-<commit>.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from gevent import monkey
+monkey.patch_all()
+from gevent.pool import Pool
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+import synthetic_db
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+HOST_URL = 'http://bench.local'
+XC_ACTIONS = ('get_user_info', 'get_live_categories', 'get_live_streams', 'get_vod_categories',
+              'get_vod_streams', 'get_vod_streams&category_id', 'get_vod_info')
+ENDPOINTS = tuple(f"player_api:{action}" for action in XC_ACTIONS) + ('playlist.m3u', 'epg.xml', 'xmltv.php')
+
+# --- Request Paths ---
+def sample_user_ids(db_path, count, seed):
+    """`count` random users that have at least one channel."""
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM channels ORDER BY user_id")]
+    conn.close()
+    return random.Random(seed).sample(user_ids, min(count, len(user_ids)))
+
+def endpoint_path(conn, endpoint, user_id):
+    credentials = f"username=user{user_id}&password={synthetic_db.PASSWORD}"
+    if endpoint == 'playlist.m3u':
+        return f"/playlist.m3u?token=token{user_id}"
+    if endpoint == 'epg.xml':
+        return f"/epg.xml?token=token{user_id}"
+    if endpoint == 'xmltv.php':
+        return f"/xmltv.php?{credentials}"
+
+    action = endpoint.split(':', 1)[1]
+    if action in ('get_vod_info', 'get_vod_streams&category_id'):
+        vod_id, category_id = conn.execute('''
+            SELECT v.vod_id, v.category_id FROM channels c JOIN vod_streams v ON v.channel_login = c.login_name
+            WHERE c.user_id = ? LIMIT 1
+        ''', (user_id,)).fetchone()
+        if action == 'get_vod_info':
+            return f"/player_api.php?{credentials}&action=get_vod_info&vod_id={vod_id}"
+        return f"/player_api.php?{credentials}&action=get_vod_streams&category_id={category_id}"
+    return f"/player_api.php?{credentials}&action={action}"
+
+def endpoint_paths(db_path, endpoint, user_ids):
+    conn = sqlite3.connect(db_path)
+    paths = [endpoint_path(conn, endpoint, user_id) for user_id in user_ids]
+    conn.close()
+    return paths
+
+# --- Measuring ---
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 2)
+
+def latency_summary(values):
+    return {'count': len(values), 'p50_ms': percentile(values, 0.5), 'p95_ms': percentile(values, 0.95),
+            'p99_ms': percentile(values, 0.99), 'max_ms': round(max(values), 2) if values else None}
+
+def measure(fetch, paths, total, concurrency):
+    """Requests paths round-robin, `total` requests, `concurrency` at a time. fetch(path)
+    returns (status, body size). The first round (one request per user) counts as cold.
+    """
+    cold, warm = [], []
+    errors = []
+    sizes = []
+
+    def one(i):
+        path = paths[i % len(paths)]
+        started = time.perf_counter()
+        try:
+            status, size = fetch(path)
+        except Exception as e:
+            errors.append(f"{path}: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if status >= 400:
+            errors.append(f"{path}: HTTP {status}")
+            return
+        (cold if i < len(paths) else warm).append(elapsed_ms)
+        sizes.append(size)
+
+    pool = Pool(concurrency)
+    for i in range(total):
+        pool.spawn(one, i)
+    pool.join()
+
+    result = latency_summary(cold + warm)
+    result.update({
+        'requests': total,
+        'errors': len(errors),
+        'cold': latency_summary(cold),
+        'warm': latency_summary(warm),
+        'avg_bytes': int(sum(sizes) / len(sizes)) if sizes else 0,
+    })
+    if errors:
+        result['error_samples'] = errors[:3]
+    return result
+
+# --- Process Stats ---
+def process_memory_mb(pid, field):
+    """VmRSS (current) or VmHWM (peak) of a process, from /proc (Linux only)."""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# --- App Processes ---
+def load_app(db_path, artifacts_dir):
+    """Imports the web app on db_path, writing its EPG/M3U artifacts to artifacts_dir."""
+    os.environ.setdefault('HOST_URL', HOST_URL)
+    import db
+    db.DB_PATH = db_path
+    from app import app
+    import streaming
+    streaming.ARTIFACTS_DIR = artifacts_dir
+    return app
+
+def make_app():
+    """gunicorn entry point ('load_bench:make_app()'), configured from the environment."""
+    return load_app(os.environ['LOAD_BENCH_DB'], os.environ['LOAD_BENCH_ARTIFACTS'])
+
+def run_client_worker(args):
+    """Runs one endpoint through Flask's test client in this (fresh) process."""
+    app = load_app(args.db, tempfile.mkdtemp(prefix='artifacts-', dir=os.path.dirname(args.result)))
+    client = app.test_client()
+
+    def fetch(path):
+        response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+    paths = endpoint_paths(args.db, args.endpoint, sample_user_ids(args.db, args.sample_users, args.seed))
+    rss_start = process_memory_mb(os.getpid(), 'VmRSS')
+    result = measure(fetch, paths, args.requests, args.concurrency)
+    result['rss_start_mb'] = round(rss_start, 1)
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+def run_endpoint_client(args, endpoint, tmp, log):
+    result_path = os.path.join(tmp, 'result.json')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--endpoint', endpoint, '--db', args.db,
+               '--result', result_path, '--requests', str(args.requests), '--sample-users', str(args.sample_users),
+               '--concurrency', str(args.concurrency), '--seed', str(args.seed)]
+    subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT, check=True)
+    with open(result_path) as f:
+        return json.load(f)
+
+def run_endpoint_gunicorn(args, endpoint, tmp, log):
+    port = free_port()
+    env = dict(os.environ, HOST_URL=HOST_URL, LOAD_BENCH_DB=args.db,
+               LOAD_BENCH_ARTIFACTS=tempfile.mkdtemp(prefix='artifacts-', dir=tmp))
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', '1', '-k', 'gevent',
+                               '--bind', f'127.0.0.1:{port}', '--pythonpath', f'{ROOT},{BENCH_DIR}',
+                               'load_bench:make_app()'],
+                              env=env, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                requests.get(f"{base_url}/health", timeout=2)
+                break
+            except requests.RequestException:
+                if time.time() > deadline or master.poll() is not None:
+                    raise RuntimeError(f"gunicorn did not come up, see {log.name}")
+                time.sleep(0.2)
+        worker = child_pids(master.pid)[0]
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+        def fetch(path):
+            response = session.get(base_url + path, headers={'Accept-Encoding': 'gzip'}, timeout=300)
+            return response.status_code, len(response.content)
+
+        paths = endpoint_paths(args.db, endpoint, sample_user_ids(args.db, args.sample_users, args.seed))
+        rss_start = process_memory_mb(worker, 'VmRSS')
+        result = measure(fetch, paths, args.requests, args.concurrency)
+        result['rss_start_mb'] = round(rss_start, 1)
+        result['peak_rss_mb'] = round(process_memory_mb(worker, 'VmHWM'), 1)
+        return result
+    finally:
+        master.terminate()
+        master.wait()
+
+# --- Reports ---
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def database_scale(db_path):
+    conn = sqlite3.connect(db_path)
+    scale = {
+        'users': conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+        'channel_links': conn.execute("SELECT COUNT(*) FROM channels").fetchone()[0],
+        'distinct_channels': conn.execute("SELECT COUNT(*) FROM live_streams").fetchone()[0],
+        'vods': conn.execute("SELECT COUNT(*) FROM vod_streams").fetchone()[0],
+    }
+    conn.close()
+    return scale
+
+def print_report(report):
+    print(f"\n{'endpoint':<40} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'cold p50':>9} {'warm p50':>9} {'peak MB':>8}")
+    for name, e in report['endpoints'].items():
+        def fmt(value, width):
+            return format(value, f'{width}.1f') if value is not None else '-'.rjust(width)
+        print(f"{name:<40} {e['errors']:>6} {fmt(e['p50_ms'], 8)} {fmt(e['p95_ms'], 8)} {fmt(e['p99_ms'], 8)} "
+              f"{fmt(e['cold']['p50_ms'], 9)} {fmt(e['warm']['p50_ms'], 9)} {fmt(e['peak_rss_mb'], 8)}")
+        for error in e.get('error_samples', []):
+            print(f"    error: {error}")
+
+def compare(report, baseline, max_regression):
+    """Prints the change against a baseline report. Returns the regressions over max_regression percent."""
+    print(f"\nCompared to {baseline['commit']} ({baseline['server']}, {baseline['scale']}):")
+    for key in ('server', 'scale', 'config'):
+        if baseline.get(key) != report[key]:
+            print(f"Warning: the baseline's {key} differs ({baseline.get(key)}), the numbers aren't comparable.")
+    print(f"{'endpoint':<40} {'p50':>8} {'p95':>8} {'p99':>8} {'peak MB':>8}")
+    regressions = []
+    for name, e in report['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if not before:
+            continue
+        cells = []
+        for field in ('p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb'):
+            if not before.get(field) or e.get(field) is None:
+                cells.append('-'.rjust(8))
+                continue
+            change = (e[field] - before[field]) / before[field] * 100
+            cells.append(f"{change:+7.0f}%")
+            if max_regression is not None and field in ('p95_ms', 'peak_rss_mb') and change > max_regression:
+                regressions.append(f"{name} {field}: {before[field]} -> {e[field]} ({change:+.0f}%)")
+        print(f"{name:<40} {' '.join(cells)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--channel-links', type=int, default=100000)
+    parser.add_argument('--vods', type=int, default=500000)
+    parser.add_argument('--db', help='Synthetic database to use; built at the given scale if it does not exist')
+    parser.add_argument('--server', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--sample-users', type=int, default=50, help='Users the requests are spread over')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Report file (default: bench/results/load-<commit>.json)')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='With --baseline: exit with an error if a p95 or peak RSS got worse by more than this percentage')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--endpoint', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_client_worker(args)
+        return
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))} (known: {', '.join(ENDPOINTS)})")
+
+    tmp = tempfile.mkdtemp(prefix='load-bench-')
+    if not args.db:
+        args.db = os.path.join(tmp, 'channels.db')
+    if os.path.exists(args.db):
+        print(f"Using existing database {args.db}")
+    else:
+        print(f"Building synthetic database {args.db}...")
+        print(synthetic_db.build(args.db, users=args.users, channel_links=args.channel_links, vods=args.vods))
+    conn = sqlite3.connect(args.db)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('m3u_enabled', 'true')")
+    conn.close()
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'server': args.server,
+        'scale': database_scale(args.db),
+        'config': {'requests': args.requests, 'sample_users': args.sample_users,
+                   'concurrency': args.concurrency, 'seed': args.seed},
+        'endpoints': {},
+    }
+    log_path = os.path.join(tmp, 'app.out')
+    run_endpoint = run_endpoint_gunicorn if args.server == 'gunicorn' else run_endpoint_client
+    with open(log_path, 'w') as log:
+        for endpoint in endpoints:
+            print(f"Running {endpoint} ({args.requests} requests)...", flush=True)
+            report['endpoints'][endpoint] = run_endpoint(args, endpoint, tmp, log)
+
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {output} (app output: {log_path})")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions over {:.0f}%:".format(args.max_regression))
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
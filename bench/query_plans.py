@@ -0,0 +1,142 @@
+"""Query-plan regression check.
+
+Collects every SQL statement in the app modules, runs EXPLAIN QUERY PLAN on
+it against a synthetic large database and fails (exit code 1) if a query
+scans a table it isn't allowed to scan. Run after touching a query or the
+indexes in migrations.py:
+
+    python3 bench/query_plans.py
+"""
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic_db
+
+MODULES = ['streaming.py', 'views.py', 'poller.py', 'db.py', 'auth.py']
+
+# Values for the {...} parts of f-string queries: Key=source of the expression
+FSTRING_SUBSTITUTIONS = {
+    'columns': '*',
+    "', '.join(LIVE_STREAM_COLUMNS)": '*',
+    "', '.join(fields)": 'client_id = ?',
+    'category_filter': 'AND v.category_id = ?',
+}
+
+# Tables that are tiny by nature; scanning them is fine anywhere
+SMALL_TABLES = {'settings', 'poller_leases', 'poller_instances', 'twitch_app_tokens', 'schema_version',
+                'settings_generation', 'schedule_generation'}
+
+# Intended full reads: (module, function, table as named in the plan) -> reason
+ALLOWED_SCANS = {
+    ('poller.py', 'get_monitored', 'c'): 'reloads every monitored channel when the schedule generation changes',
+    ('poller.py', 'get_monitored', 'u'): 'reloads every monitored channel when the schedule generation changes',
+    ('poller.py', 'sync_schedule', 'live_streams'): 'loads the known rows of all scheduled channels',
+    ('poller.py', 'refresh_expiring_tokens', 'users'): 'renews tokens for all credentials',
+    ('poller.py', 'collect_garbage', 'live_streams'): 'hourly full GC sweep',
+    ('poller.py', 'collect_garbage', 'vod_streams'): 'hourly full GC sweep',
+    ('poller.py', 'collect_garbage', 'programme_history'): 'hourly full GC sweep',
+    ('poller.py', 'backfill_images', 'live_streams'): 'hourly search for uncached images',
+    ('poller.py', 'backfill_images', 'vod_streams'): 'hourly search for uncached images',
+    ('poller.py', 'collect_images', 'live_streams'): 'hourly image LRU update',
+    ('poller.py', 'collect_images', 'vod_streams'): 'hourly image LRU update',
+    ('views.py', 'admin_dashboard', 'users'): 'admin user list',
+    ('views.py', 'admin_dashboard', 'vouchers'): 'admin voucher list',
+    ('streaming.py', 'generate_epg_data', 'l'): 'partial index idx_live_streams_live, only live rows',
+}
+
+SQL_START = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s+\S')
+SCAN = re.compile(r'^SCAN (\w+)')
+
+def collect_queries(module):
+    """Yields (function, lineno, sql) for SQL string literals (and f-strings) in a module."""
+    with open(os.path.join(ROOT, module), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    def visit(node, function):
+        for child in ast.iter_child_nodes(node):
+            name = child.name if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) else function
+            if isinstance(child, ast.Constant) and isinstance(child.value, str) and SQL_START.match(child.value):
+                yield name, child.lineno, child.value
+            elif isinstance(child, ast.JoinedStr):
+                sql = render_fstring(child)
+                if sql is not None and SQL_START.match(sql):
+                    yield name, child.lineno, sql
+                continue
+            yield from visit(child, name)
+
+    yield from visit(tree, '<module>')
+
+def render_fstring(node):
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(value.value)
+        else:
+            expr = ast.unparse(value.value)
+            if expr not in FSTRING_SUBSTITUTIONS:
+                # Not SQL (log messages etc.) unless the literal parts say so
+                literal = ''.join(v.value for v in node.values if isinstance(v, ast.Constant))
+                if SQL_START.match(literal):
+                    raise KeyError(f"No substitution for {{{expr}}} in f-string query: {literal!r}")
+                return None
+            parts.append(FSTRING_SUBSTITUTIONS[expr])
+    return ''.join(parts)
+
+class AnyParams(dict):
+    """Binds None to every named parameter."""
+    def __missing__(self, key):
+        return None
+
+def explain(conn, sql):
+    if re.search(r'(?<!:):[a-z_]+', sql):
+        params = AnyParams()
+    elif re.search(r'\?\d', sql):
+        params = (None,) * max(int(n) for n in re.findall(r'\?(\d+)', sql))
+    else:
+        params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'plans.db')
+        info = synthetic_db.build(db_path, users=2000, channel_links=20000, vods=50000)
+        print(f"Synthetic DB: {info}")
+        conn = sqlite3.connect(db_path)
+
+        failures = []
+        checked = 0
+        for module in MODULES:
+            for function, lineno, sql in collect_queries(module):
+                checked += 1
+                where = f"{module}:{lineno} ({function})"
+                try:
+                    plan = explain(conn, sql)
+                except sqlite3.Error as e:
+                    failures.append(f"{where}: could not explain: {e}")
+                    continue
+                for detail in plan:
+                    match = SCAN.match(detail)
+                    if not match or detail.startswith('SCAN CONSTANT ROW'):
+                        continue
+                    table = match.group(1)
+                    if table in SMALL_TABLES or (module, function, table) in ALLOWED_SCANS:
+                        continue
+                    failures.append(f"{where}: {detail}\n    {' '.join(sql.split())}")
+        conn.close()
+
+    print(f"Checked {checked} queries.")
+    if failures:
+        print(f"{len(failures)} query plan regression(s):")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK: no unexpected table scans.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Streaming benchmark: N simulated players against the live and VOD play routes.
+
+Starts a fake Twitch HLS origin (bench/hls_origin.py) and the web app (gevent
+WSGI server, like the gunicorn gevent worker) on a synthetic database, with
+Streamlink's Twitch plugin patched to resolve channels and VODs to the origin
+(the plugin's own playlist parsing and ad filtering still run). Then, per route,
+N players stream concurrently for --duration seconds:
+
+    live   /live/<user>/<password>/<stream_id>.ts   (live proxy, Xtream Codes)
+    m3u    /play_live_m3u/<stream_id>               (live proxy, M3U)
+    vod    /movie/<user>/<password>/<vod_id>.m3u8   (playlist rewrite + segment redirects)
+
+Reports time to first byte, throughput per stream (live: compared to the
+origin's bitrate), ad bytes that got through, and the app process's CPU and
+memory per stream (from /proc, Linux only).
+
+    python3 bench/stream_bench.py --players 20 --duration 30 --routes live,m3u,vod --jitter 200 --ad-every 60
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urljoin
+
+from gevent import monkey
+monkey.patch_all()
+import gevent
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+import hls_origin
+import synthetic_db
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+# --- App Server (child process) ---
+def patch_streamlink(origin_url):
+    """Points Streamlink's Twitch plugin at the fake origin (no access token, no usher).
+
+    Streamlink executes the plugin module anew for every session, so the patch is
+    applied to the plugin class each URL resolves to rather than to the module.
+    """
+    from streamlink import Streamlink
+    resolve_url = Streamlink.resolve_url
+
+    def bench_resolve_url(self, url, *args, **kwargs):
+        name, plugin, resolved = resolve_url(self, url, *args, **kwargs)
+        if name == 'twitch':
+            usher = plugin.__init__.__globals__['UsherService']
+            plugin._access_token = lambda self, is_live, channel_or_vod: ('sig', 'token', [])
+            usher.channel = lambda self, channel, **params: f"{origin_url}/live/{channel}/master.m3u8"
+            usher.video = lambda self, video_id, **params: f"{origin_url}/vod/{video_id}/master.m3u8"
+        return name, plugin, resolved
+    Streamlink.resolve_url = bench_resolve_url
+
+def serve(port, db_path, origin_url):
+    os.environ['HOST_URL'] = f"http://127.0.0.1:{port}"
+    from gevent.pywsgi import WSGIServer
+    import db
+    db.DB_PATH = db_path
+    from app import app
+    patch_streamlink(origin_url) # After the app: streaming.py makes the plugin importable under gevent
+    WSGIServer(('127.0.0.1', port), app, log=None).serve_forever()
+
+# --- Process Stats ---
+def process_cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS # utime + stime
+
+def process_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+# --- Players ---
+def live_player(url, duration):
+    """Streams a live proxy URL for `duration` seconds."""
+    result = {'ttfb': None, 'bytes': 0, 'ad_bytes': 0, 'seconds': 0.0, 'error': None}
+    started = time.perf_counter()
+    first_byte_at = None
+    try:
+        with requests.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(65536):
+                now = time.perf_counter()
+                if first_byte_at is None:
+                    first_byte_at = now
+                    result['ttfb'] = now - started
+                result['bytes'] += len(chunk)
+                result['ad_bytes'] += chunk.count(hls_origin.AD_PACKET_HEADER) * hls_origin.TS_PACKET_SIZE
+                if now - started >= duration:
+                    break
+    except Exception as e:
+        result['error'] = str(e)
+    if first_byte_at is not None:
+        result['seconds'] = time.perf_counter() - first_byte_at
+    return result
+
+def vod_player(url, duration):
+    """Loads a VOD playlist and downloads its segments back to back for `duration` seconds."""
+    result = {'ttfb': None, 'bytes': 0, 'ad_bytes': 0, 'seconds': 0.0, 'error': None}
+    started = time.perf_counter()
+    first_byte_at = None
+    try:
+        playlist = requests.get(url, timeout=30)
+        playlist.raise_for_status()
+        segments = [urljoin(url, line) for line in playlist.text.splitlines() if line and not line.startswith('#')]
+        session = requests.Session()
+        for segment_url in segments:
+            with session.get(segment_url, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(65536):
+                    if first_byte_at is None:
+                        first_byte_at = time.perf_counter()
+                        result['ttfb'] = first_byte_at - started
+                    result['bytes'] += len(chunk)
+            if time.perf_counter() - started >= duration:
+                break
+    except Exception as e:
+        result['error'] = str(e)
+    if first_byte_at is not None:
+        result['seconds'] = time.perf_counter() - first_byte_at
+    return result
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_route(route, urls, duration, app_pid, bitrate_kbps):
+    player = vod_player if route == 'vod' else live_player
+    cpu_before = process_cpu_seconds(app_pid)
+    rss_before = process_rss_mb(app_pid)
+    peak_rss = rss_before
+    started = time.time()
+    players = [gevent.spawn(player, url, duration) for url in urls]
+    while not all(p.ready() for p in players):
+        peak_rss = max(peak_rss, process_rss_mb(app_pid))
+        gevent.sleep(0.5)
+    wall = time.time() - started
+    cpu = process_cpu_seconds(app_pid) - cpu_before
+
+    results = [p.value for p in players]
+    ok = [r for r in results if r['ttfb'] is not None]
+    ttfbs = [r['ttfb'] * 1000 for r in ok]
+    throughputs = [r['bytes'] * 8 / 1000 / r['seconds'] for r in ok if r['seconds'] > 0]
+    n = len(urls)
+    summary = {
+        'players': n,
+        'errors': sum(1 for r in results if r['error'] or r['ttfb'] is None),
+        'ttfb_ms': {'p50': percentile(ttfbs, 0.5), 'p95': percentile(ttfbs, 0.95), 'max': max(ttfbs, default=None)},
+        'throughput_kbps_per_stream': {'avg': sum(throughputs) / len(throughputs) if throughputs else None,
+                                       'min': min(throughputs, default=None)},
+        'ad_bytes': sum(r['ad_bytes'] for r in results),
+        'app_cpu_percent_per_stream': cpu / wall * 100 / n,
+        'app_rss_mb_per_stream': (peak_rss - rss_before) / n,
+        'app_peak_rss_mb': peak_rss,
+        'wall_seconds': wall,
+    }
+    if route != 'vod':
+        summary['realtime_ratio'] = (summary['throughput_kbps_per_stream']['avg'] or 0) / bitrate_kbps
+    errors = sorted({r['error'] for r in results if r['error']})
+    if errors:
+        summary['error_samples'] = errors[:3]
+    return summary
+
+def route_urls(route, db_path, base_url, players):
+    """Play URLs of `players` distinct channels (or VODs), with their owners' credentials."""
+    import sqlite3
+    conn = sqlite3.connect(db_path)
+    if route == 'vod':
+        rows = conn.execute('''
+            SELECT c.user_id, v.vod_id FROM vod_streams v JOIN channels c ON c.login_name = v.channel_login
+            GROUP BY v.vod_id LIMIT ?
+        ''', (players,)).fetchall()
+        urls = [f"{base_url}/movie/user{uid}/{synthetic_db.PASSWORD}/{vod_id}.m3u8" for uid, vod_id in rows]
+    else:
+        rows = conn.execute("SELECT user_id, id FROM channels ORDER BY id LIMIT ?", (players,)).fetchall()
+        if route == 'live':
+            urls = [f"{base_url}/live/user{uid}/{synthetic_db.PASSWORD}/{cid}.ts" for uid, cid in rows]
+        else:
+            urls = [f"{base_url}/play_live_m3u/{cid}" for uid, cid in rows]
+    conn.close()
+    return urls
+
+def print_report(report):
+    print(f"\n{'route':<6} {'players':>7} {'errors':>6} {'ttfb p50':>9} {'ttfb p95':>9} {'kbit/s':>8} "
+          f"{'realtime':>8} {'ad bytes':>9} {'cpu%/str':>8} {'MB/str':>7}")
+    for route, s in report['routes'].items():
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else '-'
+        print(f"{route:<6} {s['players']:>7} {s['errors']:>6} {fmt(s['ttfb_ms']['p50'], '9.0f')} "
+              f"{fmt(s['ttfb_ms']['p95'], '9.0f')} {fmt(s['throughput_kbps_per_stream']['avg'], '8.0f')} "
+              f"{fmt(s.get('realtime_ratio'), '8.2f')} {s['ad_bytes']:>9} "
+              f"{s['app_cpu_percent_per_stream']:>8.2f} {s['app_rss_mb_per_stream']:>7.2f}")
+    for route, s in report['routes'].items():
+        for error in s.get('error_samples', []):
+            print(f"{route} error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per player')
+    parser.add_argument('--routes', default='live,m3u,vod')
+    parser.add_argument('--output', help='Also write the report as JSON to this file')
+    parser.add_argument('--keep-logs', action='store_true', help="Print the path of the app's output")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--origin', help=argparse.SUPPRESS)
+    hls_origin.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.db, args.origin)
+        return
+
+    routes = [r.strip() for r in args.routes.split(',') if r.strip()]
+    tmp = tempfile.mkdtemp(prefix='stream-bench-')
+    db_path = os.path.join(tmp, 'channels.db')
+    info = synthetic_db.build(db_path, users=max(2, args.players // 5), channel_links=max(40, args.players * 4),
+                              vods=max(100, args.players * 10))
+    print(f"Synthetic DB: {info}")
+
+    origin_port, app_port = free_port(), free_port()
+    origin_url, base_url = f"http://127.0.0.1:{origin_port}", f"http://127.0.0.1:{app_port}"
+    origin_args = ['--bitrate', str(args.bitrate), '--segment-seconds', str(args.segment_seconds),
+                   '--jitter', str(args.jitter), '--ad-every', str(args.ad_every), '--ad-length', str(args.ad_length)]
+    app_log_path = os.path.join(tmp, 'app.out')
+    app_log = open(app_log_path, 'wb')
+    children = [
+        subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'hls_origin.py'), '--port', str(origin_port)] + origin_args,
+                         stdout=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(app_port),
+                          '--db', db_path, '--origin', origin_url], stdout=app_log, stderr=subprocess.STDOUT, cwd=ROOT),
+    ]
+    app_pid = children[1].pid
+    try:
+        wait_for(f"{origin_url}/live/probe/master.m3u8")
+        wait_for(f"{base_url}/health")
+        report = {
+            'config': {'players': args.players, 'duration': args.duration, 'bitrate_kbps': args.bitrate,
+                       'segment_seconds': args.segment_seconds, 'jitter_ms': args.jitter,
+                       'ad_every': args.ad_every, 'ad_length': args.ad_length},
+            'app_idle_rss_mb': process_rss_mb(app_pid),
+            'routes': {},
+        }
+        for route in routes:
+            print(f"Running '{route}' with {args.players} players for {args.duration:.0f}s...")
+            urls = route_urls(route, db_path, base_url, args.players)
+            report['routes'][route] = run_route(route, urls, args.duration, app_pid, args.bitrate)
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+        app_log.close()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    if args.keep_logs:
+        print(f"App output: {app_log_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Builds a synthetic database with the real schema (init_db.py / migrations.py).
+
+Used by the query-plan check and the benchmarks:
+
+    python3 bench/synthetic_db.py /tmp/synthetic.db --users 10000 --channel-links 100000 --vods 500000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from init_db import init_db
+from utils.categories import vod_category_id
+
+from werkzeug.security import generate_password_hash
+
+# Every synthetic user has this password (hashed once, hashing 10k times would take minutes)
+PASSWORD = 'bench-password'
+
+def login_name(i):
+    return f"streamer{i:06d}"
+
+def build(db_path, users=1000, channel_links=10000, vods=50000, distinct_channels=None, live_ratio=0.2, seed=1):
+    """Creates db_path (replacing it) and fills it. Returns a dict describing what was generated."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    init_db(db_path)
+
+    rnd = random.Random(seed)
+    distinct_channels = distinct_channels or max(1, channel_links // 4)
+    links_per_user = max(1, channel_links // users)
+    vods_per_channel = max(1, vods // distinct_channels)
+    started = time.time()
+
+    conn = sqlite3.connect(db_path)
+    password_hash = generate_password_hash(PASSWORD)
+    conn.executemany(
+        "INSERT INTO users (id, username, password_hash, api_token, client_id, client_secret, subscription_tier) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((uid, f"user{uid}", password_hash, f"token{uid}", f"client{uid % 50}", f"secret{uid % 50}", 'premium')
+         for uid in range(1, users + 1))
+    )
+
+    def user_channels(uid):
+        return {rnd.randrange(distinct_channels) for _ in range(links_per_user)}
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO channels (user_id, login_name) VALUES (?, ?)",
+        ((uid, login_name(i)) for uid in range(1, users + 1) for i in user_channels(uid))
+    )
+
+    now = time.time()
+    live = set(rnd.sample(range(distinct_channels), int(distinct_channels * live_ratio)))
+    conn.executemany(
+        """INSERT INTO live_streams (login_name, epg_channel_id, display_name, is_live, stream_title, stream_game, last_live_at, vods_checked_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((login_name(i), f"{login_name(i)}.tv",
+          login_name(i).title() if i in live else f"[Offline] {login_name(i).title()}",
+          i in live, f"Stream title {i}" if i in live else None, f"Game {i % 300}" if i in live else None,
+          now - rnd.randrange(0, 30 * 86400), now)
+         for i in range(distinct_channels))
+    )
+
+    base = datetime(2024, 1, 1)
+    conn.executemany(
+        """INSERT INTO vod_streams (vod_id, channel_login, title, created_at, category, thumbnail_url, duration, category_id)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((str(10**9 + i * vods_per_channel + n), login_name(i), f"VOD {n} of {login_name(i)}",
+          (base + timedelta(hours=i % 1000 + n * 24)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+          f"{login_name(i).title()} VODs", f"https://static-cdn.example/{i}/{n}-640x360.jpg", rnd.randrange(600, 36000),
+          vod_category_id(login_name(i)))
+         for i in range(distinct_channels) for n in range(vods_per_channel))
+    )
+
+    # EPG history: two past broadcasts per channel, plus the running one of live channels
+    def programmes(i):
+        for day in (2, 1):
+            start = now - day * 86400 - rnd.randrange(0, 43200)
+            yield (login_name(i), start, start + rnd.randrange(3600, 4 * 3600), f"Stream title {i}/{day}", f"Game {(i + day) % 300}")
+        if i in live:
+            yield (login_name(i), now - rnd.randrange(600, 7200), None, f"Stream title {i}", f"Game {i % 300}")
+
+    conn.executemany(
+        "INSERT INTO programme_history (login_name, start, stop, title, game) VALUES (?, ?, ?, ?, ?)",
+        (row for i in range(distinct_channels) for row in programmes(i))
+    )
+    conn.commit()
+
+    info = {
+        'users': users,
+        'channel_links': conn.execute("SELECT COUNT(*) FROM channels").fetchone()[0],
+        'distinct_channels': distinct_channels,
+        'vods': conn.execute("SELECT COUNT(*) FROM vod_streams").fetchone()[0],
+        'build_seconds': round(time.time() - started, 1)
+    }
+    conn.close()
+    return info
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--channel-links', type=int, default=10000)
+    parser.add_argument('--vods', type=int, default=50000)
+    parser.add_argument('--distinct-channels', type=int, default=None)
+    args = parser.parse_args()
+    print(build(args.db_path, args.users, args.channel_links, args.vods, args.distinct_channels))
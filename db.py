@@ -1,6 +1,10 @@
-import sqlite3
+import time
+from collections import OrderedDict
 from werkzeug.security import check_password_hash
 from flask import current_app, g
+from utils.crypto import keyed_digest
+from utils import sqlite_pool
+from utils.timing import TimedConnection, phase
 
 import os
 
@@ -12,30 +16,37 @@ if not os.path.exists(INSTANCE_FOLDER):
 
 DB_PATH = os.path.join(INSTANCE_FOLDER, 'channels.db')
 
+# Verified XC credentials: Key=keyed digest of (user row, password), Value=expiry timestamp.
+# check_password_hash is deliberately slow and TiviMate sends the password with every
+# request. The key covers the whole user row, so any change to it (password, tier, ...)
+# or deleting the user invalidates the entry by itself.
+XC_AUTH_CACHE_TTL = 300 # seconds
+XC_AUTH_CACHE_MAX = 1024
+xc_auth_cache = OrderedDict()
+
+# Snapshot of the settings table. A play request alone reads half a dozen settings.
+# Writes (from any process) bump settings_generation via triggers (migrations.py);
+# the generation is checked once per request and the snapshot reloaded if it changed.
+settings_cache = {'generation': None, 'values': {}}
+
 def get_db():
     """Opens a new database connection if there is none yet for the
     current application context.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
-        
-        # Simple Migration Check (Auto-add auth_token column)
-        try:
-            g.db.execute("SELECT auth_token FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            current_app.logger.info("[DB] Migrating: Adding 'auth_token' column to users table.")
-            g.db.execute("ALTER TABLE users ADD COLUMN auth_token TEXT")
-            g.db.commit()
+        # Pooled connection in WAL mode (see utils/sqlite_pool.py); its statements
+        # count to the request's 'db' phase (utils/timing.py)
+        g.db = sqlite_pool.acquire(DB_PATH, TimedConnection)
+        # Schema migrations run once at startup (init_db.py), not here
             
     return g.db
 
 def close_db(e=None):
-    """Closes the database again at the end of the request."""
+    """Returns the connection to the pool at the end of the request."""
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        sqlite_pool.release(db, DB_PATH)
 
 def init_app(app):
     """Register database functions with the Flask app. This is called by
@@ -63,12 +74,26 @@ def get_user_by_token(token):
         current_app.logger.error(f"[DB-Helper] Error fetching user by token: {e}")
         return None
 
+def invalidate_settings():
+    """Drops the settings snapshot (after this process wrote settings)."""
+    settings_cache['generation'] = None
+
+def get_settings():
+    """Returns the cached settings snapshot as a dict. Don't modify it."""
+    if 'settings_checked' not in g or settings_cache['generation'] is None:
+        db = get_db()
+        generation = db.execute("SELECT generation FROM settings_generation WHERE id = 1").fetchone()[0]
+        if generation != settings_cache['generation']:
+            rows = db.execute("SELECT key, value FROM settings").fetchall()
+            settings_cache['values'] = {row['key']: row['value'] for row in rows}
+            settings_cache['generation'] = generation
+        g.settings_checked = True
+    return settings_cache['values']
+
 def get_setting(key, default=None):
     """Fetches a single value from the settings table."""
     try:
-        db = get_db()
-        row = db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-        return row['value'] if row else default
+        return get_settings().get(key, default)
     except Exception as e:
         current_app.logger.error(f"[DB-Helper] Error fetching setting '{key}': {e}")
         return default
@@ -76,9 +101,7 @@ def get_setting(key, default=None):
 def get_all_settings():
     """Fetches all settings (except the secret)."""
     try:
-        db = get_db()
-        settings_raw = db.execute("SELECT key, value FROM settings").fetchall()
-        settings = {row['key']: row['value'] for row in settings_raw}
+        settings = dict(get_settings())
         if 'twitch_client_secret' in settings:
             settings['twitch_client_secret'] = "" # Never send secret to client
         return settings
@@ -86,8 +109,15 @@ def get_all_settings():
         current_app.logger.error(f"[DB-Helper] Error fetching all settings: {e}")
         return {}
 
+def _xc_auth_cache_key(user, password):
+    return keyed_digest(f"{tuple(user)!r}\0{password}", 'xc-auth')
+
 def check_xc_auth(username, password):
     """Checks credentials against the users table."""
+    with phase('auth'):
+        return _check_xc_auth(username, password)
+
+def _check_xc_auth(username, password):
     if not username or not password:
         return False
         
@@ -96,8 +126,19 @@ def check_xc_auth(username, password):
         current_app.logger.warning(f"[Auth] Check_xc_auth failed: User '{username}' not found.")
         return False
 
+    cache_key = _xc_auth_cache_key(user, password)
+    expires = xc_auth_cache.get(cache_key)
+    if expires and time.time() < expires:
+        return True
+
     is_valid = check_password_hash(user['password_hash'], password)
-    if not is_valid:
+    if is_valid:
+        # Only successful checks are cached, so guessing stays expensive
+        xc_auth_cache[cache_key] = time.time() + XC_AUTH_CACHE_TTL
+        xc_auth_cache.move_to_end(cache_key)
+        while len(xc_auth_cache) > XC_AUTH_CACHE_MAX:
+            xc_auth_cache.popitem(last=False)
+    else:
         current_app.logger.warning(f"[Auth] Check_xc_auth failed: Invalid password for user '{username}'.")
         
     return is_valid
@@ -2,10 +2,13 @@
 set -e
 
 echo "[Entrypoint] Initializing database (if not exists)..."
-# Run the DB init script on every start.
-# This is safe because of "IF NOT EXISTS" in the SQL.
+# Run the DB init script on every start. It only applies migrations
+# that aren't recorded in schema_version yet (see migrations.py).
 python3 init_db.py
 
+# Number of poller processes started by supervisord (see README, "Scaling the Poller")
+export POLLER_PROCESSES="${POLLER_PROCESSES:-1}"
+
 echo "[Entrypoint] Database is ready. Starting Supervisor..."
 # Start supervisor, which manages Nginx, Gunicorn, and the Poller
 exec /usr/bin/supervisord -c /app/supervisord.conf
\ No newline at end of file
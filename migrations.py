@@ -0,0 +1,370 @@
+"""Numbered schema migrations, tracked in the schema_version table.
+
+init_db.py runs them once at container start (entrypoint.sh), never in the
+request path. Each migration is applied in its own transaction. Append new
+migrations to MIGRATIONS; never change one that has already shipped.
+"""
+from utils.categories import vod_category_id
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+def add_column(conn, table, column, type):
+    """ALTER TABLE ... ADD COLUMN, unless the column is already there (DBs from before versioning)."""
+    if not column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type}")
+
+# --- Migrations ---
+def m001_baseline(conn):
+    """Schema as it was before versioned migrations. Also adopts existing DBs,
+    which may be missing any of the later-added columns.
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        api_token TEXT UNIQUE,
+        client_id TEXT,
+        client_secret TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        login_name TEXT NOT NULL,
+        UNIQUE(login_name, user_id),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY NOT NULL,
+        value TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS live_streams (
+        login_name TEXT PRIMARY KEY,
+        display_name TEXT NOT NULL,
+        is_live BOOLEAN NOT NULL DEFAULT 0,
+        category TEXT NOT NULL DEFAULT 'Twitch Live',
+        epg_channel_id TEXT,
+        stream_title TEXT,
+        stream_game TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS vod_streams (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vod_id TEXT NOT NULL,
+        channel_login TEXT NOT NULL,
+        title TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        category TEXT NOT NULL,
+        thumbnail_url TEXT,
+        UNIQUE(vod_id, channel_login)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS vouchers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT NOT NULL UNIQUE,
+        usage_limit INTEGER NOT NULL,
+        times_used INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    ''')
+
+    # Columns added over time
+    add_column(conn, 'users', 'client_id', 'TEXT')
+    add_column(conn, 'users', 'client_secret', 'TEXT')
+    add_column(conn, 'users', 'auth_token', 'TEXT')
+    add_column(conn, 'users', 'is_admin', 'INTEGER DEFAULT 0')
+    add_column(conn, 'users', 'subscription_tier', "TEXT DEFAULT 'free'")
+    add_column(conn, 'users', 'paypal_sub_id', 'TEXT')
+    add_column(conn, 'users', 'subscription_end', 'TEXT')
+    add_column(conn, 'users', 'email', 'TEXT')
+    add_column(conn, 'users', 'reset_token', 'TEXT')
+    add_column(conn, 'users', 'reset_token_expiry', 'TEXT')
+    # ADD COLUMN cannot have a UNIQUE constraint in SQLite
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+
+    add_column(conn, 'live_streams', 'epg_channel_id', 'TEXT')
+    add_column(conn, 'live_streams', 'stream_title', 'TEXT')
+    add_column(conn, 'live_streams', 'stream_game', 'TEXT')
+    add_column(conn, 'vod_streams', 'thumbnail_url', 'TEXT')
+    add_column(conn, 'vod_streams', 'duration', 'INTEGER DEFAULT 0')
+
+def m002_poll_schedule(conn):
+    add_column(conn, 'live_streams', 'last_live_at', 'REAL')     # Dormant channels are polled rarely
+    add_column(conn, 'live_streams', 'vods_checked_at', 'REAL')  # VODs are refetched after a broadcast ends
+    # The UNIQUE(vod_id, channel_login) index can't be used for per-channel lookups (poller diff & GC)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vod_streams_channel_login ON vod_streams (channel_login, created_at)")
+
+def m003_app_token_cache(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS twitch_app_tokens (
+        client_id TEXT NOT NULL,
+        secret_digest TEXT NOT NULL,
+        token TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (client_id, secret_digest)
+    )
+    ''')
+
+def m004_poller_leases(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS poller_leases (
+        shard INTEGER PRIMARY KEY,
+        owner TEXT,
+        expires REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS poller_instances (
+        poller_id TEXT PRIMARY KEY,
+        heartbeat REAL NOT NULL
+    )
+    ''')
+
+def m005_hot_query_indexes(conn):
+    # Per-user channel lists and the live_streams/vod_streams joins filter on user_id
+    # (the UNIQUE(login_name, user_id) index leads with login_name)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channels_user_id ON channels (user_id, login_name)")
+    # EPG without a user filter only wants live channels
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_live_streams_live ON live_streams (login_name) WHERE is_live = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_reset_token ON users (reset_token) WHERE reset_token IS NOT NULL")
+
+def m006_settings_generation(conn):
+    # Bumped by triggers on every settings write (web UI, reset_pass.py, ...), so the
+    # in-process settings caches of the web app and the poller notice changes
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settings_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO settings_generation (id, generation) VALUES (1, 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS settings_generation_{event.lower()} AFTER {event} ON settings
+        BEGIN
+            UPDATE settings_generation SET generation = generation + 1 WHERE id = 1;
+        END
+        ''')
+
+def m007_catalog_generations(conn):
+    # Per-user counter behind the player_api catalog snapshots (streaming.py).
+    # Triggers bump it for every user whose channels, live rows or VODs change.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_generations (
+        user_id INTEGER PRIMARY KEY,
+        generation INTEGER NOT NULL
+    )
+    ''')
+    bump_users_of = '''
+        INSERT INTO catalog_generations (user_id, generation)
+        SELECT user_id, 1 FROM channels WHERE login_name = {login}
+        ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1;
+    '''
+    bump_user = '''
+        INSERT INTO catalog_generations (user_id, generation) VALUES ({user_id}, 1)
+        ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1;
+    '''
+    triggers = [
+        ('live_streams', 'INSERT', bump_users_of.format(login='NEW.login_name')),
+        ('live_streams', 'UPDATE', bump_users_of.format(login='NEW.login_name')),
+        ('live_streams', 'DELETE', bump_users_of.format(login='OLD.login_name')),
+        ('vod_streams', 'INSERT', bump_users_of.format(login='NEW.channel_login')),
+        ('vod_streams', 'UPDATE', bump_users_of.format(login='NEW.channel_login')),
+        ('vod_streams', 'DELETE', bump_users_of.format(login='OLD.channel_login')),
+        ('channels', 'INSERT', bump_user.format(user_id='NEW.user_id')),
+        ('channels', 'DELETE', bump_user.format(user_id='OLD.user_id')),
+        # Snapshots contain the username and the Twitch auth token (in the playback tokens)
+        ('users', 'UPDATE OF username, auth_token', bump_user.format(user_id='NEW.id')),
+    ]
+    for table, event, action in triggers:
+        name = f"catalog_generation_{table}_{event.split()[0].lower()}"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {action} END")
+
+def m008_vod_category_id(conn):
+    # Written by the poller, so get_vod_streams can filter a category in SQL
+    add_column(conn, 'vod_streams', 'category_id', 'TEXT')
+    conn.create_function('vod_category_id', 1, vod_category_id, deterministic=True)
+    conn.execute("UPDATE vod_streams SET category_id = vod_category_id(channel_login) WHERE category_id IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vod_streams_category_id ON vod_streams (category_id, created_at)")
+
+def m009_programme_history(conn):
+    # Title/game transitions written by the poller; the EPG is built from them.
+    # stop is NULL for the programme that is on air right now.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS programme_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        login_name TEXT NOT NULL,
+        start REAL NOT NULL,
+        stop REAL,
+        title TEXT,
+        game TEXT
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_programme_history_login_start ON programme_history (login_name, start)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_programme_history_stop ON programme_history (stop)")
+    # Channels live right now start with an open programme
+    conn.execute('''
+    INSERT INTO programme_history (login_name, start, title, game)
+    SELECT login_name, COALESCE(last_live_at, strftime('%s', 'now')), stream_title, stream_game
+    FROM live_streams WHERE is_live = 1
+    ''')
+
+def m010_image_cache(conn):
+    add_column(conn, 'live_streams', 'profile_image_url', 'TEXT')
+    add_column(conn, 'live_streams', 'box_art_url', 'TEXT')
+    # Twitch image URL -> file in instance/images/ (utils/image_cache.py)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS image_cache (
+        source_url TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_cache_path ON image_cache (path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_cache_last_used_at ON image_cache (last_used_at)")
+
+def m011_channel_events(conn):
+    # Viewer counts change with every refresh of a live channel. They're not in any
+    # catalog, so the catalog trigger on live_streams is narrowed to the other columns.
+    add_column(conn, 'live_streams', 'viewer_count', 'INTEGER')
+    conn.execute("DROP TRIGGER IF EXISTS catalog_generation_live_streams_update")
+    conn.execute('''
+    CREATE TRIGGER catalog_generation_live_streams_update
+    AFTER UPDATE OF login_name, display_name, is_live, category, epg_channel_id, stream_title, stream_game,
+                    last_live_at, vods_checked_at, profile_image_url, box_art_url ON live_streams
+    BEGIN
+        INSERT INTO catalog_generations (user_id, generation)
+        SELECT user_id, 1 FROM channels WHERE login_name = NEW.login_name
+        ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1;
+    END
+    ''')
+
+    # Status changes for the web UI's live updates (views.py, /api/channels/events).
+    # user_id NULL: for everyone following login_name; set: that user's channel list changed.
+    # Rows are only kept for a few minutes (poller.py, collect_garbage).
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS channel_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        login_name TEXT NOT NULL,
+        user_id INTEGER,
+        created_at REAL NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_events_created_at ON channel_events (created_at)")
+    now = "(julianday('now') - 2440587.5) * 86400.0"
+    status_changed = '''
+        OLD.is_live IS NOT NEW.is_live OR OLD.display_name IS NOT NEW.display_name OR OLD.stream_title IS NOT NEW.stream_title
+        OR OLD.stream_game IS NOT NEW.stream_game OR OLD.viewer_count IS NOT NEW.viewer_count
+    '''
+    triggers = [
+        ('live_streams_insert', 'INSERT ON live_streams', '', f"VALUES (NEW.login_name, NULL, {now})"),
+        ('live_streams_update', 'UPDATE ON live_streams', f"WHEN {status_changed}", f"VALUES (NEW.login_name, NULL, {now})"),
+        ('channels_insert', 'INSERT ON channels', '', f"VALUES (NEW.login_name, NEW.user_id, {now})"),
+        ('channels_delete', 'DELETE ON channels', '', f"VALUES (OLD.login_name, OLD.user_id, {now})"),
+    ]
+    for name, event, when, values in triggers:
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS channel_events_{name} AFTER {event} {when}
+        BEGIN
+            INSERT INTO channel_events (login_name, user_id, created_at) {values};
+        END
+        """)
+
+def m012_playback_token_revocation(conn):
+    # Playback tokens are bound to the password hash (streaming.py, playback_key), so
+    # a password change must rebuild the catalog snapshots that contain them.
+    conn.execute("DROP TRIGGER IF EXISTS catalog_generation_users_update")
+    conn.execute('''
+    CREATE TRIGGER catalog_generation_users_update
+    AFTER UPDATE OF username, auth_token, password_hash ON users
+    BEGIN
+        INSERT INTO catalog_generations (user_id, generation) VALUES (NEW.id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1;
+    END
+    ''')
+
+def m013_schedule_generation(conn):
+    # Bumped by triggers whenever the set of monitored channels or the credentials
+    # they're polled with change, so the poller only reloads its schedule then
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO schedule_generation (id, generation) VALUES (1, 0)")
+    for name, event in (('channels_insert', 'INSERT ON channels'),
+                        ('channels_update', 'UPDATE OF login_name, user_id ON channels'),
+                        ('channels_delete', 'DELETE ON channels'),
+                        ('users_update', 'UPDATE OF username, client_id, client_secret ON users'),
+                        ('users_delete', 'DELETE ON users')):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS schedule_generation_{name} AFTER {event}
+        BEGIN
+            UPDATE schedule_generation SET generation = generation + 1 WHERE id = 1;
+        END
+        ''')
+
+MIGRATIONS = [
+    (1, 'Baseline schema', m001_baseline),
+    (2, 'Poll schedule state', m002_poll_schedule),
+    (3, 'Persistent app token cache', m003_app_token_cache),
+    (4, 'Poller shard leases', m004_poller_leases),
+    (5, 'Indexes for hot queries', m005_hot_query_indexes),
+    (6, 'Settings generation counter', m006_settings_generation),
+    (7, 'Catalog generation counters', m007_catalog_generations),
+    (8, 'VOD category IDs', m008_vod_category_id),
+    (9, 'Programme history for the EPG', m009_programme_history),
+    (10, 'Image cache', m010_image_cache),
+    (11, 'Channel status events', m011_channel_events),
+    (12, 'Revoke playback tokens on password changes', m012_playback_token_revocation),
+    (13, 'Schedule generation counter', m013_schedule_generation),
+]
+
+# --- Runner ---
+def get_schema_version(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn, log=print):
+    """Applies all pending migrations, each in its own transaction. Returns the new version.
+
+    conn must be in autocommit mode (isolation_level=None), so the transactions
+    here are the only ones.
+    """
+    current = get_schema_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                conn.execute("ROLLBACK")
+                continue
+            apply(conn)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        log(f"  > Applied migration {version:03d}: {description}")
+        current = version
+    return current
@@ -1,21 +1,70 @@
 import sqlite3
 import gevent
+import gevent.pool
 from gevent import monkey
 monkey.patch_all() 
 
 import time
+import heapq
+import random
 import streamlink
 from streamlink.exceptions import NoPluginError, PluginError
 import os
 import requests
 import logging
 import sys
+import signal
+import socket
+import zlib
+import argparse
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from utils.crypto import encrypt, decrypt, keyed_digest
+from utils import sqlite_pool
+from utils.categories import vod_category_id
+from utils import image_cache
+from utils.logs import setup_logging
 
 # --- Configuration ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'instance', 'channels.db')
+LOG_RING_PATH = os.path.join(BASE_DIR, 'instance', 'logs.ring')
+IMAGES_DIR = image_cache.IMAGES_DIR
 POLL_INTERVAL = 60 # seconds
 
+# --- Scheduling ---
+LIVE_REFRESH_INTERVAL = 60         # Live channels get their title/game refreshed this often
+DORMANT_AFTER = 14 * 24 * 3600     # Channels not live for two weeks count as dormant...
+DORMANT_POLL_FACTOR = 6            # ...and are only polled every poll_interval * 6
+SCHEDULE_SYNC_INTERVAL = 15        # Max. sleep between passes, so new channels are picked up quickly
+SCHEDULE_RELOAD_INTERVAL = 300     # Safety net: the monitored channels are reloaded at least this often
+FULL_GC_INTERVAL = 3600            # Full sweep for stale rows (removed channels are GC'd right away)
+API_RETRY_DELAY = 60               # Channels whose poll failed are retried after this
+PROGRAMME_HISTORY_DAYS = 7         # Past programmes kept for the EPG (catch-up)
+CHANNEL_EVENTS_TTL = 600           # Status changes kept for the web UI's live updates (see views.py)
+VIEWER_COUNT_CHANGE = 0.2          # Viewer counts alone only rewrite a row if they moved by this fraction...
+VIEWER_COUNT_MIN_CHANGE = 20       # ...and at least this many viewers
+
+# --- Image Cache ---
+IMAGE_FETCHES_PER_PASS = 100       # New images downloaded per pass (the rest follow later)
+IMAGE_FETCH_CONCURRENCY = 8
+IMAGE_UNUSED_TTL = 3 * 24 * 3600   # Images no row refers to any more are kept this long...
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_MB', '512')) * 1024 * 1024 # ...unless over budget (referenced ones always stay)
+
+# --- Sharding ---
+# Channels are split into POLLER_SHARDS shards (by hash of the login name). Every
+# poller process leases a fair share of them via the poller_leases table, renews
+# its leases with a heartbeat and takes over shards whose lease expired.
+POLLER_SHARDS = max(1, int(os.environ.get('POLLER_SHARDS', '1')))
+POLLER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = 60
+LEASE_HEARTBEAT_INTERVAL = 10
+
+# --- App Tokens ---
+TOKEN_REFRESH_MARGIN = 3600        # Tokens expiring within this window are refreshed in the background
+TOKEN_REFRESH_CHECK_INTERVAL = 300
+
 # --- Helper function (boot time only) ---
 def get_startup_log_level():
     """Reads the log level from the DB *before* the logger is configured."""
@@ -33,20 +82,6 @@ def get_startup_log_level():
     print(f"[Poller-Boot] Setting log level to '{level_str}'.")
     return logging.ERROR if level_str == 'error' else logging.INFO
 
-# --- START Logging Config (Dynamic) ---
-log_level = get_startup_log_level()
-logging.basicConfig(
-    level=log_level,
-    format='%(asctime)s %(levelname)s [Poller] - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logging.warning("--------------------------------------")
-logging.warning(f"Poller service starting... (Log Level: {logging.getLevelName(log_level)})")
-logging.warning("--------------------------------------")
-# --- END Logging Config ---
-
 
 # --- Twitch API Helper Functions ---
 TWITCH_AUTH_URL = 'https://id.twitch.tv/oauth2/token'
@@ -54,19 +89,66 @@ TWITCH_API_URL_USERS = 'https://api.twitch.tv/helix/users'
 TWITCH_API_URL_VIDEOS = 'https://api.twitch.tv/helix/videos'
 TWITCH_API_URL_STREAMS = 'https://api.twitch.tv/helix/streams'
 
-# Cache for tokens: Key=(client_id, client_secret), Value={'token': str, 'expires': float}
+# Twitch API requests and failed ones since start: Key=endpoint ('token', 'users', 'streams', 'videos')
+api_calls = Counter()
+api_errors = Counter()
+
+# Cache for tokens: Key=(client_id, secret_digest), Value={'token': str, 'expires': float}
+# Persisted (encrypted) in the twitch_app_tokens table, so restarts don't re-request them.
 token_cache = {}
 
+# Cache for Twitch user IDs: Key=login_name, Value=str (IDs never change for a login)
+twitch_id_cache = {}
+# Avatars seen with the IDs: Key=login_name, Value=profile_image_url
+profile_image_urls = {}
+# Key=(client_id, client_secret, username), Value=time their last auth failed
+auth_failures = {}
+
+# --- Per-Channel Schedule ---
+# Priority queue of (due_time, login_name). Entries are invalidated lazily:
+# only the entry matching next_due[login_name] is still valid.
+schedule_heap = []
+next_due = {}
+# In-memory copy of the live_streams rows: Key=login_name, Value=dict of LIVE_STREAM_COLUMNS
+# (None if the channel has no row yet). Used to write only rows that changed.
+channel_state = {}
+
+LIVE_STREAM_COLUMNS = ('login_name', 'epg_channel_id', 'display_name', 'is_live', 'stream_title', 'stream_game', 'last_live_at', 'vods_checked_at',
+                       'profile_image_url', 'box_art_url', 'viewer_count')
+VOD_STREAM_COLUMNS = ('vod_id', 'channel_login', 'title', 'created_at', 'category', 'thumbnail_url', 'duration', 'category_id')
+
+# Rows written by the last update pass (see update_database)
+last_cycle_changes = {}
+# Seconds the last pass waited for the write lock and then held it
+last_cycle_write_timing = {'lock_wait': 0.0, 'write': 0.0}
+last_full_gc = 0
+
+# Shards this process currently holds a lease on
+owned_shards = set()
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Takes a connection from the shared pool. Hand it back with release_db_connection()."""
+    return sqlite_pool.acquire(DB_PATH)
+
+def release_db_connection(conn):
+    sqlite_pool.release(conn, DB_PATH)
+
+# Parsed settings, reloaded when settings_generation changes (bumped by triggers on every settings write)
+settings_cache = {'generation': None, 'settings': None}
+# VOD lists fetched before this were fetched with other VOD settings
+vod_settings_changed_at = 0
 
 def get_base_settings():
     """Fetches global settings that are not user-specific."""
+    global vod_settings_changed_at
     conn = get_db_connection()
-    settings_raw = conn.execute('SELECT key, value FROM settings').fetchall()
-    conn.close()
+    try:
+        generation = conn.execute("SELECT generation FROM settings_generation WHERE id = 1").fetchone()[0]
+        if generation == settings_cache['generation']:
+            return settings_cache['settings']
+        settings_raw = conn.execute('SELECT key, value FROM settings').fetchall()
+    finally:
+        release_db_connection(conn)
     settings = {row['key']: row['value'] for row in settings_raw}
     
     settings.setdefault('vod_enabled', 'false')
@@ -82,21 +164,90 @@ def get_base_settings():
         settings['poll_interval'] = int(settings.get('poll_interval', '300')) # Default 300s (5m)
     except ValueError:
         settings['poll_interval'] = 300
-    
+
+    # Log level changes from the web UI apply without a restart
+    new_level = logging.ERROR if settings.get('log_level') == 'error' else logging.INFO
+    root_logger = logging.getLogger()
+    if root_logger.level != new_level:
+        root_logger.setLevel(new_level)
+        logging.warning(f"[Poller] Log level set to {logging.getLevelName(new_level)} at runtime.")
+
+    # Turning VODs on or changing their count refetches every VOD list, right away
+    old = settings_cache['settings']
+    vod_settings = (settings['vod_enabled'], settings['vod_count_per_channel'])
+    if old and settings['vod_enabled'] and vod_settings != (old['vod_enabled'], old['vod_count_per_channel']):
+        vod_settings_changed_at = time.time()
+        for login_name in list(next_due):
+            schedule_channel(login_name, vod_settings_changed_at)
+        logging.info(f"[Poller] VOD settings changed, refetching the VODs of {len(next_due)} channel(s).")
+
+    settings_cache['generation'] = generation
+    settings_cache['settings'] = settings
     return settings
 
-def get_twitch_app_token(client_id, client_secret):
-    """Fetches a token for a specific ID/Secret pair. Caches result."""
-    global token_cache
-    
-    cache_key = (client_id, client_secret)
-    cached = token_cache.get(cache_key)
-    
-    # Check cache validity
-    if cached and time.time() < cached['expires']:
-        return cached['token']
+# --- App Token Cache ---
+def token_cache_key(client_id, client_secret):
+    # Never keep the client secret itself in the token table
+    return (client_id, keyed_digest(client_secret, 'twitch-client-secret'))
+
+def load_token_cache():
+    """Loads persisted app tokens into token_cache (called once at startup)."""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute("SELECT client_id, secret_digest, token, expires FROM twitch_app_tokens").fetchall()
+        now = time.time()
+        loaded = 0
+        for row in rows:
+            token = decrypt(row['token'], 'twitch-app-token')
+            if token and row['expires'] > now:
+                token_cache[(row['client_id'], row['secret_digest'])] = {'token': token, 'expires': row['expires']}
+                loaded += 1
+        # Expired or undecryptable (SECRET_KEY changed) tokens are useless
+        with conn:
+            conn.execute("DELETE FROM twitch_app_tokens WHERE expires <= ?", (now,))
+        logging.info(f"[Poller-Auth] Loaded {loaded} cached app token(s) from DB.")
+    except Exception as e:
+        logging.error(f"[Poller-Auth] ERROR: Could not load cached app tokens: {e}")
+    finally:
+        release_db_connection(conn)
+
+def store_token(cache_key, entry):
+    """Persists a token (encrypted with SECRET_KEY)."""
+    client_id, secret_digest = cache_key
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO twitch_app_tokens (client_id, secret_digest, token, expires) VALUES (?, ?, ?, ?)",
+                (client_id, secret_digest, encrypt(entry['token'], 'twitch-app-token'), entry['expires'])
+            )
+    except Exception as e:
+        logging.error(f"[Poller-Auth] ERROR: Could not persist app token for ID {client_id[:4]}...: {e}")
+    finally:
+        release_db_connection(conn)
+
+def invalidate_twitch_app_token(client_id):
+    """Drops all tokens of a Client ID (e.g. after a 401), so the next use requests a new one."""
+    for key in [k for k in token_cache if k[0] == client_id]:
+        del token_cache[key]
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM twitch_app_tokens WHERE client_id = ?", (client_id,))
+    except Exception as e:
+        logging.error(f"[Poller-Auth] ERROR: Could not delete app token for ID {client_id[:4]}...: {e}")
+    finally:
+        release_db_connection(conn)
+    logging.warning(f"[Poller-Auth] Token for Client ID {client_id[:4]}... rejected by Twitch (401). Invalidated.")
+
+def is_unauthorized(error):
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 401
 
+def request_twitch_app_token(client_id, client_secret):
+    """Requests a new client-credentials token and caches it (memory + DB)."""
     logging.info(f"[Poller-Auth] Requesting new token for Client ID {client_id[:4]}...")
+    api_calls['token'] += 1
     try:
         response = requests.post(
             TWITCH_AUTH_URL,
@@ -113,14 +264,78 @@ def get_twitch_app_token(client_id, client_secret):
         token = data['access_token']
         expires = time.time() + data['expires_in'] - 60
         
+        cache_key = token_cache_key(client_id, client_secret)
         token_cache[cache_key] = {'token': token, 'expires': expires}
+        store_token(cache_key, token_cache[cache_key])
         logging.info(f"[Poller-Auth] Token acquired for Client ID {client_id[:4]}...")
         return token
     except Exception as e:
+        api_errors['token'] += 1
         logging.error(f"[Poller-Auth] ERROR: Failed to get Twitch token for ID {client_id[:4]}...: {e}")
         return None
 
+def load_stored_token(cache_key):
+    """Picks up a token another poller process stored in the meantime."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT token, expires FROM twitch_app_tokens WHERE client_id = ? AND secret_digest = ?", cache_key
+        ).fetchone()
+    finally:
+        release_db_connection(conn)
+    token = decrypt(row['token'], 'twitch-app-token') if row else None
+    if not token:
+        return None
+    token_cache[cache_key] = {'token': token, 'expires': row['expires']}
+    return token_cache[cache_key]
+
+def get_twitch_app_token(client_id, client_secret):
+    """Fetches a token for a specific ID/Secret pair. Caches result."""
+    cache_key = token_cache_key(client_id, client_secret)
+    cached = token_cache.get(cache_key)
+    
+    # Check cache validity
+    if cached and time.time() < cached['expires']:
+        return cached['token']
+
+    cached = load_stored_token(cache_key)
+    if cached and time.time() < cached['expires']:
+        return cached['token']
+
+    return request_twitch_app_token(client_id, client_secret)
+
+def refresh_expiring_tokens():
+    """Renews tokens that expire soon, so polling never waits for id.twitch.tv."""
+    conn = get_db_connection()
+    try:
+        creds = conn.execute(
+            "SELECT DISTINCT client_id, client_secret FROM users WHERE client_id IS NOT NULL AND client_secret IS NOT NULL"
+        ).fetchall()
+    finally:
+        release_db_connection(conn)
+
+    now = time.time()
+    for row in creds:
+        cache_key = token_cache_key(row['client_id'], row['client_secret'])
+        cached = token_cache.get(cache_key)
+        if cached and cached['expires'] - now < TOKEN_REFRESH_MARGIN:
+            # Another poller process may have renewed it already
+            cached = load_stored_token(cache_key) or cached
+            if cached['expires'] - now < TOKEN_REFRESH_MARGIN:
+                request_twitch_app_token(row['client_id'], row['client_secret'])
+                gevent.sleep(1) # Spread renewals out
+
+def token_refresher():
+    """Background greenlet for refresh_expiring_tokens()."""
+    while True:
+        gevent.sleep(TOKEN_REFRESH_CHECK_INTERVAL)
+        try:
+            refresh_expiring_tokens()
+        except Exception as e:
+            logging.error(f"[Poller-Auth] ERROR: Background token refresh failed: {e}")
+
 def get_user_ids(token, client_id, login_names):
+    """Returns {login_name: twitch_user_id} (logins that don't exist are missing), or None if a request failed."""
     if not login_names:
         return {}
     
@@ -131,15 +346,22 @@ def get_user_ids(token, client_id, login_names):
             headers = {'Client-ID': client_id, 'Authorization': f'Bearer {token}'}
             params = [('login', name) for name in chunk]
             
+            api_calls['users'] += 1
             response = requests.get(TWITCH_API_URL_USERS, headers=headers, params=params, timeout=30)
             response.raise_for_status()
             data = response.json().get('data', [])
             
             for user in data:
                 user_id_map[user['login']] = user['id']
+                if user.get('profile_image_url'):
+                    profile_image_urls[user['login']] = image_cache.profile_image_url(user['profile_image_url'])
             
         except Exception as e:
+            api_errors['users'] += 1
+            if is_unauthorized(e):
+                invalidate_twitch_app_token(client_id)
             logging.error(f"[Poller-API] ERROR: Failed to get Twitch User IDs: {e}")
+            return None
     
     return user_id_map
 
@@ -153,14 +375,19 @@ def get_channel_vods(token, client_id, user_id, vod_count):
             'first': vod_count
         }
         
+        api_calls['videos'] += 1
         response = requests.get(TWITCH_API_URL_VIDEOS, headers=headers, params=params, timeout=30)
         response.raise_for_status()
         return response.json().get('data', [])
     except Exception as e:
+        api_errors['videos'] += 1
+        if is_unauthorized(e):
+            invalidate_twitch_app_token(client_id)
         logging.error(f"[Poller-API] ERROR: Failed to get VODs for {user_id}: {e}")
         return []
 
 def get_live_streams_info(token, client_id, user_id_map):
+    """Returns {twitch_user_id: {'title', 'game', 'viewers', 'started_at', 'box_art_url'}} for live channels, or None if the request failed."""
     if not user_id_map:
         return {}
         
@@ -174,6 +401,7 @@ def get_live_streams_info(token, client_id, user_id_map):
             chunk = user_ids[i:i+100]
             params = [('user_id', user_id) for user_id in chunk]
             
+            api_calls['streams'] += 1
             response = requests.get(TWITCH_API_URL_STREAMS, headers=headers, params=params, timeout=30)
             response.raise_for_status()
             data = response.json().get('data', [])
@@ -181,106 +409,618 @@ def get_live_streams_info(token, client_id, user_id_map):
             for stream in data:
                 live_stream_map[stream['user_id']] = {
                     "title": stream.get('title', ''),
-                    "game": stream.get('game_name', '')
+                    "game": stream.get('game_name', ''),
+                    "viewers": stream.get('viewer_count'),
+                    "started_at": parse_timestamp(stream.get('started_at')),
+                    "box_art_url": image_cache.box_art_url(stream.get('game_id'))
                 }
                 
     except Exception as e:
+        api_errors['streams'] += 1
+        if is_unauthorized(e):
+            invalidate_twitch_app_token(client_id)
         logging.error(f"[Poller-API] ERROR: Failed to get stream info: {e}")
+        # Unknown is not offline: callers must not treat a failed poll as "everyone went offline"
+        return None
     
     return live_stream_map
 
+# --- Shard Leases ---
+def shard_of(login_name):
+    return zlib.crc32(login_name.encode('utf-8')) % POLLER_SHARDS
+
+def heartbeat_leases():
+    """Renews our leases and rebalances: claims free or expired shards up to our
+    fair share, releases shards beyond it (e.g. after another poller joined).
+
+    Runs in one write transaction, so two pollers can never claim the same shard.
+    """
+    global owned_shards
+    conn = get_db_connection()
+    try:
+        now = time.time()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO poller_instances (poller_id, heartbeat) VALUES (?, ?)", (POLLER_ID, now))
+            conn.execute("DELETE FROM poller_instances WHERE heartbeat < ?", (now - LEASE_TTL,))
+            active = conn.execute("SELECT COUNT(*) FROM poller_instances").fetchone()[0]
+            fair_share = -(-POLLER_SHARDS // max(active, 1)) # ceil
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO poller_leases (shard, owner, expires) VALUES (?, NULL, 0)",
+                [(shard,) for shard in range(POLLER_SHARDS)]
+            )
+            conn.execute("DELETE FROM poller_leases WHERE shard >= ?", (POLLER_SHARDS,))
+
+            # Renew ours
+            conn.execute("UPDATE poller_leases SET expires = ? WHERE owner = ?", (now + LEASE_TTL, POLLER_ID))
+            mine = [row['shard'] for row in conn.execute(
+                "SELECT shard FROM poller_leases WHERE owner = ? ORDER BY shard", (POLLER_ID,)
+            ).fetchall()]
+
+            # Release what's beyond our fair share
+            released = mine[fair_share:]
+            if released:
+                conn.executemany(
+                    "UPDATE poller_leases SET owner = NULL, expires = 0 WHERE shard = ? AND owner = ?",
+                    [(shard, POLLER_ID) for shard in released]
+                )
+                mine = mine[:fair_share]
+
+            # Claim free or expired shards (takeover of crashed pollers)
+            claimed = []
+            if len(mine) < fair_share:
+                free = [row['shard'] for row in conn.execute(
+                    "SELECT shard FROM poller_leases WHERE owner IS NULL OR expires < ? ORDER BY shard", (now,)
+                ).fetchall()]
+                for shard in free[:fair_share - len(mine)]:
+                    conn.execute(
+                        "UPDATE poller_leases SET owner = ?, expires = ? WHERE shard = ?",
+                        (POLLER_ID, now + LEASE_TTL, shard)
+                    )
+                    claimed.append(shard)
+
+        if released or claimed:
+            logging.info(f"[Poller-Lease] Claimed shards {claimed}, released {released}. Now holding {len(mine) + len(claimed)}/{POLLER_SHARDS} ({active} poller(s) active).")
+        owned_shards = set(mine + claimed)
+    except Exception as e:
+        # Keep polling what we hold; the lease simply expires if this keeps failing
+        logging.error(f"[Poller-Lease] ERROR: Lease heartbeat failed: {e}")
+    finally:
+        release_db_connection(conn)
+
+def release_leases():
+    """Hands our shards back right away (on shutdown), instead of letting them expire."""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("UPDATE poller_leases SET owner = NULL, expires = 0 WHERE owner = ?", (POLLER_ID,))
+            conn.execute("DELETE FROM poller_instances WHERE poller_id = ?", (POLLER_ID,))
+        logging.warning(f"[Poller-Lease] Released all leases of {POLLER_ID}.")
+    except Exception as e:
+        logging.error(f"[Poller-Lease] ERROR: Could not release leases: {e}")
+    finally:
+        release_db_connection(conn)
+
+def lease_heartbeat():
+    """Background greenlet for heartbeat_leases()."""
+    while True:
+        gevent.sleep(LEASE_HEARTBEAT_INTERVAL)
+        heartbeat_leases()
+
+def shutdown(*args):
+    release_leases()
+    sys.exit(0)
+
+# --- Change Tracking Helpers ---
+def live_row_state(row):
+    """Normalizes a live_streams row so it compares equal to freshly polled data."""
+    state = {col: row[col] for col in LIVE_STREAM_COLUMNS}
+    state['is_live'] = bool(state['is_live'])
+    return state
+
+def live_row_changed(old, new):
+    """Whether a polled state must be written. Viewer counts change on every refresh of
+    a live channel, so they only count once they moved noticeably from the stored one.
+    """
+    if old is None or any(old[col] != new[col] for col in LIVE_STREAM_COLUMNS if col != 'viewer_count'):
+        return True
+    before, after = old['viewer_count'], new['viewer_count']
+    if before is None or after is None:
+        return before != after
+    return abs(after - before) >= max(VIEWER_COUNT_MIN_CHANGE, before * VIEWER_COUNT_CHANGE)
+
+# --- Scheduler Helpers ---
+def schedule_channel(login_name, due):
+    """(Re-)schedules a channel. Older heap entries for it become stale."""
+    next_due[login_name] = due
+    heapq.heappush(schedule_heap, (due, login_name))
+
+def unschedule_channel(login_name):
+    next_due.pop(login_name, None)
+    channel_state.pop(login_name, None)
+
+def pop_due_channels(now):
+    """Pops all channels whose next-due time has passed."""
+    due_logins = []
+    while schedule_heap and schedule_heap[0][0] <= now:
+        due, login_name = heapq.heappop(schedule_heap)
+        if next_due.get(login_name) == due:
+            del next_due[login_name]
+            due_logins.append(login_name)
+    return due_logins
+
+def seconds_until_next_due(now):
+    """How long the main loop may sleep before the next channel is due."""
+    # Drop stale entries at the top so they don't cause early wake-ups
+    while schedule_heap and next_due.get(schedule_heap[0][1]) != schedule_heap[0][0]:
+        heapq.heappop(schedule_heap)
+    if not schedule_heap:
+        return SCHEDULE_SYNC_INTERVAL
+    return min(SCHEDULE_SYNC_INTERVAL, max(1, schedule_heap[0][0] - now))
+
+def next_poll_delay(is_live, last_live_at, poll_interval, now):
+    """Live channels are refreshed often, long-dormant ones rarely."""
+    if is_live:
+        delay = min(LIVE_REFRESH_INTERVAL, poll_interval)
+    elif last_live_at and now - last_live_at > DORMANT_AFTER:
+        delay = poll_interval * DORMANT_POLL_FACTOR
+    else:
+        delay = poll_interval
+    # Jitter spreads channels over time instead of polling them in lockstep
+    return delay * random.uniform(0.9, 1.1)
+
+# Monitored channels and their credentials, reloaded when schedule_generation changes
+# (bumped by triggers on channels and the users' credentials) or every SCHEDULE_RELOAD_INTERVAL
+monitored_cache = {'generation': None, 'loaded_at': 0, 'monitored': {}}
+
+def get_monitored(conn):
+    """Returns a map of login_name -> list of (client_id, client_secret, username),
+    the distinct credentials of the users following each channel (oldest user first)."""
+    now = time.time()
+    generation = conn.execute("SELECT generation FROM schedule_generation WHERE id = 1").fetchone()[0]
+    if generation == monitored_cache['generation'] and now - monitored_cache['loaded_at'] < SCHEDULE_RELOAD_INTERVAL:
+        return monitored_cache['monitored']
+
+    rows = conn.execute("""
+        SELECT c.login_name, u.username, u.client_id, u.client_secret
+        FROM channels c
+        JOIN users u ON c.user_id = u.id
+        WHERE u.client_id IS NOT NULL AND u.client_secret IS NOT NULL
+        ORDER BY u.id
+    """).fetchall()
+
+    monitored = {}
+    for row in rows:
+        creds = monitored.setdefault(row['login_name'], [])
+        if all((c_id, c_secret) != (row['client_id'], row['client_secret']) for c_id, c_secret, _ in creds):
+            creds.append((row['client_id'], row['client_secret'], row['username']))
+    monitored_cache.update(generation=generation, loaded_at=now, monitored=monitored)
+    return monitored
+
+def sync_schedule(conn):
+    """Syncs the schedule with the channels table.
+
+    Returns (channel_creds, removed_logins): the monitored channels of our shards
+    with their credentials in the order they're tried (see get_monitored), and the
+    channels nobody monitors any more.
+    """
+    monitored = get_monitored(conn)
+    channel_creds = {l: creds for l, creds in monitored.items() if shard_of(l) in owned_shards}
+
+    # Channels we don't poll any more: either nobody monitors them (GC) or
+    # their shard moved to another poller (state is reloaded if it comes back)
+    dropped = [l for l in next_due if l not in channel_creds]
+    for login_name in dropped:
+        unschedule_channel(login_name)
+    removed_logins = [l for l in dropped if l not in monitored]
+
+    # Load the stored rows of channels we don't know (yet)
+    unknown = [l for l in channel_creds if l not in channel_state]
+    if unknown:
+        columns = ', '.join(LIVE_STREAM_COLUMNS)
+        known = {row['login_name']: row for row in conn.execute(f"SELECT {columns} FROM live_streams").fetchall()}
+        for login_name in unknown:
+            row = known.get(login_name)
+            channel_state[login_name] = live_row_state(row) if row else None
+
+    # New channels are due immediately
+    new_logins = [l for l in channel_creds if l not in next_due]
+    if new_logins:
+        now = time.time()
+        for login_name in new_logins:
+            schedule_channel(login_name, now)
+        logging.info(f"[Poller-Schedule] {len(new_logins)} new channel(s) scheduled.")
+
+    return channel_creds, removed_logins
+
+# --- Image Cache ---
+def fetch_images(conn, urls, now):
+    """Downloads the images (of urls) that aren't cached yet, at most IMAGE_FETCHES_PER_PASS.
+
+    Returns image_cache rows to insert. Nothing is written here.
+    """
+    missing = [
+        url for url in dict.fromkeys(u for u in urls if u)
+        if not conn.execute("SELECT 1 FROM image_cache WHERE source_url = ?", (url,)).fetchone()
+    ][:IMAGE_FETCHES_PER_PASS]
+    if not missing:
+        return []
+    pool = gevent.pool.Pool(IMAGE_FETCH_CONCURRENCY)
+    results = pool.map(lambda url: image_cache.fetch_image(url, IMAGES_DIR), missing)
+    rows = [(url, result[0], result[1], now, now) for url, result in zip(missing, results) if result]
+    logging.info(f"[Poller-Images] Cached {len(rows)} of {len(missing)} new image(s).")
+    return rows
+
+def store_images(conn, rows):
+    conn.executemany(
+        "INSERT OR IGNORE INTO image_cache (source_url, path, size, fetched_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+
+def backfill_images(conn, now):
+    """Caches images of rows written before their image was cached (e.g. over the
+    per-pass limit). Writes in its own transaction and touches the rows, so the
+    web app's catalog snapshots switch to the local copies.
+    """
+    referenced = conn.execute("""
+        SELECT login_name, url FROM (
+            SELECT login_name, profile_image_url AS url FROM live_streams
+            UNION ALL SELECT login_name, box_art_url FROM live_streams
+            UNION ALL SELECT channel_login, thumbnail_url FROM vod_streams
+        ) WHERE url IS NOT NULL AND NOT EXISTS (SELECT 1 FROM image_cache i WHERE i.source_url = url)
+        LIMIT ?
+    """, (IMAGE_FETCHES_PER_PASS,)).fetchall()
+    rows = fetch_images(conn, [row['url'] for row in referenced], now)
+    if not rows:
+        return 0
+    cached = {row[0] for row in rows}
+    touched = [(row['login_name'], row['url']) for row in referenced if row['url'] in cached]
+    with conn:
+        store_images(conn, rows)
+        conn.executemany(
+            "UPDATE live_streams SET profile_image_url = profile_image_url WHERE login_name = ?1 AND (profile_image_url = ?2 OR box_art_url = ?2)",
+            touched
+        )
+        conn.executemany(
+            "UPDATE vod_streams SET thumbnail_url = thumbnail_url WHERE channel_login = ? AND thumbnail_url = ?",
+            touched
+        )
+    return len(rows)
+
+def collect_images(conn, now):
+    """Evicts images no row refers to for IMAGE_UNUSED_TTL, then the ones unused the
+    longest while the cache is over IMAGE_CACHE_MAX_BYTES. Images a row still refers to
+    are never evicted (the catalogs and artifacts point at them). Must run inside a
+    transaction; returns the file paths to remove once it has committed.
+    """
+    conn.execute("""
+        UPDATE image_cache SET last_used_at = ? WHERE source_url IN (
+            SELECT profile_image_url FROM live_streams
+            UNION SELECT box_art_url FROM live_streams
+            UNION SELECT thumbnail_url FROM vod_streams
+        )
+    """, (now,))
+    evicted = conn.execute(
+        "SELECT source_url, path FROM image_cache WHERE last_used_at < ?", (now - IMAGE_UNUSED_TTL,)
+    ).fetchall()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM image_cache WHERE last_used_at >= ?", (now - IMAGE_UNUSED_TTL,)).fetchone()[0]
+    if total > IMAGE_CACHE_MAX_BYTES:
+        # Referenced images were just touched (last_used_at = now)
+        for row in conn.execute(
+            "SELECT source_url, path, size FROM image_cache WHERE last_used_at >= ? AND last_used_at < ? ORDER BY last_used_at",
+            (now - IMAGE_UNUSED_TTL, now)
+        ):
+            if total <= IMAGE_CACHE_MAX_BYTES:
+                break
+            evicted.append(row)
+            total -= row['size']
+
+    conn.executemany("DELETE FROM image_cache WHERE source_url = ?", [(row['source_url'],) for row in evicted])
+    # Several URLs can share one file (same content)
+    return [
+        path for path in {row['path'] for row in evicted}
+        if not conn.execute("SELECT 1 FROM image_cache WHERE path = ?", (path,)).fetchone()
+    ]
+
+def collect_garbage(conn, removed_logins, full=False):
+    """Deletes live_streams rows and programme history of unmonitored channels, VODs of
+    unfollowed channels, programmes older than PROGRAMME_HISTORY_DAYS and status
+    events older than CHANNEL_EVENTS_TTL (the last on every pass).
+
+    Channels removed since the last pass are deleted by primary key. A full sweep
+    joins against the channels table instead of binding every login, so it
+    works for any number of channels. Must run inside a transaction.
+    """
+    deleted = max(conn.execute(
+        "DELETE FROM channel_events WHERE created_at < ?", (time.time() - CHANNEL_EVENTS_TTL,)
+    ).rowcount, 0)
+    if removed_logins:
+        params = [(l,) for l in removed_logins]
+        deleted += max(conn.executemany("DELETE FROM live_streams WHERE login_name = ?", params).rowcount, 0)
+        # VODs are kept as long as anyone follows the channel (even without credentials)
+        deleted += max(conn.executemany(
+            "DELETE FROM vod_streams WHERE channel_login = ? AND NOT EXISTS (SELECT 1 FROM channels WHERE login_name = ?)",
+            [(l, l) for l in removed_logins]
+        ).rowcount, 0)
+        deleted += max(conn.executemany("DELETE FROM programme_history WHERE login_name = ?", params).rowcount, 0)
+
+    if full:
+        deleted += max(conn.execute("""
+            DELETE FROM live_streams WHERE NOT EXISTS (
+                SELECT 1 FROM channels c
+                JOIN users u ON c.user_id = u.id
+                WHERE c.login_name = live_streams.login_name
+                  AND u.client_id IS NOT NULL AND u.client_secret IS NOT NULL
+            )
+        """).rowcount, 0)
+        deleted += max(conn.execute("""
+            DELETE FROM vod_streams WHERE NOT EXISTS (
+                SELECT 1 FROM channels c WHERE c.login_name = vod_streams.channel_login
+            )
+        """).rowcount, 0)
+        deleted += max(conn.execute(
+            "DELETE FROM programme_history WHERE stop < ?", (time.time() - PROGRAMME_HISTORY_DAYS * 86400,)
+        ).rowcount, 0)
+        deleted += max(conn.execute("""
+            DELETE FROM programme_history WHERE NOT EXISTS (
+                SELECT 1 FROM live_streams l WHERE l.login_name = programme_history.login_name
+            )
+        """).rowcount, 0)
+
+    return deleted
+
 # --- Main Poller Function ---
 def update_database():
-    logging.info("[Poller] Starting update cycle...")
-    
+    """Polls all channels that are due according to the schedule.
+
+    All Twitch API calls happen first. The fetched state is then diffed against
+    the in-memory rows, and only rows that actually changed are written, in one
+    short transaction. Returns the per-pass change counter.
+    """
+    global last_cycle_changes, last_cycle_write_timing, last_full_gc
     settings = get_base_settings()
     conn = get_db_connection()
-    cursor = conn.cursor()
+    changes = {'live_streams': 0, 'vod_upserts': 0, 'vod_deletes': 0, 'programmes': 0, 'images': 0, 'gc_deletes': 0}
+    due_logins = []
 
     try:
-        # 1. Get all users who have credentials
-        users_with_creds = conn.execute("SELECT id, username, client_id, client_secret FROM users WHERE client_id IS NOT NULL AND client_secret IS NOT NULL").fetchall()
-        
-        all_monitored_logins = set()
-        
-        # 2. Iterate each user and poll
-        for user in users_with_creds:
-            uid = user['id']
-            username = user['username']
-            c_id = user['client_id']
-            c_secret = user['client_secret']
-            
-            # Fetch channels for this user
-            user_channels = conn.execute("SELECT login_name FROM channels WHERE user_id = ?", (uid,)).fetchall()
-            login_names = [row['login_name'] for row in user_channels]
-            
-            if not login_names:
-                continue
+        # 1. Sync schedule with the channels table and pop what's due
+        channel_creds, removed_logins = sync_schedule(conn)
+        now = time.time()
+        due_logins = pop_due_channels(now)
+
+        # 2. Group due channels by the credentials used to poll them. If a set fails
+        # (bad credentials, API errors), its channels move on to the next user's.
+        # Credentials whose auth failed recently are tried last.
+        due_by_creds = {}
+        for login_name in due_logins:
+            creds = sorted(channel_creds[login_name], key=lambda c: now - auth_failures.get(c, 0) < settings['poll_interval'])
+            due_by_creds.setdefault(creds[0], []).append(login_name)
+        failed_creds = set()
+
+        def fall_back(creds, login_names, retry_at):
+            """Regroups channels under their next untried credentials, or schedules a retry."""
+            failed_creds.add(creds)
+            for login_name in login_names:
+                untried = [c for c in channel_creds[login_name] if c not in failed_creds]
+                if untried:
+                    due_by_creds.setdefault(untried[0], []).append(login_name)
+                else:
+                    schedule_channel(login_name, retry_at)
+
+        if due_logins:
+            logging.info(f"[Poller] Starting update pass for {len(due_logins)} due channel(s)...")
+
+        live_updates = []  # New live_streams states (only changed ones)
+        programme_changes = []  # (login_name, now, started, title, game) for title/game/live transitions
+        vod_upserts = []
+        vod_deletes = []
+
+        while due_by_creds:
+            creds, login_names = due_by_creds.popitem()
+            c_id, c_secret, username = creds
+            logging.info(f"[Poller] Processing {len(login_names)} channels with credentials of user '{username}'...")
 
-            all_monitored_logins.update(login_names)
-            
-            logging.info(f"[Poller] Processing {len(login_names)} channels for user '{username}'...")
-            
             # Authenticate
             token = get_twitch_app_token(c_id, c_secret)
             if not token:
-                logging.warning(f"[Poller] Skipping user '{username}': Could not auth.")
+                auth_failures[creds] = now
+                logging.warning(f"[Poller] Could not auth with the credentials of user '{username}' for {len(login_names)} channels.")
+                fall_back(creds, login_names, now + settings['poll_interval'])
                 continue
-                
-            # Resolve IDs
-            user_id_map = get_user_ids(token, c_id, login_names)
-            
+
+            # Resolve IDs (only the ones we don't know yet)
+            unresolved = [l for l in login_names if l not in twitch_id_cache]
+            if unresolved:
+                resolved = get_user_ids(token, c_id, unresolved)
+                if resolved is None:
+                    # Unknown is not offline: without their IDs these channels can't be polled
+                    logging.warning(f"[Poller] Could not resolve {len(unresolved)} channels with the credentials of user '{username}'.")
+                    fall_back(creds, unresolved, now + API_RETRY_DELAY)
+                    login_names = [l for l in login_names if l not in unresolved]
+                    if not login_names:
+                        continue
+                else:
+                    twitch_id_cache.update(resolved)
+            user_id_map = {l: twitch_id_cache[l] for l in login_names if l in twitch_id_cache}
+
             # Poll Live Status
             live_data = get_live_streams_info(token, c_id, user_id_map)
-            
-            # Update Live Streams Table (Shared Cache)
-            # We iterate through this user's channels only
-            user_id_to_login = {v: k for k, v in user_id_map.items()}
-            
+            if live_data is None:
+                logging.warning(f"[Poller] Could not poll {len(login_names)} channels with the credentials of user '{username}'.")
+                fall_back(creds, login_names, now + API_RETRY_DELAY)
+                continue
+
+            new_states = {}
+            vod_logins = []
             for login_name in login_names:
                 twitch_user_id = user_id_map.get(login_name)
                 stream_info = live_data.get(twitch_user_id) if twitch_user_id else None
-                
-                epg_id = f"{login_name}.tv"
+                old = channel_state.get(login_name) or {}
+                was_live = old.get('is_live', False)
                 
                 if stream_info: # LIVE
                     display_name, is_live, stream_title, stream_game = login_name.title(), True, stream_info['title'], stream_info['game']
                 else: # OFFLINE
                     display_name, is_live, stream_title, stream_game = f"[Offline] {login_name.title()}", False, None, None
-                
-                # We use INSERT OR REPLACE. Since multiple users might watch same channel,
-                # last one wins. This is fine as data should be identical.
-                cursor.execute(
-                    """INSERT OR REPLACE INTO live_streams 
-                       (login_name, epg_channel_id, display_name, is_live, stream_title, stream_game) 
-                       VALUES (?, ?, ?, ?, ?, ?)""",
-                    (login_name, epg_id, display_name, is_live, stream_title, stream_game)
-                )
+
+                # Only bumped on transitions (and when first seen live), so a running
+                # stream doesn't rewrite its row every refresh.
+                last_live_at = old.get('last_live_at')
+                if is_live != was_live or (is_live and last_live_at is None):
+                    last_live_at = now
+
+                # EPG: every change of title, game or live status ends the running programme
+                if (is_live or was_live) and (is_live, stream_title, stream_game) != (was_live, old.get('stream_title'), old.get('stream_game')):
+                    started = now
+                    if is_live and not was_live and stream_info.get('started_at'):
+                        started = min(now, stream_info['started_at'])
+                    programme_changes.append((login_name, now, started if is_live else None, stream_title, stream_game))
+
+                new_states[login_name] = {
+                    'login_name': login_name, 'epg_channel_id': f"{login_name}.tv", 'display_name': display_name,
+                    'is_live': is_live, 'stream_title': stream_title, 'stream_game': stream_game,
+                    'last_live_at': last_live_at, 'vods_checked_at': old.get('vods_checked_at'),
+                    'profile_image_url': profile_image_urls.get(login_name, old.get('profile_image_url')),
+                    'box_art_url': stream_info['box_art_url'] if stream_info else None,
+                    'viewer_count': stream_info['viewers'] if stream_info else None
+                }
+
+                # VODs only change when a broadcast ends (or were never fetched, or with other VOD settings)
+                vods_checked_at = old.get('vods_checked_at')
+                if settings['vod_enabled'] and ((was_live and not is_live) or vods_checked_at is None
+                                                or vods_checked_at < vod_settings_changed_at):
+                    vod_logins.append(login_name)
+
+                schedule_channel(login_name, now + next_poll_delay(is_live, last_live_at, settings['poll_interval'], now))
 
             # Poll VODs (if enabled)
-            if settings['vod_enabled']:
-                process_vods(cursor, token, c_id, login_names, user_id_map, settings['vod_count_per_channel'])
-                
+            if vod_logins:
+                upserts, deletes = process_vods(conn, token, c_id, vod_logins, user_id_map, settings['vod_count_per_channel'])
+                vod_upserts.extend(upserts)
+                vod_deletes.extend(deletes)
+                for login_name in vod_logins:
+                    new_states[login_name]['vods_checked_at'] = now
+
+            # Diff against the known rows
+            live_updates.extend(state for login_name, state in new_states.items() if live_row_changed(channel_state.get(login_name), state))
                 
             # Yield to other greenlets
             gevent.sleep(0.5) # Increased from 0.1s to reduce CPU load
 
-        # 3. Garbage Collection
-        # streams that are in live_streams but NOT in all_monitored_logins should be removed
-        if all_monitored_logins:
-            placeholders = ','.join(['?'] * len(all_monitored_logins))
-            cursor.execute(f"DELETE FROM live_streams WHERE login_name NOT IN ({placeholders})", list(all_monitored_logins))
-        else:
-            cursor.execute("DELETE FROM live_streams")
+        # Images of the changed rows are cached first, so rebuilt catalogs point at the local copies
+        image_rows = fetch_images(
+            conn,
+            [state[c] for state in live_updates for c in ('profile_image_url', 'box_art_url')] + [row[5] for row in vod_upserts],
+            now
+        )
+
+        # 3. Write all changes in one short transaction
+        evicted_images = []
+        write_started = time.perf_counter()
+        with conn:
+            # The write lock is taken up front (not by the first write), so waiting for other writers is measurable
+            conn.execute("BEGIN IMMEDIATE")
+            lock_acquired = time.perf_counter()
+            if image_rows:
+                store_images(conn, image_rows)
+            if live_updates:
+                conn.executemany(
+                    """INSERT INTO live_streams 
+                       (login_name, epg_channel_id, display_name, is_live, stream_title, stream_game, last_live_at, vods_checked_at,
+                        profile_image_url, box_art_url, viewer_count) 
+                       VALUES (:login_name, :epg_channel_id, :display_name, :is_live, :stream_title, :stream_game, :last_live_at, :vods_checked_at,
+                               :profile_image_url, :box_art_url, :viewer_count)
+                       ON CONFLICT(login_name) DO UPDATE SET
+                       epg_channel_id=excluded.epg_channel_id,
+                       display_name=excluded.display_name,
+                       is_live=excluded.is_live,
+                       stream_title=excluded.stream_title,
+                       stream_game=excluded.stream_game,
+                       last_live_at=excluded.last_live_at,
+                       vods_checked_at=excluded.vods_checked_at,
+                       profile_image_url=excluded.profile_image_url,
+                       box_art_url=excluded.box_art_url,
+                       viewer_count=excluded.viewer_count
+                    """,
+                    live_updates
+                )
+            if vod_upserts:
+                # Use UPSERT to preserve the 'id' (Primary Key) if the VOD already exists.
+                conn.executemany(
+                    """INSERT INTO vod_streams (vod_id, channel_login, title, created_at, category, thumbnail_url, duration, category_id) 
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(vod_id, channel_login) DO UPDATE SET
+                       title=excluded.title,
+                       created_at=excluded.created_at,
+                       category=excluded.category,
+                       thumbnail_url=excluded.thumbnail_url,
+                       duration=excluded.duration,
+                       category_id=excluded.category_id
+                    """,
+                    vod_upserts
+                )
+            if vod_deletes:
+                conn.executemany("DELETE FROM vod_streams WHERE vod_id = ? AND channel_login = ?", vod_deletes)
+            if programme_changes:
+                conn.executemany(
+                    "UPDATE programme_history SET stop = ? WHERE login_name = ? AND stop IS NULL",
+                    [(stop, login_name) for login_name, stop, started, title, game in programme_changes]
+                )
+                conn.executemany(
+                    "INSERT INTO programme_history (login_name, start, title, game) VALUES (?, ?, ?, ?)",
+                    [(login_name, started, title, game) for login_name, stop, started, title, game in programme_changes if started]
+                )
+
+            # 4. Garbage Collection
+            full_gc = now - last_full_gc >= FULL_GC_INTERVAL
+            changes['gc_deletes'] = collect_garbage(conn, removed_logins, full=full_gc)
+            if full_gc:
+                evicted_images = collect_images(conn, now)
+        last_cycle_write_timing = {'lock_wait': lock_acquired - write_started, 'write': time.perf_counter() - lock_acquired}
+
+        if full_gc:
+            last_full_gc = now
+            for path in evicted_images:
+                image_cache.remove_image(path, IMAGES_DIR)
+            if evicted_images:
+                logging.info(f"[Poller-Images] Evicted {len(evicted_images)} image(s).")
+            backfill_images(conn, now)
 
-        conn.commit()
-        logging.info("[Poller] Update cycle complete.")
+        # Committed: the written states are now the known rows
+        for state in live_updates:
+            channel_state[state['login_name']] = state
+
+        changes['live_streams'] = len(live_updates)
+        changes['vod_upserts'] = len(vod_upserts)
+        changes['vod_deletes'] = len(vod_deletes)
+        changes['programmes'] = len(programme_changes)
+        changes['images'] = len(image_rows)
+        if due_logins:
+            logging.info(
+                f"[Poller] Update pass complete. Rows written: {changes['live_streams']} live_streams, "
+                f"{changes['vod_upserts']} VOD upserts, {changes['vod_deletes']} VOD deletes, "
+                f"{changes['programmes']} programme changes, {changes['gc_deletes']} GC deletes."
+            )
 
     except Exception as e:
         logging.critical(f"[Poller] FATAL ERROR during update cycle: {e}")
-        conn.rollback()
+        # Nothing was written: reload the known rows from the DB and retry soon
+        channel_state.clear()
+        for login_name in due_logins:
+            schedule_channel(login_name, time.time() + SCHEDULE_SYNC_INTERVAL)
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+    last_cycle_changes = changes
+    return changes
+
+def parse_timestamp(value):
+    """Parses a Twitch timestamp (e.g. '2024-01-01T10:00:00Z') into epoch seconds, None if invalid."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
 
 def parse_duration(duration_str):
     """Parses Twitch duration string (e.g., '1h30m5s') into seconds."""
@@ -296,8 +1036,14 @@ def parse_duration(duration_str):
         total_seconds = h * 3600 + m * 60 + s
     return total_seconds
 
-def process_vods(cursor, token, client_id, login_names, user_id_map, vod_count):
-    """Helper to process VODs for a specific user session."""
+def process_vods(conn, token, client_id, login_names, user_id_map, vod_count):
+    """Fetches VODs for the given channels and diffs them against the stored rows.
+
+    Returns (upserts, deletes): parameter tuples for the rows that changed. Nothing is written here.
+    """
+    upserts = []
+    deletes = []
+    columns = ', '.join(VOD_STREAM_COLUMNS[2:])
     
     for login_name in login_names:
         user_id = user_id_map.get(login_name)
@@ -307,53 +1053,157 @@ def process_vods(cursor, token, client_id, login_names, user_id_map, vod_count):
         if not vods: continue
 
         vod_category = f"{login_name.title()} VODs"
+        category_id = vod_category_id(login_name)
         
         gevent.sleep(0.1) # Yield slightly for each user VODs processing
+
+        stored = {
+            row['vod_id']: tuple(row)[1:]
+            for row in conn.execute(f"SELECT vod_id, {columns} FROM vod_streams WHERE channel_login = ?", (login_name,)).fetchall()
+        }
         
         for vod in vods:
-            thumbnail = vod['thumbnail_url'].replace('%{width}', '640').replace('%{height}', '360')
+            thumbnail = image_cache.vod_thumbnail_url(vod['thumbnail_url'])
             duration_seconds = parse_duration(vod.get('duration', '0s'))
-            
-            # Use UPSERT to preserve the 'id' (Primary Key) if the VOD already exists.
-            # strict=True on the DB init is not set for UNIQUE(vod_id, channel_login), 
-            # but init_db.py defines UNIQUE(vod_id, channel_login).
-            cursor.execute(
-                """INSERT INTO vod_streams (vod_id, channel_login, title, created_at, category, thumbnail_url, duration) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)
-                   ON CONFLICT(vod_id, channel_login) DO UPDATE SET
-                   title=excluded.title,
-                   created_at=excluded.created_at,
-                   category=excluded.category,
-                   thumbnail_url=excluded.thumbnail_url,
-                   duration=excluded.duration
-                """,
-                (vod['id'], login_name, vod['title'], vod['created_at'], vod_category, thumbnail, duration_seconds)
-            )
+            fields = (vod['title'], vod['created_at'], vod_category, thumbnail, duration_seconds, category_id)
+            if stored.get(vod['id']) != fields:
+                upserts.append((vod['id'], login_name) + fields)
 
         # Cleanup: Remove VODs for this channel that were NOT in the fetched list
-        valid_vod_ids = [v['id'] for v in vods]
-        if valid_vod_ids:
-            placeholders = ','.join(['?'] * len(valid_vod_ids))
-            # We need to pass the login_name AND the list of valid IDs
-            params = [login_name] + valid_vod_ids
-            cursor.execute(f"DELETE FROM vod_streams WHERE channel_login = ? AND vod_id NOT IN ({placeholders})", params)
-            logging.info(f"[Poller-VOD] Cleaned up VODs for {login_name}. Kept {len(valid_vod_ids)} VODs.")
+        valid_vod_ids = {v['id'] for v in vods}
+        stale = [(vod_id, login_name) for vod_id in stored if vod_id not in valid_vod_ids]
+        deletes.extend(stale)
+        logging.info(f"[Poller-VOD] Checked VODs for {login_name}. Kept {len(valid_vod_ids)} VODs, removing {len(stale)}.", extra={'channel': login_name})
+
+    return upserts, deletes
 
             
+# --- Benchmark Mode ---
+def use_api_url(base_url):
+    """Points all Twitch API calls at base_url (a Helix stand-in, see bench/helix_stub.py)."""
+    global TWITCH_AUTH_URL, TWITCH_API_URL_USERS, TWITCH_API_URL_VIDEOS, TWITCH_API_URL_STREAMS
+    base_url = base_url.rstrip('/')
+    TWITCH_AUTH_URL = f"{base_url}/oauth2/token"
+    TWITCH_API_URL_USERS = f"{base_url}/helix/users"
+    TWITCH_API_URL_VIDEOS = f"{base_url}/helix/videos"
+    TWITCH_API_URL_STREAMS = f"{base_url}/helix/streams"
+
+def run_benchmark(cycles, api_url):
+    """Runs `cycles` update passes back to back against a Helix stand-in, with every
+    channel of our shards due in every pass. Returns the report: API calls, wall and
+    CPU time, rows written and write-lock wait per cycle.
+    """
+    use_api_url(api_url)
+    heartbeat_leases()
+    heartbeat = gevent.spawn(lease_heartbeat) # Several benchmarking pollers rebalance shards like real ones
+    if POLLER_SHARDS > 1:
+        # Pollers started together don't see each other on their first heartbeat
+        logging.warning(f"[Poller-Bench] Waiting {LEASE_HEARTBEAT_INTERVAL * 2}s for the shard leases to settle...")
+        gevent.sleep(LEASE_HEARTBEAT_INTERVAL * 2 + 1)
+    results = []
+    try:
+        for cycle in range(1, cycles + 1):
+            for login_name in list(next_due):
+                schedule_channel(login_name, 0)
+            calls_before, errors_before = api_calls.copy(), api_errors.copy()
+            started, cpu_started = time.perf_counter(), time.process_time()
+            changes = update_database()
+            result = {
+                'cycle': cycle,
+                'channels': len(next_due),
+                'wall_seconds': round(time.perf_counter() - started, 3),
+                'cpu_seconds': round(time.process_time() - cpu_started, 3),
+                'api_calls': dict(api_calls - calls_before),
+                'api_errors': dict(api_errors - errors_before),
+                'rows_written': changes,
+                'lock_wait_ms': round(last_cycle_write_timing['lock_wait'] * 1000, 2),
+                'write_ms': round(last_cycle_write_timing['write'] * 1000, 2),
+            }
+            results.append(result)
+            logging.warning(
+                f"[Poller-Bench] Cycle {cycle}/{cycles}: {result['channels']} channels in {result['wall_seconds']:.1f}s "
+                f"(CPU {result['cpu_seconds']:.1f}s), {sum(result['api_calls'].values())} API calls, "
+                f"{sum(changes.values())} rows written, lock wait {result['lock_wait_ms']:.1f}ms."
+            )
+        held = sorted(owned_shards)
+    finally:
+        heartbeat.kill()
+        release_leases()
+
+    totals = {
+        'wall_seconds': round(sum(r['wall_seconds'] for r in results), 3),
+        'cpu_seconds': round(sum(r['cpu_seconds'] for r in results), 3),
+        'api_calls': dict(sum((Counter(r['api_calls']) for r in results), Counter())),
+        'api_errors': dict(sum((Counter(r['api_errors']) for r in results), Counter())),
+        'rows_written': dict(sum((Counter(r['rows_written']) for r in results), Counter())),
+        'lock_wait_ms': round(sum(r['lock_wait_ms'] for r in results), 2),
+        'max_lock_wait_ms': max((r['lock_wait_ms'] for r in results), default=0),
+    }
+    return {'poller_id': POLLER_ID, 'db': DB_PATH, 'api_url': api_url, 'shards': POLLER_SHARDS,
+            'owned_shards': held, 'cycles': results, 'totals': totals}
+
+def print_benchmark_report(report):
+    print(f"\n{'cycle':>5} {'channels':>8} {'wall s':>8} {'cpu s':>7} {'calls':>6} {'errors':>6} {'rows':>6} {'lock ms':>8} {'write ms':>8}")
+    for r in report['cycles']:
+        print(f"{r['cycle']:>5} {r['channels']:>8} {r['wall_seconds']:>8.2f} {r['cpu_seconds']:>7.2f} "
+              f"{sum(r['api_calls'].values()):>6} {sum(r['api_errors'].values()):>6} {sum(r['rows_written'].values()):>6} "
+              f"{r['lock_wait_ms']:>8.1f} {r['write_ms']:>8.1f}")
+    totals = report['totals']
+    print(f"\nPoller {report['poller_id']}, shards {report['owned_shards']} of {report['shards']}")
+    print(f"Total: {totals['wall_seconds']:.1f}s wall, {totals['cpu_seconds']:.1f}s CPU, "
+          f"lock wait {totals['lock_wait_ms']:.1f}ms (max {totals['max_lock_wait_ms']:.1f}ms)")
+    print(f"API calls: {totals['api_calls']}, errors: {totals['api_errors']}")
+    print(f"Rows written: {totals['rows_written']}")
+
 # --- Main run loop ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TiviTwitch poller")
+    parser.add_argument('--db', help='Database file (default: instance/channels.db)')
+    parser.add_argument('--benchmark', type=int, metavar='CYCLES',
+                        help='Run this many update passes against --api-url, print a report and exit. Needs --db; '
+                             'images and the log ring go next to it (<db name>-images/, <db name>.ring)')
+    parser.add_argument('--api-url', help='Helix stand-in for --benchmark (bench/helix_stub.py), e.g. http://127.0.0.1:8891')
+    parser.add_argument('--output', help='With --benchmark: also write the report as JSON to this file')
+    args = parser.parse_args()
+    if args.db:
+        DB_PATH = args.db
+    if args.benchmark:
+        if not args.api_url:
+            parser.error('--benchmark needs --api-url (it never runs against the real Twitch API)')
+        if not args.db:
+            parser.error('--benchmark needs --db (it never runs against the real database)')
+        # Keep the real image cache and log ring out of it
+        bench_base = os.path.splitext(os.path.abspath(args.db))[0]
+        IMAGES_DIR = f"{bench_base}-images"
+        LOG_RING_PATH = f"{bench_base}.ring"
+
+    # --- START Logging Config (Dynamic) ---
+    log_level = get_startup_log_level()
+    setup_logging('poller', log_level, ring_path=LOG_RING_PATH)
+    logging.warning("--------------------------------------")
+    logging.warning(f"Poller service starting... (Log Level: {logging.getLevelName(log_level)})")
+    logging.warning("--------------------------------------")
+    # --- END Logging Config ---
+
+    if args.benchmark:
+        report = run_benchmark(args.benchmark, args.api_url)
+        print_benchmark_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        sys.exit(0)
+
     gevent.sleep(5) # Wait for DB to be ready
+    load_token_cache()
+    heartbeat_leases()
+    gevent.spawn(lease_heartbeat)
+    gevent.spawn(token_refresher)
+    gevent.signal_handler(signal.SIGTERM, shutdown)
     while True:
         try:
             update_database()
         except Exception as e:
             logging.critical(f"[Poller] Unhandled exception in main loop: {e}")
             
-        try:
-            settings = get_base_settings()
-            poll_wait = settings.get('poll_interval', 300)
-        except Exception:
-            poll_wait = 300
-            
-        logging.info(f"Next poll run in {poll_wait} seconds.")
-        gevent.sleep(poll_wait)
\ No newline at end of file
+        # Sleep until the next channel is due (or the next schedule sync)
+        gevent.sleep(seconds_until_next_due(time.time()))
@@ -53,6 +53,53 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // The user's channels with their live status: Key=login_name, Value=channel
+    const channels = new Map();
+    let liveUpdates = false;
+
+    function renderChannels() {
+        if (!channelList) return;
+        channelList.innerHTML = '';
+        if (channels.size === 0) {
+            channelList.innerHTML = '<li>No channels added yet.</li>';
+            return;
+        }
+        [...channels.values()]
+            .sort((a, b) => a.login_name.localeCompare(b.login_name))
+            .forEach(channel => {
+                const li = document.createElement('li');
+                const info = document.createElement('span');
+                info.textContent = channel.login_name;
+                if (channel.is_live) {
+                    const badge = document.createElement('span');
+                    badge.className = 'badge badge-live';
+                    badge.textContent = 'LIVE';
+                    info.prepend(badge, ' ');
+
+                    // Titles and games come from Twitch, so they're set as text
+                    const status = document.createElement('small');
+                    status.className = 'channel-status';
+                    const parts = [channel.stream_game, channel.stream_title].filter(Boolean);
+                    if (channel.viewer_count != null) parts.push(`${channel.viewer_count.toLocaleString()} viewers`);
+                    status.textContent = parts.join(' · ');
+                    info.appendChild(status);
+                }
+                const button = document.createElement('button');
+                button.className = 'delete-btn';
+                button.dataset.id = channel.id;
+                button.dataset.login = channel.login_name;
+                button.textContent = 'Delete';
+                li.append(info, button);
+                channelList.appendChild(li);
+            });
+    }
+
+    function setChannels(list) {
+        channels.clear();
+        list.forEach(channel => channels.set(channel.login_name, channel));
+        renderChannels();
+    }
+
     async function fetchChannels() {
         try {
             const response = await fetch('/api/channels', {
@@ -66,22 +113,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 throw new Error('Network error');
             }
-            const channels = await response.json();
-
-            if (channelList) {
-                channelList.innerHTML = '';
-                if (channels.length === 0) {
-                    channelList.innerHTML = '<li>No channels added yet.</li>';
-                }
-                channels.forEach(channel => {
-                    const li = document.createElement('li');
-                    li.innerHTML = `
-                        <span>${channel.login_name}</span>
-                        <button data-id="${channel.id}" class="delete-btn">Delete</button>
-                    `;
-                    channelList.appendChild(li);
-                });
-            }
+            setChannels(await response.json());
         } catch (error) {
             if (channelList) {
                 channelList.innerHTML = '<li>Error loading channels.</li>';
@@ -89,6 +121,31 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Live status via server-sent events: a snapshot of all channels, then deltas when
+    // the poller writes a change. EventSource reconnects (and resumes) by itself.
+    function watchChannels() {
+        if (!window.EventSource) {
+            fetchChannels();
+            return;
+        }
+        const source = new EventSource('/api/channels/events');
+        liveUpdates = true;
+        source.addEventListener('snapshot', (e) => setChannels(JSON.parse(e.data)));
+        source.addEventListener('delta', (e) => {
+            const delta = JSON.parse(e.data);
+            delta.channels.forEach(channel => channels.set(channel.login_name, channel));
+            delta.removed.forEach(login => channels.delete(login));
+            renderChannels();
+        });
+        source.addEventListener('error', () => {
+            // Closed for good (e.g. the session expired and we got the login page)
+            if (source.readyState === EventSource.CLOSED) {
+                liveUpdates = false;
+                fetchChannels();
+            }
+        });
+    }
+
     async function loadSettings() {
         try {
             const response = await fetch('/api/settings', {
@@ -169,7 +226,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     throw new Error(result.error || 'Unknown error');
                 }
                 channelNameInput.value = '';
-                fetchChannels();
+                if (!liveUpdates) fetchChannels();
                 if (addChannelModal) {
                     addChannelModal.style.display = 'none';
                 }
@@ -192,7 +249,12 @@ document.addEventListener('DOMContentLoaded', () => {
                     });
 
                     if (!response.ok) throw new Error('Error deleting channel');
-                    fetchChannels();
+                    if (liveUpdates) {
+                        channels.delete(e.target.dataset.login);
+                        renderChannels();
+                    } else {
+                        fetchChannels();
+                    }
                 } catch (error) {
                     alert(error.message);
                 }
@@ -448,7 +510,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Init
     setDynamicUrls();
-    if (channelList) fetchChannels();
+    if (channelList) watchChannels();
     // Replaces the old loadSettings call
     checkAndEnforceCredentials();
 
@@ -1,70 +1,474 @@
 from flask import (
-    Blueprint, request, jsonify, Response, redirect, current_app
+    Blueprint, request, jsonify, Response, redirect, current_app, g, stream_with_context, send_from_directory
 )
-from db import get_db, get_setting, check_xc_auth
+from db import get_db, get_setting, check_xc_auth, INSTANCE_FOLDER
+from utils.crypto import encrypt, decrypt, keyed_digest
+from utils import singleflight
+from utils.logs import RateLimiter
+from utils.timing import phase
+from utils.image_cache import IMAGES_DIR
+from collections import OrderedDict
+import gevent
 import streamlink
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import html
+import itertools
+import gzip
+import hashlib
+import hmac
+import json
 from urllib.parse import urljoin, urlparse
 import os
+import tempfile
 import logging
-import zlib
 
 bp = Blueprint('streaming', __name__)
 
 HOST_URL = os.environ.get('HOST_URL')
 
+# --- Signed Playback URLs ---
+# player_api hands out live/VOD URLs with an encrypted, expiring token in place of
+# the password. The token carries the channel or VOD ID and is bound to a digest of
+# the user's password hash and Twitch auth token: changing either (or deleting the
+# user) revokes all of the user's tokens. The play endpoints skip the password hash
+# and look up the user by primary key; the auth token never leaves the DB.
+PLAYBACK_TOKEN_TTL = 3 * 24 * 3600 # Longer than TiviMate's playlist refresh
+# VOD segment URLs are signed with a short HMAC instead (one per playlist line).
+VOD_SEGMENT_TTL = 12 * 3600
+# Media playlist base URL per VOD: Key=twitch_vod_id, Value=(base_url, expires)
+vod_base_urls = OrderedDict()
+VOD_BASE_URLS_MAX = 512
+
+def playback_key(user):
+    return keyed_digest(f"{user['id']}:{user['password_hash']}:{user['auth_token'] or ''}", 'playback-key')[:22]
+
+def make_playback_token(kind, user, stream_id, **data):
+    payload = dict(data, k=kind, u=user['username'], i=user['id'], p=playback_key(user), s=str(stream_id))
+    return encrypt(json.dumps(payload, separators=(',', ':')), 'playback')
+
+def read_playback_token(token, kind, username, stream_id):
+    """Returns (payload, user) if this is a valid, unexpired and unrevoked token
+    for this URL, else (None, None).
+
+    A real password simply fails to decrypt, without touching the DB.
+    """
+    raw = decrypt(token, 'playback', ttl=PLAYBACK_TOKEN_TTL) if token else None
+    if not raw:
+        return None, None
+    payload = json.loads(raw)
+    if payload.get('k') != kind or payload.get('u') != username or payload.get('s') != str(stream_id):
+        return None, None
+    user = get_db().execute("SELECT * FROM users WHERE id = ?", (payload.get('i'),)).fetchone()
+    if not user or user['username'] != username or not hmac.compare_digest(playback_key(user), payload.get('p', '')):
+        return None, None
+    return payload, user
+
+def sign_vod_segment(twitch_vod_id, expires):
+    return keyed_digest(f"{twitch_vod_id}:{expires}", 'vod-segment')[:32]
+
+def check_vod_segment_signature(twitch_vod_id, expires, signature):
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(sign_vod_segment(twitch_vod_id, expires), signature or '')
+
+def remember_vod_base_url(twitch_vod_id, base_url):
+    vod_base_urls[twitch_vod_id] = (base_url, time.time() + VOD_SEGMENT_TTL)
+    vod_base_urls.move_to_end(twitch_vod_id)
+    while len(vod_base_urls) > VOD_BASE_URLS_MAX:
+        vod_base_urls.popitem(last=False)
+
+# --- Catalog Snapshots ---
+# get_live_streams, get_vod_categories and get_vod_streams are serialized once per user
+# and reused until that user's catalog generation changes (bumped by DB triggers whenever
+# the poller or a channel edit touches their rows, see migrations.py). Snapshots are also
+# rebuilt well before the playback tokens inside them expire.
+CATALOG_SNAPSHOT_MAX_AGE = PLAYBACK_TOKEN_TTL // 3
+CATALOG_CACHE_MAX = 1024
+# Key=(user_id, action, params), Value=(generation, built_at, body, etag)
+catalog_cache = OrderedDict()
+
+def get_catalog_generation(db, user_id):
+    row = db.execute("SELECT generation FROM catalog_generations WHERE user_id = ?", (user_id,)).fetchone()
+    return row['generation'] if row else 0
+
+def iter_json_array(items, batch_size=200):
+    """Encodes an iterable of JSON-serializable items as a JSON array, in chunks."""
+    yield b'['
+    first = True
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            break
+        chunk = ','.join(json.dumps(item, separators=(',', ':')) for item in batch)
+        yield (chunk if first else ',' + chunk).encode('utf-8')
+        first = False
+        gevent.sleep(0) # Let streams and other requests run during big builds
+    yield b']'
+
+def get_page_args():
+    """Optional ?limit=&offset= pagination. Returns (limit, offset); limit None = everything."""
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        offset = max(0, int(request.args.get('offset') or 0))
+    except ValueError:
+        return None, 0
+    if limit is not None and limit < 0:
+        limit = None
+    return limit, offset
+
+def catalog_response(user, action, params, build):
+    """Serves a player_api catalog from its snapshot, calling build(db, user, params) if
+    there is none or it is stale. Handles If-None-Match (304).
+
+    With ?limit= or ?offset= the requested page is streamed straight from the cursor instead.
+    """
+    db = get_db()
+    limit, offset = get_page_args()
+    if limit is not None or offset:
+        items = build(db, user, params, limit=limit, offset=offset)
+        return Response(stream_with_context(iter_json_array(items)), mimetype='application/json')
+
+    key = (user['id'], action, params)
+    generation = get_catalog_generation(db, user['id'])
+    entry = catalog_cache.get(key)
+    if not entry or entry[0] != generation or time.time() - entry[1] > CATALOG_SNAPSHOT_MAX_AGE:
+        def rebuild():
+            # Rows are encoded as they come from the cursor, the body is the only full copy
+            body = b''.join(iter_json_array(build(db, user, params)))
+            entry = (generation, time.time(), body, hashlib.sha1(body).hexdigest())
+            catalog_cache[key] = entry
+            while len(catalog_cache) > CATALOG_CACHE_MAX:
+                catalog_cache.popitem(last=False)
+            return entry
+        # Boxes starting up together share one build
+        with phase('serialize'):
+            entry = singleflight.do(('catalog', key, generation), rebuild)
+    if key in catalog_cache:
+        catalog_cache.move_to_end(key)
+
+    response = Response(entry[2], mimetype='application/json')
+    response.set_etag(entry[3])
+    return response.make_conditional(request)
+
+def image_url(path, source_url):
+    """URL of a cached image (served by nginx), or the Twitch URL while it isn't cached yet."""
+    if path:
+        return f"{HOST_URL}/images/{path}"
+    return source_url or ""
+
+def build_live_streams(db, user, params=None, limit=None, offset=0):
+    """Yields the get_live_streams entries of a user."""
+    query = '''
+        SELECT l.*, c.id as channel_id, i.path AS icon_path
+        FROM live_streams l
+        JOIN channels c ON l.login_name = c.login_name
+        LEFT JOIN image_cache i ON i.source_url = l.profile_image_url
+        WHERE c.user_id = ?
+        ORDER BY l.is_live DESC, l.login_name ASC
+        LIMIT ? OFFSET ?
+    '''
+    username = user['username']
+    added = str(int(time.time()))
+    count = 0
+
+    for stream in db.execute(query, (user['id'], -1 if limit is None else limit, offset)):
+        display_name = stream['display_name']
+        if stream['is_live'] and stream['stream_title']:
+            display_name = f"{stream['login_name']} - {stream['stream_title']}"
+
+        # channels.id is the stable integer stream_id TiviMate expects
+        play_token = make_playback_token('live', user, stream['channel_id'], l=stream['login_name'])
+        count += 1
+            
+        yield {
+            "num": stream['channel_id'], "name": display_name, "stream_type": "live", "stream_id": stream['channel_id'], 
+            "stream_icon": image_url(stream['icon_path'], stream['profile_image_url']), "epg_channel_id": stream['epg_channel_id'], "added": added,
+            "category_id": "1", "custom_sid": "", "tv_archive": 0, "container_extension": "m3u8",
+            "direct_source": f"{HOST_URL}/live/{username}/{play_token}/{stream['channel_id']}.m3u8"
+        }
+    current_app.logger.info(f"[XC-API] Delivered {count} live streams for user '{username}'.")
+
+def build_vod_categories(db, user, params=None, limit=None, offset=0):
+    """Yields the get_vod_categories entries of a user."""
+    query = '''
+        SELECT DISTINCT v.channel_login, v.category_id
+        FROM channels c
+        JOIN vod_streams v ON c.login_name = v.channel_login
+        WHERE c.user_id = ?
+        LIMIT ? OFFSET ?
+    '''
+    for row in db.execute(query, (user['id'], -1 if limit is None else limit, offset)):
+        yield {
+            "category_id": row['category_id'],
+            "category_name": row['channel_login'].title(),
+            "parent_id": 0
+        }
+
+def build_vod_streams(db, user, category_id_filter=None, limit=None, offset=0):
+    """Yields the get_vod_streams entries of a user."""
+    params = [user['id']]
+    category_filter = ''
+    if category_id_filter:
+        category_filter = 'AND v.category_id = ?'
+        params.append(str(category_id_filter))
+    params += [-1 if limit is None else limit, offset]
+
+    # Titles are prefixed with the date as dd.mm.yy (raw date if it doesn't parse)
+    query = f'''
+        SELECT v.id, v.vod_id, v.title, v.thumbnail_url, v.category_id, i.path AS image_path,
+               COALESCE(strftime('%d.%m.', v.created_at) || substr(strftime('%Y', v.created_at), 3),
+                        substr(v.created_at, 1, 10)) AS formatted_date
+        FROM vod_streams v
+        JOIN channels c ON v.channel_login = c.login_name
+        LEFT JOIN image_cache i ON i.source_url = v.thumbnail_url
+        WHERE c.user_id = ? {category_filter}
+        ORDER BY v.created_at DESC
+        LIMIT ? OFFSET ?
+    '''
+
+    username = user['username']
+    added = str(int(time.time()))
+    count = 0
+    
+    for vod in db.execute(query, params):
+        play_token = make_playback_token('vod', user, vod['vod_id'], v=vod['vod_id'])
+        count += 1
+        
+        yield {
+            "num": vod['id'],
+            "name": f"[{vod['formatted_date']}] {vod['title']}",
+            "stream_type": "movie",
+            "stream_id": vod['vod_id'],
+            "stream_icon": image_url(vod['image_path'], vod['thumbnail_url']),
+            "rating": "5",
+            "rating_5based": 5,
+            "added": added,
+            "category_id": vod['category_id'],
+            "container_extension": "mp4",
+            "custom_sid": "",
+            "direct_source": f"{HOST_URL}/movie/{username}/{play_token}/{vod['vod_id']}.mp4"
+        }
+        
+    current_app.logger.info(f"[XC-API] Delivered {count} VOD streams for user '{username}'.")
+
+# --- Pre-gzipped EPG / M3U Artifacts ---
+# EPG and M3U files are rendered once per user and catalog generation, gzipped and
+# written atomically to instance/artifacts/. Behind nginx the response is only an
+# X-Accel-Redirect; nginx then serves the .gz file itself (gzip_static, gunzip for
+# clients without gzip) with Last-Modified/ETag. See nginx.conf, location /_artifacts/.
+ARTIFACTS_DIR = os.path.join(INSTANCE_FOLDER, 'artifacts')
+ARTIFACTS_URL = '/_artifacts'
+EPG_ARTIFACT_MAX_AGE = 3600 # The EPG's programme times are relative to the build time
+# Key=(user_id, name), Value=(generation, variant, built_at)
+artifact_index = {}
+
+def write_artifact(path, chunks):
+    """Writes text chunks gzipped to path + '.gz', atomically (readers never see a partial file)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as gz:
+                for chunk in chunks:
+                    gz.write(chunk.encode('utf-8'))
+        os.chmod(tmp_path, 0o644) # nginx runs as another user
+        os.replace(tmp_path, path + '.gz')
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def artifact_response(user, name, mimetype, render, variant=None, max_age=None):
+    """Serves artifact `name` of a user, calling render() for its text chunks if the
+    user's catalog changed (or variant differs, or it is older than max_age seconds).
+    """
+    key = (user['id'], name)
+    path = os.path.join(ARTIFACTS_DIR, str(user['id']), name)
+    generation = get_catalog_generation(get_db(), user['id'])
+    entry = artifact_index.get(key)
+    if (not entry or entry[0] != generation or entry[1] != variant
+            or (max_age and time.time() - entry[2] > max_age) or not os.path.exists(path + '.gz')):
+        def rebuild():
+            write_artifact(path, render())
+            artifact_index[key] = (generation, variant, time.time())
+        with phase('serialize'):
+            singleflight.do(('artifact', key, generation, variant), rebuild)
+
+    if request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{ARTIFACTS_URL}/{user['id']}/{name}"
+        return response
+
+    # Without nginx (development): serve the file from here
+    with open(path + '.gz', 'rb') as f:
+        data = f.read()
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = Response(data, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    else:
+        response = Response(gzip.decompress(data), mimetype=mimetype)
+    response.last_modified = os.path.getmtime(path + '.gz')
+    return response.make_conditional(request)
+
+def render_m3u(db, user, token):
+    """Yields the lines of a user's M3U playlist."""
+    query = '''
+        SELECT l.*, c.id as channel_id, i.path AS icon_path
+        FROM live_streams l
+        JOIN channels c ON l.login_name = c.login_name
+        LEFT JOIN image_cache i ON i.source_url = l.profile_image_url
+        WHERE c.user_id = ?
+        ORDER BY l.is_live DESC, l.login_name ASC
+    '''
+    epg_url = f"{HOST_URL}/epg.xml?token={token}"
+    yield f'#EXTM3U url-tvg="{epg_url}"\n'
+    count = 0
+    
+    for stream in db.execute(query, (user['id'],)):
+        channel_name = stream['display_name']
+        if stream['is_live'] and stream['stream_title']:
+            channel_name = f"{stream['login_name']} - {stream['stream_title']}"
+            
+        tvg_id = stream['epg_channel_id'] 
+        stream_url = f"{HOST_URL}/play_live_m3u/{stream['channel_id']}"
+        logo = image_url(stream['icon_path'], stream['profile_image_url'])
+        yield f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{channel_name}" tvg-logo="{logo}" group-title="Twitch Live",{channel_name}\n'
+        yield stream_url + '\n'
+        count += 1
+
+    current_app.logger.info(f"[M3U] M3U playlist generated with {count} channels for user '{user['username']}'.")
+
 # --- Streaming Helpers ---
 from db import get_user_by_token, get_user_by_username 
 
+# --- EPG ---
+# Built from programme_history (title/game transitions recorded by the poller). Each
+# channel's XML is rendered once and shared by all users following it; a rebuild only
+# re-renders channels whose live row changed since (or whose fragment got old).
+EPG_PAST = 7 * 24 * 3600          # Past programmes (catch-up), same as the poller's retention
+EPG_LIVE_PROJECTION = 2 * 3600    # A running programme is shown until at least now + this
+EPG_OFFLINE_AHEAD = 24 * 3600     # Offline channels get an "Offline" block until now + this
+EPG_FRAGMENTS_MAX = 20000
+# Key=login_name, Value=(signature, built_at, channel_xml, programmes_xml)
+epg_fragments = OrderedDict()
+
+def xmltv_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%d%H%M%S +0000')
+
+def render_programme(channel_id, start, stop, title, category, icon=None):
+    title = html.escape(title or 'No Title')
+    category = html.escape(category or 'No Category')
+    icon_xml = f'    <icon src="{html.escape(icon)}" />\n' if icon else ''
+    return (f'  <programme start="{xmltv_time(start)}" stop="{xmltv_time(stop)}" channel="{channel_id}">\n'
+            f'    <title lang="en">{title}</title>\n'
+            f'    <desc lang="en">{category}</desc>\n'
+            f'    <category lang="en">{category}</category>\n'
+            f'{icon_xml}'
+            '  </programme>\n')
+
+def render_epg_channel(db, stream, now):
+    """Returns (channel_xml, programmes_xml) of one channel."""
+    channel_id = html.escape(stream['epg_channel_id'] or f"{stream['login_name']}.tv")
+    icon = image_url(stream['icon_path'], stream['profile_image_url'])
+    icon_xml = f'    <icon src="{html.escape(icon)}" />\n' if icon else ''
+    # Box art is only known for the current game, so only the running programme gets it
+    box_art = image_url(stream['box_art_path'], stream['box_art_url']) if stream['is_live'] else None
+    channel_xml = (f'  <channel id="{channel_id}">\n'
+                   f'    <display-name>{html.escape(stream["login_name"].title())}</display-name>\n'
+                   f'{icon_xml}'
+                   '  </channel>\n')
+
+    programmes = db.execute('''
+        SELECT start, stop, title, game FROM programme_history
+        WHERE login_name = ? AND start > ?
+        ORDER BY start
+    ''', (stream['login_name'], now - EPG_PAST - 86400)).fetchall()
+
+    parts = []
+    last_stop = None
+    for programme in programmes:
+        stop = programme['stop']
+        if stop is None:
+            if not stream['is_live']:
+                continue # Offline, the poller will close it on its next pass
+            stop = now + EPG_LIVE_PROJECTION
+        if stop < now - EPG_PAST:
+            continue
+        icon = box_art if programme['stop'] is None else None
+        parts.append(render_programme(channel_id, programme['start'], stop, programme['title'], programme['game'], icon))
+        last_stop = stop
+
+    if stream['is_live'] and (last_stop is None or last_stop < now):
+        # Live, but no open programme recorded (yet)
+        start = min(stream['last_live_at'] or now, now)
+        parts.append(render_programme(channel_id, start, now + EPG_LIVE_PROJECTION, stream['stream_title'], stream['stream_game'], box_art))
+    elif not stream['is_live']:
+        start = max(last_stop or 0, now - EPG_PAST)
+        parts.append(render_programme(channel_id, start, now + EPG_OFFLINE_AHEAD, 'Offline', None))
+    return channel_xml, ''.join(parts)
+
 def generate_epg_data(user_id=None):
-    """Generates the XMLTV content based on the DB, optionally filtered by user."""
+    """Yields the XMLTV content based on the DB, optionally filtered by user."""
     current_app.logger.info(f"[EPG] Generating EPG data... (User ID: {user_id})")
     db = get_db()
     
     if user_id:
         query = '''
-            SELECT l.* 
+            SELECT l.login_name, l.epg_channel_id, l.is_live, l.stream_title, l.stream_game, l.last_live_at,
+                   l.profile_image_url, i.path AS icon_path, l.box_art_url, b.path AS box_art_path
             FROM live_streams l
             JOIN channels c ON l.login_name = c.login_name
-            WHERE c.user_id = ? AND l.is_live = 1
+            LEFT JOIN image_cache i ON i.source_url = l.profile_image_url
+            LEFT JOIN image_cache b ON b.source_url = l.box_art_url
+            WHERE c.user_id = ?
         '''
-        streams = db.execute(query, (user_id,)).fetchall()
+        params = (user_id,)
     else:
-        streams = db.execute('SELECT * FROM live_streams WHERE is_live = 1').fetchall()
-        
-    current_app.logger.info(f"[EPG] EPG data generated for {len(streams)} live channels.")
-    
-    xml_content = ['<?xml version="1.0" encoding="UTF-8"?>', '<tv>']
-    
-    for stream in streams:
-        xml_content.append(f'  <channel id="{stream["epg_channel_id"]}">')
-        xml_content.append(f'    <display-name>{html.escape(stream["login_name"].title())}</display-name>')
-        xml_content.append('  </channel>')
-        
-    now = datetime.utcnow()
-    start_time = now.strftime('%Y%m%d%H%M%S +0000')
-    end_time = (now + timedelta(hours=24)).strftime('%Y%m%d%H%M%S +0000')
-    
-    for stream in streams:
-        title = html.escape(stream['stream_title'] or 'No Title')
-        desc = html.escape(stream['stream_game'] or 'No Category')
-        
-        xml_content.append(f'  <programme start="{start_time}" stop="{end_time}" channel="{stream["epg_channel_id"]}">')
-        xml_content.append(f'    <title lang="en">{title}</title>')
-        xml_content.append(f'    <desc lang="en">{desc}</desc>')
-        xml_content.append(f'    <category lang="en">{desc}</category>')
-        xml_content.append('  </programme>')
+        query = '''
+            SELECT l.login_name, l.epg_channel_id, l.is_live, l.stream_title, l.stream_game, l.last_live_at,
+                   l.profile_image_url, i.path AS icon_path, l.box_art_url, b.path AS box_art_path
+            FROM live_streams l
+            LEFT JOIN image_cache i ON i.source_url = l.profile_image_url
+            LEFT JOIN image_cache b ON b.source_url = l.box_art_url
+            WHERE l.is_live = 1
+        '''
+        params = ()
+
+    now = time.time()
+    fragments = []
+    rendered = 0
+    for stream in db.execute(query, params):
+        # Every transition the poller records also changes one of these
+        signature = tuple(stream)
+        fragment = epg_fragments.get(stream['login_name'])
+        if not fragment or fragment[0] != signature or now - fragment[1] > EPG_ARTIFACT_MAX_AGE:
+            fragment = (signature, now) + render_epg_channel(db, stream, now)
+            epg_fragments[stream['login_name']] = fragment
+            rendered += 1
+        epg_fragments.move_to_end(stream['login_name'])
+        fragments.append(fragment)
+    while len(epg_fragments) > EPG_FRAGMENTS_MAX:
+        epg_fragments.popitem(last=False)
         
-    xml_content.append('</tv>')
-    return '\n'.join(xml_content)
+    # XMLTV wants all <channel>s before the <programme>s
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n'
+    for fragment in fragments:
+        yield fragment[2]
+    for fragment in fragments:
+        yield fragment[3]
+    yield '</tv>\n'
+    current_app.logger.info(f"[EPG] EPG data generated for {len(fragments)} channels ({rendered} re-rendered).")
 
 def _get_vod_playlist_response(session, twitch_vod_id, stream_url):
     """(For VODs) Rewrites the playlist to point to our /vod-segment-proxy/."""
     try:
         current_app.logger.info(f"[HLS-Proxy-VOD1] Fetching media playlist for VOD {twitch_vod_id}: {stream_url}")
-        response = session.http.get(stream_url)
+        with phase('upstream'):
+            response = session.http.get(stream_url)
         response.raise_for_status()
         media_playlist_text = response.text
     except Exception as e:
@@ -73,6 +477,10 @@ def _get_vod_playlist_response(session, twitch_vod_id, stream_url):
 
     output_playlist = []
     segment_count = 0
+    base_url = stream_url.rsplit('/', 1)[0] + '/'
+    remember_vod_base_url(twitch_vod_id, base_url)
+    expires = int(time.time()) + VOD_SEGMENT_TTL
+    signature = sign_vod_segment(twitch_vod_id, expires)
     
     for line in media_playlist_text.splitlines():
         line = line.strip()
@@ -81,16 +489,29 @@ def _get_vod_playlist_response(session, twitch_vod_id, stream_url):
             output_playlist.append(line)
         else:
             segment_count += 1
-            segment_path = urlparse(line).path
-            proxy_url = f"/vod-segment-proxy/{twitch_vod_id}/{segment_path}"
+            segment_url = urljoin(base_url, line)
+            if segment_url.startswith(base_url):
+                # Relative to the media playlist: the segment proxy can rebuild the URL from its cache
+                segment_path = urlparse(segment_url[len(base_url):]).path
+            else:
+                segment_path = urlparse(line).path
+            proxy_url = f"/vod-segment-proxy/{twitch_vod_id}/{segment_path}?exp={expires}&sig={signature}"
             output_playlist.append(proxy_url)
     
     current_app.logger.info(f"[HLS-Proxy-VOD1] Playlist for VOD {twitch_vod_id} rewritten to local proxy with {segment_count} segments.")
     return Response('\n'.join(output_playlist), mimetype='application/vnd.apple.mpegurl')
 
-def generate_stream_data(stream_fd):
-    """(For Live-Proxy) Yields chunks of stream data with performance logging."""
+# Per-stream throughput diagnostics: one line per stream every STREAM_STATS_INTERVAL,
+# and across all streams at most STREAM_STATS_RATE lines per second
+STREAM_STATS_INTERVAL = 30
+STREAM_STATS_RATE = 2
+stream_stats_limiter = RateLimiter(rate=STREAM_STATS_RATE, burst=10)
+
+def generate_stream_data(stream_fd, channel=None):
+    """(For Live-Proxy) Yields chunks of stream data with (rate-limited) performance logging."""
     # This function runs outside the app context.
+    logger = logging.getLogger("flask.app")
+    log_extra = {'channel': channel}
     try:
         chunk_size = 32768 # 32KB chunks
         last_log_time = time.time()
@@ -98,12 +519,9 @@ def generate_stream_data(stream_fd):
         total_read_time = 0
         total_yield_time = 0
         chunks_count = 0
+        first_chunk = True
         
-        # Use root logger to ensure capture by FileHandler (since we are in thread/generator)
-        logger = logging.getLogger("flask.app") 
-        msg_start = f"[Live-Proxy] Diagnostics started. Chunk Size: {chunk_size}"
-        logger.info(msg_start)
-        print(msg_start, flush=True) # Fallback
+        logger.info(f"[Live-Proxy] Diagnostics started. Chunk Size: {chunk_size}", extra=log_extra)
 
         while True:
             # 1. Twitch Read
@@ -111,11 +529,12 @@ def generate_stream_data(stream_fd):
             data = stream_fd.read(chunk_size)
             t_read_done = time.time()
             
-            if chunks_count == 0:
-                 logger.info(f"[Live-Proxy] First chunk received ({len(data)} bytes) in {(t_read_done - t_start)*1000:.1f}ms.")
+            if first_chunk:
+                logger.info(f"[Live-Proxy] First chunk received ({len(data)} bytes) in {(t_read_done - t_start)*1000:.1f}ms.", extra=log_extra)
+                first_chunk = False
 
             if not data:
-                logger.info("[Live-Proxy] Stream ended (no more data).")
+                logger.info("[Live-Proxy] Stream ended (no more data).", extra=log_extra)
                 break
                 
             read_dur = t_read_done - t_start
@@ -131,17 +550,15 @@ def generate_stream_data(stream_fd):
             total_yield_time += yield_dur
             chunks_count += 1
             
-            # 3. Log (Every 2s)
+            # 3. Log (every STREAM_STATS_INTERVAL, if the global budget allows)
             now = time.time()
-            if now - last_log_time >= 2:
-                elapsed = now - last_log_time
-                mb_s = (total_bytes / (1024*1024)) / elapsed
-                avg_read = (total_read_time / chunks_count) * 1000 if chunks_count else 0
-                avg_write = (total_yield_time / chunks_count) * 1000 if chunks_count else 0
-                
-                msg_speed = f"[Speed] Throughput: {mb_s:.2f} MB/s | Twitch Read (Avg): {avg_read:.1f}ms | Client Write (Avg): {avg_write:.1f}ms"
-                logger.info(msg_speed)
-                print(msg_speed, flush=True)
+            if now - last_log_time >= STREAM_STATS_INTERVAL:
+                if stream_stats_limiter.allow():
+                    elapsed = now - last_log_time
+                    mb_s = (total_bytes / (1024*1024)) / elapsed
+                    avg_read = (total_read_time / chunks_count) * 1000
+                    avg_write = (total_yield_time / chunks_count) * 1000
+                    logger.info(f"[Speed] Throughput: {mb_s:.2f} MB/s | Twitch Read (Avg): {avg_read:.1f}ms | Client Write (Avg): {avg_write:.1f}ms", extra=log_extra)
                 
                 last_log_time = now
                 total_bytes = 0
@@ -151,10 +568,24 @@ def generate_stream_data(stream_fd):
 
     except Exception as e:
         if "Connection reset by peer" not in str(e):
-            logging.getLogger("flask.app").error(f"[Live-Proxy] ERROR: Error during streaming: {e}")
+            logger.error(f"[Live-Proxy] ERROR: Error during streaming: {e}", extra=log_extra)
     finally:
         stream_fd.close()
-        logging.getLogger("flask.app").info("[Live-Proxy] Stream connection closed.")
+        logger.info("[Live-Proxy] Stream connection closed.", extra=log_extra)
+
+def resolve_streams(url, options=()):
+    """Resolves a Twitch URL with Streamlink. Returns (session, streams).
+
+    Concurrent requests for the same URL and options (ten boxes opening one channel)
+    share a single resolve; each client still opens its own stream from the result.
+    """
+    def resolve():
+        session = streamlink.Streamlink()
+        for name, value in options:
+            session.set_option(name, value)
+        return session, session.streams(url)
+    with phase('upstream'):
+        return singleflight.do(('streamlink', url, options), resolve)
 
 # --- TIVIMATE XTREAM CODES API ENDPOINT ---
 @bp.route('/player_api.php', methods=['GET', 'POST'])
@@ -192,144 +623,45 @@ def player_api():
         current_app.logger.warning(f"[XC-API] User '{username}' authentication failed for Action '{action}'.")
         return "Invalid credentials", 401
     
-    # Get User Object for filtering
+    # Get User Object for filtering (exists, check_xc_auth passed)
     user = get_user_by_username(username)
-    user_id = user['id'] if user else None
 
     # --- 2. Live Categories ---
     if action == 'get_live_categories':
         current_app.logger.info(f"[XC-API] Delivering live categories for user '{username}'.")
         return jsonify([{"category_id": "1", "category_name": "Twitch Live", "parent_id": 0}])
 
-    # --- 3. Live Streams ---
+    # --- 3. Live Streams & VODs (per-user snapshots) ---
     if action == 'get_live_streams':
-        # Filter by user subscription
-        if user_id:
-            query = '''
-                SELECT l.* 
-                FROM live_streams l
-                JOIN channels c ON l.login_name = c.login_name
-                WHERE c.user_id = ?
-                ORDER BY l.is_live DESC, l.login_name ASC
-            '''
-            streams = db.execute(query, (user_id,)).fetchall()
-        else:
-            # Fallback (shouldn't happen with auth)
-            streams = db.execute('SELECT * FROM live_streams ORDER BY is_live DESC, login_name ASC').fetchall()
-            
-        current_app.logger.info(f"[XC-API] Delivering {len(streams)} live streams for user '{username}'.")
-        
-        live_streams_json = []
-        for stream in streams:
-            # Use login_name as key for now, or maybe stream['login_name'] as ID? 
-            # TiviMate expects an integer stream_id mostly. 
-            # We don't have a stable integer ID per user-channel-link easily unless we use channels.id
-            # But live_streams table removed ID. 
-            # Let's use hash or just keep login_name if supported, or fake ID?
-            # Actually, we can use channels.id! We need to join to get it.
-            # Let's adjust query to get channels.id as stream_id
-            pass # See next block for fix logic (I can't edit mid-stream easily, but I will adjust query above)
-            
-        # Re-doing query to get channel ID which is stable for the user
-        if user_id:
-            query = '''
-                SELECT l.*, c.id as channel_id
-                FROM live_streams l
-                JOIN channels c ON l.login_name = c.login_name
-                WHERE c.user_id = ?
-                ORDER BY l.is_live DESC, l.login_name ASC
-            '''
-            streams = db.execute(query, (user_id,)).fetchall()
-            
-        live_streams_json = []
-        for stream in streams:
-            display_name = stream['display_name']
-            if stream['is_live'] and stream['stream_title']:
-                display_name = f"{stream['login_name']} - {stream['stream_title']}"
-                
-            live_streams_json.append({
-                "num": stream['channel_id'], "name": display_name, "stream_type": "live", "stream_id": stream['channel_id'], 
-                "stream_icon": "", "epg_channel_id": stream['epg_channel_id'], "added": str(int(time.time())),
-                "category_id": "1", "custom_sid": "", "tv_archive": 0, "container_extension": "m3u8"
-            })
-        return jsonify(live_streams_json)
+        return catalog_response(user, action, None, build_live_streams)
         
     if action == 'get_vod_categories':
-        query = '''
-            SELECT DISTINCT c.login_name
-            FROM channels c
-            JOIN vod_streams v ON c.login_name = v.channel_login
-            WHERE c.user_id = ?
-        '''
-        vod_categories = db.execute(query, (user_id,)).fetchall() if user_id else []
-        json_resp = []
-        for row in vod_categories:
-            cat_id = str(zlib.crc32(row['login_name'].encode('utf-8')) & 0x7FFFFFFF)
-            json_resp.append({
-                "category_id": cat_id,
-                "category_name": row['login_name'].title(),
-                "parent_id": 0
-            })
-        current_app.logger.info(f"[XC-API] Delivering {len(json_resp)} VOD categories for user '{username}'.")
-        return jsonify(json_resp)
+        return catalog_response(user, action, None, build_vod_categories)
         
     if action == 'get_vod_streams':
         category_id_filter = request.args.get('category_id')
-        query = '''
-            SELECT v.*, c.login_name
-            FROM vod_streams v
-            JOIN channels c ON v.channel_login = c.login_name
-            WHERE c.user_id = ?
-            ORDER BY v.created_at DESC
-        '''
-        vods = db.execute(query, (user_id,)).fetchall() if user_id else []
-        json_resp = []
-        
-        for vod in vods:
-            cat_id = str(zlib.crc32(vod['login_name'].encode('utf-8')) & 0x7FFFFFFF)
-            if category_id_filter and category_id_filter != '*' and str(category_id_filter) != cat_id:
-                continue
-                
-            formatted_date = ""
-            try:
-                dt = datetime.strptime(vod['created_at'], "%Y-%m-%dT%H:%M:%SZ")
-                formatted_date = dt.strftime("%d.%m.%y")
-            except Exception:
-                formatted_date = vod['created_at'][:10]
-                
-            ep_title = f"[{formatted_date}] {vod['title']}"
-            
-            json_resp.append({
-                "num": vod['id'],
-                "name": ep_title,
-                "stream_type": "movie",
-                "stream_id": vod['vod_id'],
-                "stream_icon": vod['thumbnail_url'],
-                "rating": "5",
-                "rating_5based": 5,
-                "added": str(int(time.time())),
-                "category_id": cat_id,
-                "container_extension": "mp4",
-                "custom_sid": "",
-                "direct_source": ""
-            })
-            
-        current_app.logger.info(f"[XC-API] Delivering {len(json_resp)} VOD streams for user '{username}'.")
-        return jsonify(json_resp)
+        if category_id_filter == '*':
+            category_id_filter = None
+        return catalog_response(user, action, category_id_filter, build_vod_streams)
 
     if action == 'get_vod_info':
         vod_id = request.args.get('vod_id')
         if not vod_id: return jsonify({})
-        row = db.execute("SELECT * FROM vod_streams WHERE vod_id = ? OR id = ?", (vod_id, vod_id)).fetchone()
+        row = db.execute('''
+            SELECT v.*, i.path AS image_path FROM vod_streams v
+            LEFT JOIN image_cache i ON i.source_url = v.thumbnail_url
+            WHERE v.vod_id = ? OR v.id = ?
+        ''', (vod_id, vod_id)).fetchone()
         if not row: return jsonify({})
         
         duration_str = "00:00:00"
         if row['duration']:
             duration_str = str(timedelta(seconds=int(row['duration'])))
+        play_token = make_playback_token('vod', user, row['vod_id'], v=row['vod_id'])
             
         return jsonify({
             "info": {
-                "movie_image": row['thumbnail_url'],
+                "movie_image": image_url(row['image_path'], row['thumbnail_url']),
                 "plot": row['title'],
                 "cast": row['channel_login'].title(),
                 "director": row['channel_login'].title(),
@@ -342,8 +674,9 @@ def player_api():
                 "stream_id": row['vod_id'],
                 "name": row['title'],
                 "added": str(int(time.time())),
-                "category_id": str(zlib.crc32(row['channel_login'].encode('utf-8')) & 0x7FFFFFFF),
-                "container_extension": "mp4"
+                "category_id": row['category_id'],
+                "container_extension": "mp4",
+                "direct_source": f"{HOST_URL}/movie/{username}/{play_token}/{row['vod_id']}.mp4"
             }
         })
 
@@ -365,27 +698,34 @@ def player_api():
 @bp.route('/live/<username>/<password>/<int:stream_id>')
 @bp.route('/live/<username>/<password>/<int:stream_id>.<ext>')
 def play_live_stream_xc(username, password, stream_id, ext=None):
-    if not check_xc_auth(username, password):
-        return "Invalid credentials", 401
-    
-    db = get_db()
-    # stream_id in M3U/XC is now channels.id
-    # We need to find the login_name from channels table (and ensure user owns it? strict check optional but good)
-    channel = db.execute('''
-        SELECT c.login_name, u.auth_token 
-        FROM channels c 
-        JOIN users u ON c.user_id = u.id 
-        WHERE c.id = ?
-    ''', (stream_id,)).fetchone()
-    
-    if not channel:
-        current_app.logger.error(f"[Play-Live-XC] Stream with ID {stream_id} not found in Channels.")
-        return "Stream not found", 404
+    # Signed URL from player_api: no password check
+    play_token, token_user = read_playback_token(password, 'live', username, stream_id)
+    if play_token:
+        login_name = play_token['l']
+        auth_token = token_user['auth_token']
+    else:
+        if not check_xc_auth(username, password):
+            return "Invalid credentials", 401
         
-    login_name = channel['login_name']
-    auth_token = channel['auth_token']
+        db = get_db()
+        # stream_id in M3U/XC is now channels.id
+        # We need to find the login_name from channels table (and ensure user owns it? strict check optional but good)
+        channel = db.execute('''
+            SELECT c.login_name, u.auth_token 
+            FROM channels c 
+            JOIN users u ON c.user_id = u.id 
+            WHERE c.id = ?
+        ''', (stream_id,)).fetchone()
+        
+        if not channel:
+            current_app.logger.error(f"[Play-Live-XC] Stream with ID {stream_id} not found in Channels.")
+            return "Stream not found", 404
+            
+        login_name = channel['login_name']
+        auth_token = channel['auth_token']
     
     live_mode = get_setting('live_stream_mode', 'proxy') # Default 'proxy'
+    g.log_channel = login_name
     current_app.logger.info(f"[Play-Live-XC] Request for {login_name} (ID: {stream_id}). Mode: {live_mode}")
 
     hls_live_edge = get_setting('hls_live_edge', '10')      # Default INCREASED to 10 for stability
@@ -399,21 +739,22 @@ def play_live_stream_xc(username, password, stream_id, ext=None):
     disable_ads = True
 
     sl_logger = logging.getLogger("streamlink")
-    # ... (Keep logging config) ...
-
-    session = streamlink.Streamlink()
-    session.set_option("hls-live-edge", int(hls_live_edge))
-    session.set_option("hls-segment-threads", int(hls_segment_threads))
-    session.set_option("hls-playlist-reload-attempts", 5) # Internal stability boost
-    session.set_option("ringbuffer-size", int(ringbuffer_size))
-    session.set_option("http-header", "User-Agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-    session.set_option("twitch-disable-ads", disable_ads)
+    sl_logger.setLevel(logging.DEBUG if debug_logging else logging.WARNING)
+
+    options = (
+        ("hls-live-edge", int(hls_live_edge)),
+        ("hls-segment-threads", int(hls_segment_threads)),
+        ("hls-playlist-reload-attempts", 5), # Internal stability boost
+        ("ringbuffer-size", int(ringbuffer_size)),
+        ("http-header", "User-Agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"),
+        ("twitch-disable-ads", disable_ads),
+    )
     if auth_token:
         current_app.logger.info(f"[Streamlink] Applying User Auth Token for stream: {login_name}")
-        session.set_option("twitch-auth-token", auth_token)
+        options += (("twitch-auth-token", auth_token),)
     
     try:
-        streams = session.streams(f'twitch.tv/{login_name}')
+        session, streams = resolve_streams(f'twitch.tv/{login_name}', options)
         if "best" not in streams:
             current_app.logger.warning(f"[Play-Live-XC] Streamlink found no stream for {login_name}. (Offline?)")
             return "Stream offline or not found", 404
@@ -423,9 +764,10 @@ def play_live_stream_xc(username, password, stream_id, ext=None):
             return redirect(streams["best"].url)
         else:
             current_app.logger.info(f"[Play-Live-XC] Opening stream in Proxy-Mode for {login_name}. (Ads Disabled: {disable_ads}, Buffer: {ringbuffer_size}, Edge: {hls_live_edge})")
-            stream_fd = streams["best"].open()
+            with phase('upstream'):
+                stream_fd = streams["best"].open()
             current_app.logger.info("[Live-Proxy] Stream generator starting.")
-            return Response(generate_stream_data(stream_fd), mimetype='video/mp2t')
+            return Response(generate_stream_data(stream_fd, login_name), mimetype='video/mp2t')
 
     except Exception as e:
         current_app.logger.error(f"[Play-Live-XC] ERROR: {e}")
@@ -451,6 +793,7 @@ def play_live_m3u(stream_id):
     auth_token = channel['auth_token']
     
     live_mode = get_setting('live_stream_mode', 'proxy')
+    g.log_channel = login_name
     current_app.logger.info(f"[Play-Live-M3U] Request for {login_name} (ID: {stream_id}). Mode: {live_mode}")
     
     hls_live_edge = get_setting('hls_live_edge', '10')      # Default INCREASED to 10
@@ -461,20 +804,21 @@ def play_live_m3u(stream_id):
     disable_ads = get_setting('twitch_disable_ads', 'true') == 'true' # Default ENABLED
 
     sl_logger = logging.getLogger("streamlink")
-    # ... (Logging config skipped for brevity in search, assuming it matches above structure) ...
-
-    session = streamlink.Streamlink()
-    session.set_option("hls-live-edge", int(hls_live_edge))
-    session.set_option("hls-segment-threads", int(hls_segment_threads))
-    session.set_option("hls-playlist-reload-attempts", 5)
-    session.set_option("ringbuffer-size", int(ringbuffer_size))
-    session.set_option("http-header", "User-Agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-    session.set_option("twitch-disable-ads", disable_ads)
+    sl_logger.setLevel(logging.DEBUG if debug_logging else logging.WARNING)
+
+    options = (
+        ("hls-live-edge", int(hls_live_edge)),
+        ("hls-segment-threads", int(hls_segment_threads)),
+        ("hls-playlist-reload-attempts", 5),
+        ("ringbuffer-size", int(ringbuffer_size)),
+        ("http-header", "User-Agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"),
+        ("twitch-disable-ads", disable_ads),
+    )
     if auth_token:
-        session.set_option("twitch-auth-token", auth_token)
+        options += (("twitch-auth-token", auth_token),)
     
     try:
-        streams = session.streams(f'twitch.tv/{login_name}')
+        session, streams = resolve_streams(f'twitch.tv/{login_name}', options)
         if "best" not in streams:
             current_app.logger.warning(f"[Play-Live-M3U] Streamlink found no stream for {login_name}. (Offline?)")
             return "Stream offline or not found", 404
@@ -484,9 +828,10 @@ def play_live_m3u(stream_id):
             return redirect(streams["best"].url)
         else:
             current_app.logger.info(f"[Play-Live-M3U] Opening stream in Proxy-Mode for {login_name}. (Ads Disabled: {disable_ads})")
-            stream_fd = streams["best"].open()
+            with phase('upstream'):
+                stream_fd = streams["best"].open()
             current_app.logger.info("[Live-Proxy] Stream generator starting.")
-            return Response(generate_stream_data(stream_fd), mimetype='video/mp2t')
+            return Response(generate_stream_data(stream_fd, login_name), mimetype='video/mp2t')
         
     except Exception as e:
         current_app.logger.error(f"[Play-Live-M3U] ERROR: {e}")
@@ -499,32 +844,36 @@ def play_live_m3u(stream_id):
 @bp.route('/series/<username>/<password>/<string:stream_id>') 
 @bp.route('/series/<username>/<password>/<string:stream_id>.<ext>')
 def play_vod_stream_xc(username, password, stream_id, ext=None):
-    if not check_xc_auth(username, password):
-        current_app.logger.warning(f"[Play-VOD-XC] Invalid credentials for user '{username}'")
-        return "Invalid credentials", 401
-
-    twitch_vod_id = stream_id 
-    
-    # Resolve potential internal ID to Twitch VOD ID
-    db = get_db()
-    # First check if it's already a valid Twitch VOD ID (usually long string of digits)
-    # But strictly, check DB first to be safe or if stream_id is internal ID
-    row = db.execute("SELECT vod_id FROM vod_streams WHERE vod_id = ?", (stream_id,)).fetchone()
-    if row:
-        twitch_vod_id = row['vod_id']
+    # Signed URL from player_api: no password check, no DB lookup beyond the user
+    play_token, _ = read_playback_token(password, 'vod', username, stream_id)
+    if play_token:
+        twitch_vod_id = play_token['v']
     else:
-        # Fallback: check if it is an internal ID
-        if str(stream_id).isdigit():
-             row = db.execute("SELECT vod_id FROM vod_streams WHERE id = ?", (stream_id,)).fetchone()
-             if row:
-                 twitch_vod_id = row['vod_id']
-                 current_app.logger.info(f"[Play-VOD-XC]: Resolved internal ID {stream_id} to Twitch VOD ID {twitch_vod_id}")
+        if not check_xc_auth(username, password):
+            current_app.logger.warning(f"[Play-VOD-XC] Invalid credentials for user '{username}'")
+            return "Invalid credentials", 401
+
+        twitch_vod_id = stream_id 
+        
+        # Resolve potential internal ID to Twitch VOD ID
+        db = get_db()
+        # First check if it's already a valid Twitch VOD ID (usually long string of digits)
+        # But strictly, check DB first to be safe or if stream_id is internal ID
+        row = db.execute("SELECT vod_id FROM vod_streams WHERE vod_id = ?", (stream_id,)).fetchone()
+        if row:
+            twitch_vod_id = row['vod_id']
+        else:
+            # Fallback: check if it is an internal ID
+            if str(stream_id).isdigit():
+                 row = db.execute("SELECT vod_id FROM vod_streams WHERE id = ?", (stream_id,)).fetchone()
+                 if row:
+                     twitch_vod_id = row['vod_id']
+                     current_app.logger.info(f"[Play-VOD-XC]: Resolved internal ID {stream_id} to Twitch VOD ID {twitch_vod_id}")
 
     current_app.logger.info(f"[Play-VOD-XC]: Client requested HLS-STUFE-1 for VOD {twitch_vod_id}")
-    session = streamlink.Streamlink()
 
     try:
-        streams = session.streams(f'twitch.tv/videos/{twitch_vod_id}')
+        session, streams = resolve_streams(f'twitch.tv/videos/{twitch_vod_id}')
         if "best" not in streams:
             current_app.logger.warning(f"[Play-VOD-XC]: VOD not found on Twitch: {twitch_vod_id}")
             return "VOD not found", 404
@@ -539,19 +888,29 @@ def play_vod_stream_xc(username, password, stream_id, ext=None):
 @bp.route('/vod-segment-proxy/<string:twitch_vod_id>/<path:segment_path>')
 def vod_segment_proxy(twitch_vod_id, segment_path):
     """STAGE 2: Intercepts segment requests and redirects to a valid Twitch CDN URL."""
+    if not check_vod_segment_signature(twitch_vod_id, request.args.get('exp'), request.args.get('sig')):
+        current_app.logger.warning(f"[VOD-Proxy-S2] Invalid or expired signature for VOD {twitch_vod_id}.")
+        return "Invalid or expired segment URL", 403
+
+    # Fast path: media playlist base URL is known from the Stage-1 rewrite
+    cached = vod_base_urls.get(twitch_vod_id)
+    if cached and time.time() < cached[1]:
+        return redirect(urljoin(cached[0], segment_path))
+
     current_app.logger.info(f"[VOD-Proxy-S2]: Request for segment '{segment_path}' for VOD {twitch_vod_id}")
-    session = streamlink.Streamlink()
     
     try:
-        streams = session.streams(f'twitch.tv/videos/{twitch_vod_id}')
+        session, streams = resolve_streams(f'twitch.tv/videos/{twitch_vod_id}')
         if "best" not in streams:
             current_app.logger.warning(f"[VOD-Proxy-S2] Streamlink found no streams for VOD {twitch_vod_id}")
             return "Streamlink found no streams", 404
             
         media_playlist_url = streams["best"].url
         base_url = media_playlist_url.rsplit('/', 1)[0] + '/'
+        remember_vod_base_url(twitch_vod_id, base_url)
         
-        response = session.http.get(media_playlist_url)
+        with phase('upstream'):
+            response = session.http.get(media_playlist_url)
         response.raise_for_status()
         media_playlist_text = response.text
         
@@ -574,6 +933,11 @@ def vod_segment_proxy(twitch_vod_id, segment_path):
 
 # --- M3U / EPG ENDPOINTS ---
 
+@bp.route('/images/<path:path>')
+def cached_image(path):
+    """Cached images. Behind nginx this route is never reached (location /images/)."""
+    return send_from_directory(IMAGES_DIR, path, max_age=31536000)
+
 @bp.route('/playlist.m3u')
 def generate_m3u():
     token = request.args.get('token')
@@ -582,43 +946,16 @@ def generate_m3u():
         current_app.logger.warning("[M3U] M3U playlist request, but feature is disabled.")
         return "M3U playlist feature is disabled on the server.", 404
     
-    user_id = None
     if token:
         user = get_user_by_token(token)
-        if user:
-            user_id = user['id']
-        else:
+        if not user:
             return "Invalid token", 401
     else:
         # Require token
         return "Auth token missing", 401
         
-    db = get_db()
-    # Join to filter by user and get channels.id
-    query = '''
-        SELECT l.*, c.id as channel_id
-        FROM live_streams l
-        JOIN channels c ON l.login_name = c.login_name
-        WHERE c.user_id = ?
-        ORDER BY l.is_live DESC, l.login_name ASC
-    '''
-    streams = db.execute(query, (user_id,)).fetchall()
-    
-    epg_url = f"{HOST_URL}/epg.xml?token={token}"
-    m3u_content = [f'#EXTM3U url-tvg="{epg_url}"']
-    
-    for stream in streams:
-        channel_name = stream['display_name']
-        if stream['is_live'] and stream['stream_title']:
-            channel_name = f"{stream['login_name']} - {stream['stream_title']}"
-            
-        tvg_id = stream['epg_channel_id'] 
-        stream_url = f"{HOST_URL}/play_live_m3u/{stream['channel_id']}"
-        m3u_content.append(f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{channel_name}" tvg-logo="" group-title="Twitch Live",{channel_name}')
-        m3u_content.append(stream_url)
-
-    current_app.logger.info(f"[M3U] M3U playlist generated with {len(streams)} channels for token user.")
-    return Response('\n'.join(m3u_content), mimetype='audio/mpegurl')
+    # The token is part of the playlist (EPG URL)
+    return artifact_response(user, 'playlist.m3u', 'audio/mpegurl', lambda: render_m3u(get_db(), user, token), variant=token)
 
 @bp.route('/epg.xml')
 def generate_epg_xml():
@@ -629,8 +966,10 @@ def generate_epg_xml():
         if user: user_id = user['id']
             
     current_app.logger.info("[M3U-EPG] Request for M3U EPG (epg.xml) received.")
-    xml_data = generate_epg_data(user_id=user_id)
-    return Response(xml_data, mimetype='application/xml')
+    if user_id:
+        return artifact_response(user, 'epg.xml', 'application/xml', lambda: generate_epg_data(user_id=user_id),
+                                 max_age=EPG_ARTIFACT_MAX_AGE)
+    return Response(stream_with_context(generate_epg_data(user_id=user_id)), mimetype='application/xml')
 
 @bp.route('/xmltv.php')
 def generate_xc_epg_xml():
@@ -642,5 +981,5 @@ def generate_xc_epg_xml():
     user_id = user['id'] if user else None
 
     current_app.logger.info(f"[XC-EPG] Request for XC EPG (xmltv.php) from user '{username}' received.")
-    xml_data = generate_epg_data(user_id=user_id)
-    return Response(xml_data, mimetype='application/xml')
\ No newline at end of file
+    return artifact_response(user, 'epg.xml', 'application/xml', lambda: generate_epg_data(user_id=user_id),
+                             max_age=EPG_ARTIFACT_MAX_AGE)
\ No newline at end of file
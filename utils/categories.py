@@ -0,0 +1,8 @@
+import zlib
+
+def vod_category_id(login_name):
+    """XC category ID of a channel's VODs (stable across restarts and processes).
+
+    Stored in vod_streams.category_id by the poller; keep in sync with existing rows.
+    """
+    return str(zlib.crc32(login_name.encode('utf-8')) & 0x7FFFFFFF)
@@ -0,0 +1,34 @@
+import base64
+import hashlib
+import hmac
+import os
+from cryptography.fernet import Fernet, InvalidToken
+
+# Same fallback as app.py, so web and poller derive the same keys
+DEFAULT_SECRET_KEY = 'default-dev-key-please-change'
+
+def get_secret_key():
+    """Returns SECRET_KEY from the environment (works outside the Flask app, e.g. in the poller)."""
+    return os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
+
+def _fernet(purpose):
+    # Derive a separate key per purpose, so one secret never encrypts unrelated data
+    digest = hmac.new(get_secret_key().encode('utf-8'), purpose.encode('utf-8'), hashlib.sha256).digest()
+    return Fernet(base64.urlsafe_b64encode(digest))
+
+def encrypt(value, purpose):
+    """Encrypts and authenticates a string (secrets at rest, opaque URL tokens)."""
+    return _fernet(purpose).encrypt(value.encode('utf-8')).decode('ascii')
+
+def decrypt(token, purpose, ttl=None):
+    """Decrypts a value from encrypt(). Returns None if it can't be decrypted (e.g. SECRET_KEY
+    changed, tampered with) or is older than ttl seconds.
+    """
+    try:
+        return _fernet(purpose).decrypt(token.encode('ascii'), ttl=ttl).decode('utf-8')
+    except (InvalidToken, ValueError, UnicodeError):
+        return None
+
+def keyed_digest(value, purpose):
+    """HMAC-SHA256 of a value, for lookups that must not store the value itself."""
+    return hmac.new(get_secret_key().encode('utf-8'), f"{purpose}:{value}".encode('utf-8'), hashlib.sha256).hexdigest()
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+import requests
+
+# Content-addressed image cache: instance/images/<2 hex>/<sha256>.<ext>. The poller
+# fills it, nginx serves it (/images/, cached forever: a file never changes), the
+# image_cache table maps the Twitch URL to the file and tracks when it was last used.
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES_DIR = os.path.join(BASE_DIR, 'instance', 'images')
+
+MAX_IMAGE_BYTES = 2 * 1024 * 1024
+IMAGE_TYPES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/gif': 'gif'}
+
+# Sizes as shown by TiviMate. Twitch's CDN renders these for us, so every image is
+# fetched once at its final size (no local resizing). Avatars only come in a few
+# fixed sizes (70, 150, 300, 600).
+PROFILE_IMAGE_SIZE = (150, 150)
+BOX_ART_SIZE = (285, 380)
+VOD_THUMBNAIL_SIZE = (640, 360)
+
+def profile_image_url(url):
+    width, height = PROFILE_IMAGE_SIZE
+    return re.sub(r'-profile_image-\d+x\d+\.', f'-profile_image-{width}x{height}.', url)
+
+def box_art_url(game_id):
+    if not game_id:
+        return None
+    width, height = BOX_ART_SIZE
+    return f"https://static-cdn.jtvnw.net/ttv-boxart/{game_id}-{width}x{height}.jpg"
+
+def vod_thumbnail_url(template):
+    width, height = VOD_THUMBNAIL_SIZE
+    return template.replace('%{width}', str(width)).replace('%{height}', str(height))
+
+def fetch_image(url, images_dir=IMAGES_DIR):
+    """Downloads an image into the cache. Returns (path relative to images_dir, size) or None."""
+    try:
+        response = requests.get(url, timeout=15, stream=True)
+        response.raise_for_status()
+        ext = IMAGE_TYPES.get(response.headers.get('Content-Type', '').split(';')[0].strip())
+        if not ext:
+            logging.warning(f"[Images] Not an image: {url}")
+            return None
+        data = b''
+        for chunk in response.iter_content(65536):
+            data += chunk
+            if len(data) > MAX_IMAGE_BYTES:
+                logging.warning(f"[Images] Image too large, skipped: {url}")
+                return None
+    except Exception as e:
+        logging.warning(f"[Images] Could not fetch {url}: {e}")
+        return None
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = f"{digest[:2]}/{digest}.{ext}"
+    full_path = os.path.join(images_dir, path)
+    if not os.path.exists(full_path):
+        # Same content = same name, so concurrent writers can't conflict
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644) # nginx runs as another user
+        os.replace(tmp_path, full_path)
+    return path, len(data)
+
+def remove_image(path, images_dir=IMAGES_DIR):
+    try:
+        os.remove(os.path.join(images_dir, path))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,148 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+
+# Log ring shared by all processes (web app, pollers): a fixed-size file of slots
+# that every process's log listener appends to, newest overwriting oldest. The admin
+# log page reads it (instance/logs.ring) without going through the processes.
+#
+# Layout: header (magic, next sequence number), then SLOTS slots of SLOT_SIZE bytes,
+# each (sequence number, length, JSON entry). Entry n lives in slot n % SLOTS.
+# Writers serialize via flock and mark a slot INVALID_SEQ before rewriting its payload.
+# Readers don't lock: they check the slot's sequence number before and after copying
+# the payload and drop the entry unless it's the expected one both times (overwritten
+# or being written).
+MAGIC = b'LOGRING1'
+HEADER = struct.Struct('<8sQ')
+SLOT_HEADER = struct.Struct('<QH')
+SLOTS = 10000
+SLOT_SIZE = 1024
+MAX_PAYLOAD = SLOT_SIZE - SLOT_HEADER.size
+INVALID_SEQ = 2**64 - 1
+
+LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING,
+          'ERROR': logging.ERROR, 'CRITICAL': logging.CRITICAL}
+
+class LogRing:
+    def __init__(self, path, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        self.size = HEADER.size + slots * SLOT_SIZE
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            magic = os.pread(self.fd, len(MAGIC), 0)
+            if os.fstat(self.fd).st_size != self.size or magic != MAGIC:
+                # New file, or one of a different size: start over
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, 0), 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map = mmap.mmap(self.fd, self.size)
+
+    def next_seq(self):
+        return HEADER.unpack_from(self.map, 0)[1]
+
+    def append(self, entry):
+        payload = encode(entry)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            seq = self.next_seq()
+            offset = HEADER.size + (seq % self.slots) * SLOT_SIZE
+            # Invalidate first: a reader still holding the old entry's header must see it change
+            SLOT_HEADER.pack_into(self.map, offset, INVALID_SEQ, 0)
+            self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+            SLOT_HEADER.pack_into(self.map, offset, seq, len(payload))
+            HEADER.pack_into(self.map, 0, MAGIC, seq + 1)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return seq
+
+    def get(self, seq):
+        """Returns entry `seq` (with its 'seq'), or None if it was overwritten or isn't complete."""
+        offset = HEADER.size + (seq % self.slots) * SLOT_SIZE
+        slot_seq, length = SLOT_HEADER.unpack_from(self.map, offset)
+        if slot_seq != seq or slot_seq == INVALID_SEQ or length > MAX_PAYLOAD:
+            return None
+        payload = self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+        if SLOT_HEADER.unpack_from(self.map, offset) != (seq, length):
+            return None # Invalidated or overwritten while reading
+        try:
+            entry = json.loads(payload)
+        except ValueError:
+            return None
+        entry['seq'] = seq
+        return entry
+
+    def read(self, before=None, after=None, limit=200, match=None):
+        """Returns up to `limit` entries accepted by match(entry), newest first.
+
+        before: only entries older than this seq (paging back). after: only entries
+        newer than this seq (tailing); these are returned oldest first.
+        """
+        end = self.next_seq()
+        start = max(0, end - self.slots)
+        if after is not None:
+            seqs = range(max(start, after + 1), end)
+        else:
+            seqs = range(min(end, before if before is not None else end) - 1, start - 1, -1)
+        entries = []
+        for seq in seqs:
+            entry = self.get(seq)
+            if entry and (match is None or match(entry)):
+                entries.append(entry)
+                if len(entries) >= limit:
+                    break
+        return entries
+
+def encode(entry):
+    """JSON of an entry, shortened (msg/exc cut) to fit a slot."""
+    payload = json.dumps(entry, ensure_ascii=False, default=str).encode('utf-8')
+    if len(payload) <= MAX_PAYLOAD:
+        return payload
+    entry = dict(entry)
+    for field in ('exc', 'msg'):
+        if field in entry:
+            excess = len(payload) - MAX_PAYLOAD
+            value = entry[field].encode('utf-8')
+            entry[field] = value[:max(0, len(value) - excess - 16)].decode('utf-8', 'ignore') + '…'
+            payload = json.dumps(entry, ensure_ascii=False, default=str).encode('utf-8')
+            if len(payload) <= MAX_PAYLOAD:
+                return payload
+    return json.dumps({k: entry[k] for k in ('ts', 'level', 'component') if k in entry}).encode('utf-8')
+
+def make_filter(level=None, component=None, channel=None, text=None):
+    """Returns match(entry) for LogRing.read: minimum level, exact component/channel, substring of msg."""
+    min_level = LEVELS.get((level or '').upper(), 0)
+    text = text.lower() if text else None
+
+    def match(entry):
+        if min_level and LEVELS.get(entry.get('level'), 0) < min_level:
+            return False
+        if component and entry.get('component') != component:
+            return False
+        if channel and entry.get('channel') != channel:
+            return False
+        if text and text not in entry.get('msg', '').lower():
+            return False
+        return True
+    return match
+
+class RingHandler(logging.Handler):
+    """Appends records to a LogRing. Runs in the log listener thread (see utils/logs.py);
+    formatter is a utils.logs.JsonFormatter.
+    """
+    def __init__(self, ring, formatter):
+        super().__init__()
+        self.ring = ring
+        self.setFormatter(formatter)
+
+    def emit(self, record):
+        try:
+            self.ring.append(self.formatter.entry(record))
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,171 @@
+import atexit
+import copy
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from gevent import monkey
+
+from utils.log_ring import LogRing, RingHandler
+
+# Log records go through a bounded queue to a listener running in a real OS thread
+# (even when gevent has monkey-patched threading), which writes them as JSON lines.
+# A greenlet that logs only appends to the queue: a slow stdout pipe or disk can
+# never stall the event loop. When the queue is full, records are dropped and counted.
+LOG_QUEUE_SIZE = 10000
+
+# Unpatched primitives: the listener must not be a greenlet
+SimpleQueue = monkey.get_original('queue', 'SimpleQueue')
+start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+allocate_native_lock = monkey.get_original('_thread', 'allocate_lock')
+
+# Record attributes (passed via extra={...}) copied into the JSON line
+EXTRA_FIELDS = ('channel', 'user', 'stream_id')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, component, logger, msg, where (+ extras)."""
+    def __init__(self, component):
+        super().__init__()
+        self.component = component
+
+    def format(self, record):
+        return json.dumps(self.entry(record), ensure_ascii=False, default=str)
+
+    def entry(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.upper(), # streamlink renames the levels to lowercase
+            'component': self.component,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'where': f"{record.filename}:{record.lineno}",
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return entry
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped (and counted) while
+    the queue holds maxsize records. The count is reported once there is room again.
+    """
+    def __init__(self, queue, maxsize=LOG_QUEUE_SIZE, context=None):
+        super().__init__(queue)
+        self.maxsize = maxsize
+        self.context = context
+        self.dropped = 0
+        self.reported = 0
+
+    def prepare(self, record):
+        # Resolved here, in the logging greenlet: args and exc_info must not outlive the call
+        record = copy.copy(record)
+        if self.context:
+            for field, value in self.context().items():
+                if value is not None and getattr(record, field, None) is None:
+                    setattr(record, field, value)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+        if self.dropped > self.reported:
+            self.queue.put_nowait(logging.makeLogRecord({
+                'name': 'logs', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"[Logging] Log queue full, dropped {self.dropped - self.reported} record(s) "
+                       f"({self.dropped} in total).",
+            }))
+            self.reported = self.dropped
+
+class NativeQueueListener(QueueListener):
+    """QueueListener whose thread is an OS thread, not a greenlet."""
+    def start(self):
+        self._done = allocate_native_lock()
+        self._done.acquire()
+
+        def run():
+            try:
+                self._monitor()
+            finally:
+                self._done.release()
+        start_native_thread(run, ())
+
+    def stop(self, timeout=5):
+        self.enqueue_sentinel()
+        self._done.acquire(timeout=timeout)
+
+class RateLimiter:
+    """Token bucket: allows `rate` events per second on average, bursts up to `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        return True
+
+# The installed pipeline (one per process)
+queue_handler = None
+listener = None
+
+def setup_logging(component, level, log_path=None, ring_path=None, context=None):
+    """Routes all logging of this process (root logger) through the queue to stdout,
+    the rotating file log_path and the shared log ring ring_path (both optional).
+    context() may return extra fields (e.g. the request's channel) for each record.
+    Returns the queue handler.
+    """
+    global queue_handler, listener
+    if queue_handler:
+        return queue_handler
+
+    formatter = JsonFormatter(component)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_path:
+        try:
+            handlers.append(RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=1))
+        except Exception as e:
+            print(f"[Boot-Error] Failed to setup file logging: {e}")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if ring_path:
+        try:
+            handlers.append(RingHandler(LogRing(ring_path), formatter))
+        except Exception as e:
+            print(f"[Boot-Error] Failed to open the log ring: {e}")
+
+    queue = SimpleQueue()
+    queue_handler = DroppingQueueHandler(queue, context=context)
+    listener = NativeQueueListener(queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+    return queue_handler
+
+def dropped_records():
+    return queue_handler.dropped if queue_handler else 0
@@ -1,16 +1,17 @@
 import smtplib
 from email.mime.text import MIMEText
 from flask import current_app
-from db import get_db, get_setting
+from db import get_db, get_settings
 
 def send_mail(to, subject, body):
     """Sends an email using the SMTP settings from the database."""
     try:
-        smtp_host = get_setting('smtp_host', 'smtp.example.com')
-        smtp_port = int(get_setting('smtp_port', '587'))
-        smtp_user = get_setting('smtp_user', '')
-        smtp_password = get_setting('smtp_password', '')
-        smtp_from = get_setting('smtp_from', 'noreply@example.com')
+        settings = get_settings()
+        smtp_host = settings.get('smtp_host', 'smtp.example.com')
+        smtp_port = int(settings.get('smtp_port', '587'))
+        smtp_user = settings.get('smtp_user', '')
+        smtp_password = settings.get('smtp_password', '')
+        smtp_from = settings.get('smtp_from', 'noreply@example.com')
 
         if not smtp_host or smtp_host == 'smtp.example.com':
             current_app.logger.warning(f"[Mail] SMTP not configured. Skipping email to {to}.")
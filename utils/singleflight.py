@@ -0,0 +1,27 @@
+from gevent.event import AsyncResult
+
+# Calls in progress: Key=caller-defined key, Value=AsyncResult
+_inflight = {}
+
+def do(key, fn):
+    """Runs fn() once for all greenlets asking for the same key at the same time.
+
+    The first caller runs it, callers arriving while it runs wait and get the same
+    result (or exception). Nothing is cached once the call has finished.
+    """
+    pending = _inflight.get(key)
+    if pending is not None:
+        return pending.get()
+
+    result = AsyncResult()
+    _inflight[key] = result
+    try:
+        value = fn()
+    except BaseException as e:
+        result.set_exception(e)
+        raise
+    else:
+        result.set(value)
+        return value
+    finally:
+        del _inflight[key]
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+# Shared by the web app (db.py) and the poller. WAL lets web requests keep
+# reading while the poller writes; busy_timeout makes writers wait for each
+# other instead of failing with "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",   # Safe with WAL, only the last commits may be lost on power loss
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -8000",     # 8 MB page cache per connection
+    "PRAGMA mmap_size = 67108864",   # 64 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+)
+
+MAX_IDLE_CONNECTIONS = 8
+
+# Idle connections: Key=(db_path, connection class), Value=list of connections.
+# Keyed by class too, so e.g. the web app's timed connections never come back plain.
+_idle = {}
+# threading.Lock is patched into a greenlet lock by gevent's monkey-patching
+_lock = threading.Lock()
+
+def connect(db_path, factory=sqlite3.Connection):
+    """Opens a new, tuned connection (rows as sqlite3.Row)."""
+    # Connections move between greenlets, but a pooled one is only ever used by one at a time
+    conn = sqlite3.connect(db_path, check_same_thread=False, factory=factory)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def acquire(db_path, factory=sqlite3.Connection):
+    """Takes an idle connection of class factory from the pool, or opens a new one."""
+    with _lock:
+        idle = _idle.get((db_path, factory))
+        if idle:
+            return idle.pop()
+    return connect(db_path, factory)
+
+def release(conn, db_path):
+    """Returns a connection to the pool. Open transactions are rolled back,
+    connections that were closed by the caller are dropped.
+    """
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.ProgrammingError:
+        return # Already closed
+
+    with _lock:
+        idle = _idle.setdefault((db_path, type(conn)), [])
+        if len(idle) < MAX_IDLE_CONNECTIONS:
+            idle.append(conn)
+            return
+    conn.close()
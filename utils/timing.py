@@ -0,0 +1,216 @@
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from gevent import monkey
+
+# Request timing for the web app: latency histograms per endpoint (and per
+# player_api action), each with the time spent in the phases below. Code marks
+# its phases with `with phase('upstream'): ...`; phases nest, the inner one pauses
+# the outer (times are exclusive). Whatever isn't in a phase counts as 'other'.
+# Times are to the start of the response: a streamed body isn't included.
+PHASES = ('auth', 'db', 'upstream', 'serialize')
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', '1000'))
+SLOW_LOG_EXCLUDED = {'views.admin_profile'} # Slow on purpose
+
+# Key=endpoint name, Value=EndpointStats
+endpoint_stats = {}
+
+class RequestTiming:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.stack = [] # [name, started] of the running phases, innermost last
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self.stack:
+            outer = self.stack[-1]
+            self.phases[outer[0]] += now - outer[1]
+        self.stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        name, started = self.stack.pop()
+        self.phases[name] += now - started
+        if self.stack:
+            self.stack[-1][1] = now
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1) # Last one: above the largest bound
+        self.phases = dict.fromkeys(PHASES + ('other',), 0.0)
+
+    def add(self, elapsed_ms, phases_ms):
+        self.count += 1
+        self.total += elapsed_ms
+        self.max = max(self.max, elapsed_ms)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        for name, value in phases_ms.items():
+            self.phases[name] += value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of requests (ms)."""
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return HISTOGRAM_BUCKETS_MS[i] if i < len(HISTOGRAM_BUCKETS_MS) else round(self.max, 1)
+        return 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0,
+            "max_ms": round(self.max, 1),
+            "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95), "p99_ms": self.percentile(0.99),
+            "phases_avg_ms": {name: round(value / self.count, 2) if self.count else 0 for name, value in self.phases.items()},
+            # [upper bound in ms, count], the last bucket is unbounded
+            "histogram": [[bound, count] for bound, count in zip(HISTOGRAM_BUCKETS_MS + ('inf',), self.buckets)],
+        }
+
+@contextmanager
+def phase(name):
+    """Counts the time of the block to phase `name` of the current request (if any)."""
+    timing = g.get('timing') if has_request_context() else None
+    if timing is None:
+        yield
+        return
+    timing.enter(name)
+    try:
+        yield
+    finally:
+        timing.exit()
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        with phase('db'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with phase('db'):
+            return super().executemany(*args)
+
+    def fetchone(self):
+        with phase('db'):
+            return super().fetchone()
+
+    def fetchall(self):
+        with phase('db'):
+            return super().fetchall()
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements count to the 'db' phase (rows read by iterating
+    a cursor don't, they count to whatever consumes them)."""
+    def execute(self, *args):
+        return self.cursor(TimedCursor).execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor(TimedCursor).executemany(*args)
+
+    def commit(self):
+        with phase('db'):
+            return super().commit()
+
+def endpoint_key():
+    if request.endpoint == 'streaming.player_api':
+        return f"player_api:{request.values.get('action') or 'login'}"
+    return request.endpoint or '<404>'
+
+def before_request():
+    g.timing = RequestTiming()
+
+def after_request(response):
+    timing = g.pop('timing', None)
+    if timing is None:
+        return response
+    elapsed_ms = (time.perf_counter() - timing.start) * 1000
+    phases_ms = {name: value * 1000 for name, value in timing.phases.items()}
+    phases_ms['other'] = max(0.0, elapsed_ms - sum(phases_ms.values()))
+    key = endpoint_key()
+    stats = endpoint_stats.get(key)
+    if stats is None:
+        stats = endpoint_stats[key] = EndpointStats()
+    stats.add(elapsed_ms, phases_ms)
+
+    if elapsed_ms >= SLOW_REQUEST_MS and request.endpoint not in SLOW_LOG_EXCLUDED:
+        breakdown = ', '.join(f"{name} {value:.0f}ms" for name, value in phases_ms.items() if value >= 1) or 'no phase over 1ms'
+        logging.getLogger('flask.app').warning(
+            f"[Timing] Slow request: {request.method} {request.path} ({key}) took {elapsed_ms:.0f}ms ({breakdown})."
+        )
+    return response
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+
+def get_stats():
+    return {key: stats.to_dict() for key, stats in sorted(endpoint_stats.items())}
+
+# --- Sampling Profiler ---
+# A native thread (not a greenlet) samples the stack of the main thread, where all
+# greenlets run, every PROFILE_INTERVAL. Time the hub spends waiting shows up as
+# gevent's hub frames. Output is the "collapsed" format of flamegraph.pl/speedscope.
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+get_native_ident = monkey.get_original('_thread', 'get_ident')
+native_sleep = monkey.get_original('time', 'sleep')
+profile_running = False
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def sample_stacks(seconds, wait):
+    """Samples the stacks of the calling thread for `seconds`, calling wait(seconds)
+    meanwhile (gevent.sleep: other greenlets run and get sampled). Returns a Counter
+    of collapsed stacks (root first, ';'-separated) or None if a profile is already running.
+    """
+    global profile_running
+    if profile_running:
+        return None
+    profile_running = True
+    target = get_native_ident()
+    samples = Counter()
+    state = {'stop': False, 'done': False}
+
+    def sampler():
+        while not state['stop']:
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                samples[';'.join(reversed(stack))] += 1
+            native_sleep(PROFILE_INTERVAL)
+        state['done'] = True
+
+    try:
+        start_native_thread(sampler, ())
+        wait(seconds)
+    finally:
+        state['stop'] = True
+        while not state['done']:
+            native_sleep(PROFILE_INTERVAL)
+        profile_running = False
+    return samples
+
+def collapsed(samples):
+    return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
@@ -1,11 +1,20 @@
 from flask import (
-    Blueprint, render_template, request, jsonify, current_app, g, abort, redirect, url_for, flash
+    Blueprint, render_template, request, jsonify, current_app, g, abort, redirect, url_for, flash, Response
 )
 import datetime
+import gevent
+from gevent.event import Event
+import json
 import sqlite3
 import logging
 import os
-from db import get_db, get_all_settings
+import time
+import db
+from db import get_db, get_all_settings, invalidate_settings, INSTANCE_FOLDER
+from utils import sqlite_pool
+from utils.log_ring import LogRing, make_filter
+from utils.logs import dropped_records
+from utils import timing
 
 bp = Blueprint('views', __name__, url_prefix='')
 
@@ -70,29 +79,111 @@ def admin_update_user(user_id):
     flash(f'User {user_id} updated.', 'success')
     return redirect(url_for('views.admin_dashboard'))
 
+# --- Admin Logs ---
+# The log ring (instance/logs.ring) holds the recent records of the web app and all
+# pollers (see utils/log_ring.py). The page pages back through it via /api and
+# tails it via /stream (server-sent events).
+LOG_RING_PATH = os.path.join(INSTANCE_FOLDER, 'logs.ring')
+LOG_PAGE_MAX = 500
+LOG_TAIL_POLL = 1.0
+LOG_TAIL_KEEPALIVE = 15
+log_ring = None
+
+def get_log_ring():
+    global log_ring
+    if log_ring is None:
+        log_ring = LogRing(LOG_RING_PATH)
+    return log_ring
+
+def get_log_filter():
+    return make_filter(
+        level=request.args.get('level'),
+        component=request.args.get('component'),
+        channel=request.args.get('channel'),
+        text=request.args.get('q')
+    )
+
 @bp.route('/admin/logs2') # Use new route to avoid potential conflicts/cache
 def admin_logs():
     if not g.user or not g.user['is_admin']:
         abort(403)
-        
-    log_path = os.path.join(current_app.instance_path, 'app.log')
-    log_content = ""
-    
-    if os.path.exists(log_path):
-        try:
-            with open(log_path, 'r', encoding='utf-8') as f:
-                # Read last 500 lines efficiently-ish
-                # For now just read last 50KB to prevent huge loads
-                stat = os.stat(log_path)
-                if stat.st_size > 50000:
-                    f.seek(stat.st_size - 50000)
-                log_content = f.read()
-        except Exception as e:
-            log_content = f"Error reading log file: {e}"
-    else:
-        log_content = "Log file not found (yet)."
-        
-    return render_template('admin_logs.html', log_content=log_content)
+    return render_template('admin_logs.html')
+
+@bp.route('/admin/logs2/api')
+def admin_logs_api():
+    """Filtered log entries, newest first. Paging: ?before=<next_before of the previous page>."""
+    if not g.user or not g.user['is_admin']:
+        abort(403)
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 200, type=int), LOG_PAGE_MAX)
+    ring = get_log_ring()
+    entries = ring.read(before=before, limit=limit, match=get_log_filter())
+    return jsonify({
+        "entries": entries,
+        "next_before": entries[-1]['seq'] if len(entries) == limit else None,
+        "last_seq": ring.next_seq() - 1,
+        "dropped": dropped_records()
+    })
+
+@bp.route('/admin/logs2/stream')
+def admin_logs_stream():
+    """Live tail as server-sent events, starting after ?after= (or Last-Event-ID)."""
+    if not g.user or not g.user['is_admin']:
+        abort(403)
+    ring = get_log_ring()
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    if after is None:
+        after = ring.next_seq() - 1
+    match = get_log_filter()
+
+    def generate():
+        last_seq = after
+        idle = 0
+        while True:
+            end = ring.next_seq()
+            if end - 1 > last_seq:
+                for seq in range(max(last_seq + 1, end - ring.slots), end):
+                    entry = ring.get(seq)
+                    if entry and match(entry):
+                        yield f"id: {seq}\ndata: {json.dumps(entry)}\n\n"
+                last_seq = end - 1
+                idle = 0
+            else:
+                idle += LOG_TAIL_POLL
+                if idle >= LOG_TAIL_KEEPALIVE:
+                    yield ": keepalive\n\n"
+                    idle = 0
+            gevent.sleep(LOG_TAIL_POLL)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- Admin Timing ---
+@bp.route('/admin/timing')
+def admin_timing():
+    """Latency histograms per endpoint / player_api action, with phase averages."""
+    if not g.user or not g.user['is_admin']:
+        abort(403)
+    return jsonify({"slow_request_ms": timing.SLOW_REQUEST_MS, "endpoints": timing.get_stats()})
+
+@bp.route('/admin/profile')
+def admin_profile():
+    """Samples the web process for ?seconds= (default 10) and returns the collapsed
+    stacks (flamegraph.pl, speedscope)."""
+    if not g.user or not g.user['is_admin']:
+        abort(403)
+    seconds = max(1, min(request.args.get('seconds', 10, type=int), timing.PROFILE_MAX_SECONDS))
+    current_app.logger.warning(f"[Profile] Sampling profiler started by '{g.user['username']}' for {seconds}s.")
+    samples = timing.sample_stacks(seconds, gevent.sleep)
+    if samples is None:
+        return "A profile is already running.", 409
+    response = Response(timing.collapsed(samples), mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename="profile-{int(time.time())}.collapsed"'
+    return response
 
 @bp.route('/admin/settings', methods=['POST'])
 def admin_save_settings():
@@ -147,6 +238,7 @@ def admin_save_settings():
             save('ringbuffer_size', data.get('ringbuffer_size', '16777216'))
 
         conn.commit()
+        invalidate_settings()
         
         # Apply Log Level
         if new_level == 'error':
@@ -225,6 +317,108 @@ def delete_channel(channel_id):
     current_app.logger.info(f"[WebAPI] Channel {channel_id} deleted successfully.")
     return jsonify({'success': 'Channel deleted'}), 200
 
+# --- Live Status Events ---
+# Triggers log every status change the poller writes to live_streams, and every
+# channel added or removed, to channel_events (migrations.py, m011). One watcher
+# greenlet per process polls the newest event and wakes the open streams, which
+# then read the events of their user. Events are kept for CHANNEL_EVENTS_TTL
+# (poller.py); clients that were away longer get a fresh snapshot.
+CHANNEL_EVENTS_POLL = 1.0
+CHANNEL_EVENTS_KEEPALIVE = 15
+channel_events_seq = 0
+channel_events_changed = Event()  # Replaced by a new Event after every change
+channel_events_watcher = None
+
+def query_channel_events(query, params=()):
+    # Streams outlive their request (and its g.db), so every read takes its own pooled connection
+    conn = sqlite_pool.acquire(db.DB_PATH)
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        sqlite_pool.release(conn, db.DB_PATH)
+
+def watch_channel_events():
+    global channel_events_seq, channel_events_changed
+    while True:
+        try:
+            seq = query_channel_events("SELECT COALESCE(MAX(seq), 0) FROM channel_events")[0][0]
+        except sqlite3.Error as e:
+            logging.error(f"[WebAPI] Failed to read channel events: {e}")
+            seq = channel_events_seq
+        if seq != channel_events_seq:
+            channel_events_seq = seq
+            changed, channel_events_changed = channel_events_changed, Event()
+            changed.set()
+        gevent.sleep(CHANNEL_EVENTS_POLL)
+
+def channel_status(row):
+    return {
+        'id': row['id'], 'login_name': row['login_name'], 'display_name': row['display_name'],
+        'is_live': bool(row['is_live']), 'stream_title': row['stream_title'], 'stream_game': row['stream_game'],
+        'viewer_count': row['viewer_count']
+    }
+
+@bp.route('/api/channels/events')
+def channel_events_stream():
+    """The user's channels with their live status as server-sent events: a "snapshot"
+    of all channels, then a "delta" (changed channels, removed logins) per change.
+    Resumes after Last-Event-ID (or ?after=) if those events are still kept.
+    """
+    global channel_events_watcher
+    if channel_events_watcher is None:
+        channel_events_watcher = gevent.spawn(watch_channel_events)
+    user_id = g.user['id']
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+
+    def snapshot():
+        oldest, newest = query_channel_events(
+            "SELECT (SELECT MIN(seq) FROM channel_events), (SELECT COALESCE(MAX(seq), 0) FROM channel_events)"
+        )[0]
+        if after is not None and oldest is not None and oldest - 1 <= after <= newest:
+            return after, None
+        rows = query_channel_events("""
+            SELECT c.id, c.login_name, l.display_name, l.is_live, l.stream_title, l.stream_game, l.viewer_count
+            FROM channels c LEFT JOIN live_streams l ON l.login_name = c.login_name
+            WHERE c.user_id = ? ORDER BY c.login_name
+        """, (user_id,))
+        return newest, f"id: {newest}\nevent: snapshot\ndata: {json.dumps([channel_status(row) for row in rows])}\n\n"
+
+    def generate():
+        last_seq, message = snapshot()
+        if message:
+            yield message
+        while True:
+            # Taken before the check: a change after it sets this event
+            changed = channel_events_changed
+            if channel_events_seq <= last_seq:
+                if not changed.wait(CHANNEL_EVENTS_KEEPALIVE):
+                    yield ": keepalive\n\n"
+                continue
+            seq = channel_events_seq
+            # Events for everyone following a login (user_id NULL) or for this user's channel list
+            rows = query_channel_events("""
+                SELECT e.login_name, c.id, l.display_name, l.is_live, l.stream_title, l.stream_game, l.viewer_count
+                FROM channel_events e
+                LEFT JOIN channels c ON c.login_name = e.login_name AND c.user_id = ?1
+                LEFT JOIN live_streams l ON l.login_name = e.login_name
+                WHERE e.seq > ?2 AND e.seq <= ?3 AND (e.user_id = ?1 OR (e.user_id IS NULL AND c.id IS NOT NULL))
+                GROUP BY e.login_name
+            """, (user_id, last_seq, seq))
+            last_seq = seq
+            if rows:
+                delta = {
+                    'channels': [channel_status(row) for row in rows if row['id'] is not None],
+                    'removed': [row['login_name'] for row in rows if row['id'] is None]
+                }
+                yield f"id: {seq}\nevent: delta\ndata: {json.dumps(delta)}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @bp.route('/api/settings', methods=['GET'])
 def api_get_settings():
     """Loads settings for the Web UI. Merges global settings with user-specific keys."""
@@ -295,6 +489,7 @@ def api_save_settings():
         current_app.logger.info(f"[WebAPI] Updated settings for user {g.user['username']}.")
             
         conn.commit()
+        invalidate_settings()
         
         # *** BUG FIX & FEATURE: Dynamically adjust running app's log level ***
         if new_log_level_str == 'error':
@@ -308,8 +503,6 @@ def api_save_settings():
         conn.rollback()
         current_app.logger.error(f"[WebAPI] Failed to save settings: {e}")
         return jsonify({'error': f'Failed to save settings: {e}'}), 500
-    finally:
-        conn.close()
         
     current_app.logger.info(f"[WebAPI] Settings saved successfully.")
     return jsonify({'success': 'Settings saved!'}), 200